@@ -1,27 +1,43 @@
-import sqlite3 
-from datetime import datetime, date 
+import time
+from datetime import datetime, date, timedelta
 import tkinter as tk 
-from tkinter import ttk, messagebox 
-from PIL import Image, ImageTk 
-
-# Database file:
-FILE = "ecotrack.db"
+from tkinter import ttk, messagebox, filedialog
+
+from storage import (
+    COMPACT_BATCH,
+    DEFAULT_USER,
+    compactChunk,
+    createDtb,
+    db,
+    isArchived,
+    matchQuery,
+)
+from profiling import Laps, record, timed
+from worker import DataWorker
+from assets import photo
+from analytics import PERIODS, summaryView
+from budgets import alertText, budgetText, listAlerts, listBudgets, newAlerts
+from core import (
+    TRANSPORT,
+    GOODLIMIT,
+    OKLIMIT,
+    TODAY_ROWS,
+    fmtDate,
+    totalLimit,
+    checkLog,
+    streakShow,
+    addLogs,
+    deleteLogs,
+    undoLast,
+    redoLast,
+    todayView,
+    historyView,
+    refreshFactors,
+)
 
 LOGO = "logo.jpg"
 IMG = "pic.jpg"
 
-# Transport categories with emission elements like time taken and km traveled:
-TRANSPORT = {
-    "Travel: Car": {"unit": "km", "kg_per_unit": 0.192, "kg_per_hour": 0.30},
-    "Travel: Bus": {"unit": "km", "kg_per_unit": 0.105, "kg_per_hour": 0.10},
-    "Travel: Metro/Train": {"unit": "km", "kg_per_unit": 0.041, "kg_per_hour": 0.03},
-    "Travel: Motorcycle": {"unit": "km", "kg_per_unit": 0.090, "kg_per_hour": 0.15},
-}
-
-# Rating for the daily carbon footprints:
-GOODLIMIT = 6.0
-OKLIMIT = 12.0
-
 # Colors used across the code 
 LIGREEN = "#DFF5D8"
 DRGREEN = "#1F5F3B"
@@ -30,98 +46,27 @@ DARK = "#1B3A2F"
 BRGREEN = "#8CCF9A"
 
 
-def createDtb():
-    with sqlite3.connect(FILE) as conn:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                log_date TEXT NOT NULL,
-                category TEXT NOT NULL,
-                amount REAL NOT NULL,
-                duration_hours REAL NOT NULL DEFAULT 0,
-                kg_co2 REAL NOT NULL,
-                note TEXT
-            )
-            """
-        )
-        conn.commit()
-
-
-# Calculate CO2 emissions based on time and distance
-def Emissions(category: str, km: float, hr: float) -> float:
-    perunit = TRANSPORT[category]["kg_per_unit"]
-    perhr = TRANSPORT[category].get("kg_per_hour", 0.0)
-    return round((km * perunit) + (hr * perhr), 3)
-
-
-# Format date as YYYY-MM-DD
-def fmtDate(d: date) -> str:
-    return d.isoformat()
-
-
-# Return a rating based on daliy emission limits
-def totalLimit(total_kg: float) -> str:
-    if total_kg <= GOODLIMIT:
-        return "LOW (low footprint today)"
-    elif total_kg <= OKLIMIT:
-        return "OK (decent footprint today)"
-    else:
-        return "HIGH (very high footprint today, try reducing emissions)"
-
-
-# Convert hours input to float
-def crovertHours(s: str) -> float:
-    s = s.strip()
-    if not s:
-        return 0.0
-    try:
-        return float(s)
-    except ValueError:
-        raise ValueError("Time spent (hours) must be a number")
-
-# Calculating continuous streak of GOOD days (aka GOODLIMIT)
-def streakShow() -> int:
-    streak = 0
-    day = date.today()
-
-    with sqlite3.connect(FILE) as conn:
-        cur = conn.cursor()
-
-        while True:
-            day_s = fmtDate(day)
-            cur.execute(
-                "SELECT COUNT(*), COALESCE(SUM(kg_co2), 0) FROM logs WHERE log_date = ?",
-                (day_s,),
-            )
-            count, total = cur.fetchone()
-            total = float(total or 0.0)
-
-            # No logs => streak stops
-            if count == 0:
-                break
-
-            # Not a GOOD day => streak stops
-            if total > GOODLIMIT:
-                break
-
-            streak += 1
-            day = day.fromordinal(day.toordinal() - 1)  # previous day
-
-    return streak
-
-
 class Main(tk.Tk):  # Main EcoTrack User Interface window
-    def __init__(self):
+    def __init__(self, user_id=DEFAULT_USER):
+        self.started = time.perf_counter()
+        laps = Laps("startup")  # startup phase timings, when profiling is on
         super().__init__() # Intialize main window settings
+        self.user_id = user_id  # whose logs this window shows and adds to
 
         self.title("EcoTrack - Carbon Footprint Monitor") 
         self.geometry("920x560")
         self.minsize(880, 520)
 
         self.configure(bg=LIGREEN)
+        laps.lap("startup.tk")
         createDtb() 
+        refreshFactors()  # categories added to the factor registry join TRANSPORT
+        laps.lap("startup.createDtb")
+
+        # All later database work runs on this worker thread
+        self.worker = DataWorker(self, on_error=lambda e: messagebox.showerror("Error", str(e)))
+
+        laps.lap("startup.worker")
 
         # Style
         self.style = ttk.Style(self) # Green eco- friendly layout
@@ -168,6 +113,8 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
             background=[("active", "#F1F0D2"), ("pressed", "#E7E6C2")],
         )
 
+        laps.lap("startup.styles")
+
         # Title, slogan and the logo
         header = ttk.Frame(self, padding=12, style="Green.TFrame")
         header.pack(fill="x")
@@ -186,13 +133,10 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
             style="Green.TLabel",
         ).pack(side="left")
 
-        try:
-            img = Image.open(LOGO)
-            img = img.resize((70, 70))
-            self.co2_photo = ImageTk.PhotoImage(img)
-            ttk.Label(header, image=self.co2_photo, style="Green.TLabel").pack(side="right")
-        except Exception as e:
-            print("Logo not loaded:", e)
+        # Blank placeholders hold the images' space until loadImages fills them
+        self.co2_photo = tk.PhotoImage(width=70, height=70)
+        self.logo_lbl = ttk.Label(header, image=self.co2_photo, style="Green.TLabel")
+        self.logo_lbl.pack(side="right")
 
         # Tabs
         self.nb = ttk.Notebook(self)
@@ -200,18 +144,48 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
 
         self.tab_log = ttk.Frame(self.nb, padding=12, style="Green.TFrame")
         self.tab_history = ttk.Frame(self.nb, padding=12, style="Green.TFrame")
+        self.tab_analytics = ttk.Frame(self.nb, padding=12, style="Green.TFrame")
         self.tab_quiz = ttk.Frame(self.nb, padding=12, style="Green.TFrame")
 
         self.nb.add(self.tab_log, text="Add logs")
         self.nb.add(self.tab_history, text="History")
+        self.nb.add(self.tab_analytics, text="Analytics")
         self.nb.add(self.tab_quiz, text="Quiz")
 
         self.addLogs()
         self.historyBttn()
+        self.analyticsTab()
         self.quiz()
+        laps.lap("startup.widgets")
+
+        # Analytics is recomputed whenever its tab is opened, so it follows new logs
+        self.nb.bind("<<NotebookTabChanged>>", self.tabChanged)
 
         self.historyLoad()
         self.upt()
+        self.compact()
+        self.checkAlerts()
+        laps.lap("startup.firstQueries")
+
+        # Images are loaded once the first frame is on screen
+        self.after_idle(self.after, 0, self.firstFrame)
+
+    def firstFrame(self):
+        record("startup.firstFrame", "startup", self.started, time.perf_counter() - self.started)
+        self.loadImages()
+
+    # Swap the placeholders for the logo and picture (scaled copies are cached on disk)
+    @timed
+    def loadImages(self):
+        for attr, label, path, size in (
+            ("co2_photo", self.logo_lbl, LOGO, (70, 70)),
+            ("today_icon_photo", self.today_icon_lbl, IMG, (240, 240)),
+        ):
+            try:
+                setattr(self, attr, photo(path, size, self))
+                label.configure(image=getattr(self, attr))
+            except Exception as e:
+                print("Image not loaded:", e)
 
     # Collecting user awareness and feedback
     def quiz(self):
@@ -276,6 +250,7 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
         self.btn(btn_row, "Clear", self.clearQuiz, side="left", padx=8)
 
     # Checking Quiz answers and display results
+    @timed
     def submitQuiz(self):
         if not self.q1_var.get() or not self.q2_var.get() or not self.q3_var.get():
             messagebox.showerror("Quiz", "Please answer all 3 questions")
@@ -320,8 +295,36 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
         ttk.Button(bg, text=text, style="Yellow.TButton", command=command).pack()
         return bg
 
+    # Show the alerts raised since the last look, e.g. by a save or the CLI.
+    # Not keyed: a coalesced job's result is dropped, and these are marked seen.
+    @timed
+    def checkAlerts(self):
+        self.worker.submit(newAlerts, self.user_id, done=self.showAlerts)
+
+    def showAlerts(self, alerts):
+        if alerts:
+            messagebox.showwarning("Budget alert", "\n\n".join(alertText(a) for a in alerts))
+
+    def showBudgets(self):
+        self.worker.submit(
+            lambda: (listBudgets(self.user_id), listAlerts(self.user_id, 5)), key="budgets", done=self.budgetsMsg
+        )
+
+    def budgetsMsg(self, result):
+        budgets, alerts = result
+        lines = [
+            f"{budgetText(period, cat, limit_kg).capitalize()}: {kg:.3f} kg so far"
+            for _, period, cat, limit_kg, _, _, kg in budgets
+        ] or ["No budgets yet. Add one with:\necotrack.py add-budget week 20 --category car"]
+        if alerts:
+            lines += ["", "Latest alerts:"] + [alertText(a) for a in alerts]
+        messagebox.showinfo("Budgets", "\n".join(lines))
+
     def showStreak(self):
-        streak = streakShow()
+        self.worker.submit(streakShow, self.user_id, key="streak", done=self.streakMsg)
+
+    @timed
+    def streakMsg(self, streak):
         if streak == 0:
             msg = (
                 "Streak: 0\n\n"
@@ -385,6 +388,7 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
 
         self.btn(btns, "Add", self.svLog, side="left")
         self.btn(btns, "Clear", self.reset, side="left", padx=8)
+        self.btn(btns, "From GPS track…", self.fromTrack, side="left")
         # Preview section showing today's total emissions and rating
         preview = ttk.LabelFrame(right, text="Today’s total + rating", padding=12, style="Green.TLabelframe")
         preview.pack(fill="x")
@@ -409,6 +413,13 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
         )
         self.streak_btn.pack(anchor="w", pady=(6, 0))
 
+        ttk.Button(
+            text_frame,
+            text="Budgets",
+            style="Yellow.TButton",
+            command=self.showBudgets,
+        ).pack(anchor="w", pady=(6, 0))
+
         self.limits_lbl = ttk.Label(
             text_frame,
             text=f"Limits: Good ≤ {GOODLIMIT} kg/day \n OK ≤ {OKLIMIT} kg/day \n High > {OKLIMIT}",
@@ -419,13 +430,9 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
         img_frame = ttk.Frame(row, style="Green.TFrame")
         img_frame.pack(side="right", fill="both", expand=True)
 
-        try:
-            icon = Image.open(IMG)
-            icon = icon.resize((240, 240))
-            self.today_icon_photo = ImageTk.PhotoImage(icon)
-            ttk.Label(img_frame, image=self.today_icon_photo, style="Green.TLabel").pack(anchor="e")
-        except Exception as e:
-            print("Image not loaded:", e)
+        self.today_icon_photo = tk.PhotoImage(width=240, height=240)
+        self.today_icon_lbl = ttk.Label(img_frame, image=self.today_icon_photo, style="Green.TLabel")
+        self.today_icon_lbl.pack(anchor="e")
 
         self.btn(preview, "Refresh", self.upt, side=None, anchor="w", pady=(10, 0))
 
@@ -434,6 +441,8 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
 
         cols = ("id", "category", "amount", "time", "kg")
         self.today_tree = ttk.Treeview(recent, columns=cols, show="headings", height=10)
+        self.today_day = None  # the day today_tree and today_total were loaded for
+        self.today_total = 0.0
 
         self.today_tree.heading("id", text="ID")
         self.today_tree.heading("category", text="Category")
@@ -456,6 +465,7 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
         self.unit_label.config(text=unit)
 
     # Reset the input fields to default values
+    @timed
     def reset(self):
         self.date_var.set(fmtDate(date.today()))
         self.cat_var.set(list(TRANSPORT.keys())[0])
@@ -464,67 +474,149 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
         self.note_var.set("")
         self.unitLabel()
 
-    # Validating the input and save the new log data to the database
-    def svLog(self):
-        try:
-            d = datetime.strptime(self.date_var.get().strip(), "%Y-%m-%d").date()
-            cat = self.cat_var.get()
-            if cat not in TRANSPORT:
-                raise ValueError("Invalid category.")
-
-            amount = float(self.amount_var.get())
-            if amount <= 0:
-                raise ValueError("Amount must be > 0.")
+    # Fill the form from the first trip in a GPX/GeoJSON file instead of typing
+    # distance and time in; the category is guessed from the trip's speeds
+    @timed
+    def fromTrack(self):
+        path = filedialog.askopenfilename(
+            title="Open GPS track", filetypes=[("GPS tracks", "*.gpx *.geojson *.json"), ("All files", "*")]
+        )
+        if path:
+            self.worker.submit(self.readTrack, path, done=self.trackRead)
 
-            hrs = crovertHours(self.time_var.get())
-            if hrs < 0:
-                raise ValueError("Time must be ≥ 0.")
+    # Runs on the worker; the track reader is only imported once it is used
+    def readTrack(self, path):
+        from tracks import firstTrip
 
-            kg = Emissions(cat, amount, hrs)
-            note = self.note_var.get().strip()
+        return firstTrip(path)
 
-            with sqlite3.connect(FILE) as conn:
-                cur = conn.cursor()
-                cur.execute(
-                    "INSERT INTO logs (log_date, category, amount, duration_hours, kg_co2, note) VALUES (?, ?, ?, ?, ?, ?)",
-                    (fmtDate(d), cat, amount, hrs, kg, note if note else None),
-                )
-                conn.commit()
+    def trackRead(self, trip):
+        day_s, cat, km, hours = trip
+        self.date_var.set(day_s)
+        self.cat_var.set(cat)
+        self.amount_var.set(f"{km:g}")
+        self.time_var.set(f"{hours:g}")
+        self.unitLabel()
 
-            # Inserting validated log into the database
-            messagebox.showinfo("Saved", f"Added: {kg:.3f} kg CO₂")
-            self.upt()
-            self.historyLoad()
-            self.reset()
+    # Validating the input and save the new log data to the database
+    @timed
+    def svLog(self):
+        try:
+            day_s, cat, amount, hrs = checkLog(
+                self.date_var.get(), self.cat_var.get(), self.amount_var.get(), self.time_var.get()
+            )
+            note = self.note_var.get().strip()
 
         except Exception as e:
             messagebox.showerror("Error", str(e))
+            return
+
+        # Inserting validated log into the database
+        log = (self.user_id, day_s, cat, amount, hrs, note)
+        self.worker.submit(self.writeLog, log, self.hist_pager, done=self.saved)
+
+    # Runs on the worker: insert the log, patch a copy of the open History
+    # pager with it and read the streak (both O(1)), so the views never reload
+    # after a save. The pager on screen is only swapped on the Tk thread.
+    def writeLog(self, log, pager):
+        user_id, day_s, cat, amount, hrs, note = log
+        (log_id, kg), = addLogs([log])
+        row = (day_s, cat, amount, hrs, kg, note, log_id)
+        patched = None
+        if pager is not None:
+            patched = pager.copy()
+            patched.insert(row, user_id)
+        return row, (pager, patched), streakShow(user_id)
+
+    @timed
+    def saved(self, result):
+        row, pagers, streak = result
+        messagebox.showinfo("Saved", f"Added: {row[4]:.3f} kg CO₂")
+        self.todayChanged(row, 1, streak)
+        self.histChanged(*pagers)
+        self.reset()
+        self.checkAlerts()
+
+    # Runs on the worker: delete the logs in one transaction and patch the
+    # pager, like writeLog. Past a page of rows the pager is dropped instead and
+    # History reloads, which is cheaper than shifting every cached page.
+    def dropLogs(self, ids, pager):
+        rows = [row for _, row in deleteLogs(ids, self.user_id)]
+        if not rows:
+            archived = [i for i in ids if isArchived(i)]
+            if archived:
+                raise ValueError(f"Log ID {archived[0]} is archived and cannot be deleted.")
+            return None
+        patched = None
+        if pager is not None and len(rows) <= pager.PAGE:
+            patched = pager.copy()
+            for row in rows:
+                patched.remove(row, self.user_id)
+        return rows, (pager, patched), streakShow(self.user_id)
+
+    # Runs on the worker: one batch of compaction; the rest is queued behind
+    # whatever else the worker has to do
+    def compactStep(self):
+        return compactChunk(db())
+
+    def compact(self):
+        self.worker.submit(self.compactStep, key="compact", done=self.compacted)
+
+    def compacted(self, purged):
+        if purged == COMPACT_BATCH:
+            self.after_idle(self.compact)
 
     # For updating today's total CO2, rating, streak, and the table
+    @timed
     def upt(self):
-        today = fmtDate(date.today())
-        with sqlite3.connect(FILE) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT category, amount, duration_hours, kg_co2, id FROM logs WHERE log_date = ? ORDER BY id DESC",
-                (today,),
-            )
-            rows = cur.fetchall()
-
-        # Sum of the CO2 emissions for today (kg_CO2 column)
-        total = round(sum(r[3] for r in rows), 3)
-        self.today_total_lbl.config(text=f"{total:.3f} kg CO₂ today")
-        self.today_rating_lbl.config(text=f"Rating: {totalLimit(total)}")
-
-
-        s = streakShow()
+        self.worker.submit(todayView, self.user_id, key="today", done=self.showToday)
+
+    @timed
+    def showToday(self, view):
+        total, s, rows = view
+        self.today_day = fmtDate(date.today())
+        self.today_total = total
+        self.todayLabels(s)
+
+        # Items are keyed by log id; only rows that changed are touched
+        ids = [str(r[4]) for r in rows]
+        keep = set(ids)
+        gone = [item for item in self.today_tree.get_children() if item not in keep]
+        if gone:
+            self.today_tree.delete(*gone)
+
+        for index, (cat, amount, hrs, kg, log_id) in enumerate(rows):
+            values = (log_id, cat, f"{amount:g}", f"{hrs:g}", f"{kg:.3f}")
+            if self.today_tree.exists(ids[index]):
+                self.today_tree.item(ids[index], values=values)
+                self.today_tree.move(ids[index], "", index)
+            else:
+                self.today_tree.insert("", index, iid=ids[index], values=values)
+
+    def todayLabels(self, s):
+        self.today_total_lbl.config(text=f"{self.today_total:.3f} kg CO₂ today")
+        self.today_rating_lbl.config(text=f"Rating: {totalLimit(self.today_total)}")
         self.streak_btn.config(text=f"Streak: {s} day{'s' if s != 1 else ''}")
 
-        for item in self.today_tree.get_children():
-            self.today_tree.delete(item)
-
-        for cat, amount, hrs, kg, log_id in rows[:50]:
-            self.today_tree.insert("", "end", values=(log_id, cat, f"{amount:g}", f"{hrs:g}", f"{kg:.3f}"))
+    # Apply one saved (sign 1) or deleted (sign -1) log to the Add logs tab:
+    # today's total moves by its kg and only its own row is added or removed
+    @timed
+    def todayChanged(self, row, sign, streak):
+        if self.today_day is None:
+            self.upt()  # the first load has not arrived yet
+            return
+        if row[0] == self.today_day:
+            self.today_total = round(self.today_total + sign * row[4], 3)
+            iid = str(row[6])
+            if sign > 0:
+                values = (row[6], row[1], f"{row[2]:g}", f"{row[3]:g}", f"{row[4]:.3f}")
+                self.today_tree.insert("", 0, iid=iid, values=values)
+                extra = self.today_tree.get_children()[TODAY_ROWS:]
+                if extra:
+                    self.today_tree.delete(*extra)
+            elif self.today_tree.exists(iid):
+                self.today_tree.delete(iid)
+        self.todayLabels(streak)
 
     # Creating history tab controls and its layout
     def historyBttn(self):
@@ -536,8 +628,17 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
         self.filter_date_var = tk.StringVar(value="")
         ttk.Entry(top, textvariable=self.filter_date_var, width=16).pack(side="left", padx=8)
 
+        ttk.Label(top, text="Search notes:", style="Green.TLabel").pack(side="left")
+
+        self.search_var = tk.StringVar(value="")
+        search = ttk.Entry(top, textvariable=self.search_var, width=22)
+        search.pack(side="left", padx=8)
+        search.bind("<Return>", lambda e: self.historyLoad())
+
         self.btn(top, "Apply", self.historyLoad, side="left")
-        self.btn(top, "Delete Log", self.deleteLog, side="left", padx=8)
+        self.btn(top, "Delete Selected", self.deleteLog, side="left", padx=8)
+        self.btn(top, "Undo", self.undo, side="left")
+        self.btn(top, "Redo", self.redo, side="left", padx=8)
 
         summary = ttk.Frame(self.tab_history, style="Green.TFrame")
         summary.pack(fill="x", pady=(10, 0))
@@ -545,8 +646,11 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
         self.history_total_lbl = ttk.Label(summary, text="—", font=("Segoe UI", 11, "bold"), style="Green.TLabel")
         self.history_total_lbl.pack(anchor="w")
 
+        table = ttk.Frame(self.tab_history, style="Green.TFrame")
+        table.pack(fill="both", expand=True, pady=(10, 0))
+
         cols = ("date", "category", "amount", "time", "kg", "note", "id")
-        self.hist_tree = ttk.Treeview(self.tab_history, columns=cols, show="headings")
+        self.hist_tree = ttk.Treeview(table, columns=cols, show="headings")
 
         self.hist_tree.heading("date", text="Date")
         self.hist_tree.heading("category", text="Category")
@@ -564,62 +668,350 @@ class Main(tk.Tk):  # Main EcoTrack User Interface window
         self.hist_tree.column("note", width=220, anchor="w")
         self.hist_tree.column("id", width=70, anchor="e")
 
-        self.hist_tree.pack(fill="both", expand=True, pady=(10, 0))
-
-    # For loading the logs from the database based on the date filter
+        # The tree only ever holds the rows that fit on screen; the scrollbar
+        # and mouse wheel move a window over the pager instead of the tree
+        self.hist_scroll = ttk.Scrollbar(table, orient="vertical", command=self.histScroll)
+        self.hist_scroll.pack(side="right", fill="y")
+        self.hist_tree.pack(side="left", fill="both", expand=True)
+
+        self.hist_pager = None
+        self.hist_first = 0  # index of the top visible row
+        self.hist_visible = 20  # rows that fit, updated on resize
+        self.hist_selected = set()  # selected log ids, kept while scrolled out of view
+
+        self.hist_tree.bind("<Configure>", self.histResize)
+        self.hist_tree.bind("<<TreeviewSelect>>", self.histSelect)
+        self.hist_tree.bind("<MouseWheel>", lambda e: self.histScroll("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.hist_tree.bind("<Button-4>", lambda e: self.histScroll("scroll", -1, "units"))
+        self.hist_tree.bind("<Button-5>", lambda e: self.histScroll("scroll", 1, "units"))
+        # Undo keys only act on the History table, never on text being typed
+        # into an entry, where Ctrl+Z means undo the typing
+        self.hist_tree.bind("<Control-z>", lambda e: self.undo())
+        self.hist_tree.bind("<Control-y>", lambda e: self.redo())
+        self.hist_tree.bind("<Control-Shift-Z>", lambda e: self.redo())
+
+    # For loading the logs from the database based on the date filter and note search
+    @timed
     def historyLoad(self):
         f = self.filter_date_var.get().strip()
-        query = """SELECT log_date, category, amount, duration_hours, kg_co2, COALESCE(note,''), id FROM logs"""
-        params = ()
         if f:
             try:
                 datetime.strptime(f, "%Y-%m-%d")
             except Exception:
                 messagebox.showerror("Error", "Filter date must be YYYY-MM-DD or blank.")
                 return
-            query += " WHERE log_date = ?"
-            params = (f,)
-        query += " ORDER BY log_date DESC, id DESC"
-
-        with sqlite3.connect(FILE) as conn:
-            cur = conn.cursor()
-            cur.execute(query, params)
-            rows = cur.fetchall()
-
-        for item in self.hist_tree.get_children():
-            self.hist_tree.delete(item)
-
-        total = 0.0
-        for r in rows:
-            total += r[4]
-            self.hist_tree.insert(
-                "",
-                "end",
-                values=(r[0], r[1], f"{r[2]:g}", f"{r[3]:g}", f"{r[4]:.3f}", r[5], r[6]),
-            )
 
-        self.history_total_lbl.config(text=f"Total shown: {total:.3f} kg CO₂")
+        text = self.search_var.get().strip()
+        if text:
+            try:
+                matchQuery(text)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            # Best matches first, from the full-text index on notes
+            self.worker.submit(historyView, f or None, self.user_id, text, key="history", done=self.showHistory)
+            return
 
-    # For deleting the selected log data after the confirmation
+        # Count and total are SQL aggregates; rows are paged in as they are shown.
+        # A filter applied before comes back from the query cache with its pages.
+        self.worker.submit(historyView, f or None, self.user_id, key="history", done=self.showHistory)
+
+    @timed
+    def showHistory(self, pager):
+        self.hist_pager = pager
+        self.hist_first = 0
+        self.hist_selected.clear()
+        self.histRender()
+
+        self.history_total_lbl.config(text=f"Total shown: {pager.total:.3f} kg CO₂")
+
+    # A write patched a copy of the pager: swap it in and redraw the window
+    # from its cached pages
+    @timed
+    def histChanged(self, pager, patched):
+        if patched is None or pager is not self.hist_pager:
+            self.historyLoad()  # a new filter was applied meanwhile
+            return
+        self.hist_pager = patched
+        self.history_total_lbl.config(text=f"Total shown: {patched.total:.3f} kg CO₂")
+        self.histRender()
+
+    # Fetch the rows of the current window on the worker, then show them
+    @timed
+    def histRender(self):
+        if self.hist_pager is None:
+            return
+        last = max(0, self.hist_pager.count - self.hist_visible)
+        self.hist_first = max(0, min(self.hist_first, last))
+        pager, first = self.hist_pager, self.hist_first
+        self.worker.submit(
+            pager.rows,
+            first,
+            self.hist_visible,
+            key="history-window",
+            done=lambda rows: self.histShow(pager, first, rows),
+        )
+
+    # Show a window of rows, reusing tree items keyed by log id
+    @timed
+    def histShow(self, pager, first, rows):
+        if pager is not self.hist_pager:
+            return  # the filter was re-applied while these rows were loading
+
+        ids = [str(r[6]) for r in rows]
+        keep = set(ids)
+        gone = [item for item in self.hist_tree.get_children() if item not in keep]
+        if gone:
+            self.hist_tree.delete(*gone)
+
+        for index, r in enumerate(rows):
+            values = (r[0], r[1], f"{r[2]:g}", f"{r[3]:g}", f"{r[4]:.3f}", r[5], r[6])
+            if self.hist_tree.exists(ids[index]):
+                self.hist_tree.item(ids[index], values=values)
+                self.hist_tree.move(ids[index], "", index)
+            else:
+                self.hist_tree.insert("", index, iid=ids[index], values=values)
+
+        self.hist_tree.selection_set([i for i in ids if i in self.hist_selected])
+        self.hist_tree.yview_moveto(0)
+
+        count = pager.count
+        if count:
+            self.hist_scroll.set(first / count, min(1.0, (first + len(rows)) / count))
+        else:
+            self.hist_scroll.set(0, 1)
+
+    # Scrollbar/wheel callback: ("moveto", fraction) or ("scroll", n, "units"/"pages")
+    @timed
+    def histScroll(self, action, amount, what=None):
+        if self.hist_pager is None:
+            return "break"
+        if action == "moveto":
+            self.hist_first = int(float(amount) * self.hist_pager.count)
+        else:
+            step = self.hist_visible if what == "pages" else 3
+            self.hist_first += int(amount) * step
+        self.histRender()
+        return "break"
+
+    # Fit the window to the tree's height whenever it is resized
+    @timed
+    def histResize(self, event):
+        rowheight = int(self.style.lookup("Treeview", "rowheight") or 20)
+        visible = max(1, (event.height - 24) // rowheight)
+        if visible != self.hist_visible:
+            self.hist_visible = visible
+            self.histRender()
+
+    # Selected log ids survive scrolling: only rows on screen can change state
+    @timed
+    def histSelect(self, event=None):
+        shown = set(self.hist_tree.get_children())
+        self.hist_selected = (self.hist_selected - shown) | set(self.hist_tree.selection())
+
+    # For deleting every selected log, including ones scrolled out of view,
+    # after one confirmation and in one transaction
+    @timed
     def deleteLog(self):
-        sel = self.hist_tree.selection()
-        if not sel:
+        self.histSelect()
+        if not self.hist_selected:
             messagebox.showinfo("Delete", "Select a log first.")
             return
 
-        values = self.hist_tree.item(sel[0], "values")
-        log_id = values[-1]
-
-        if not messagebox.askyesno("Confirm", f"Delete log ID {log_id}?"):
+        ids = sorted(int(i) for i in self.hist_selected)
+        what = f"log ID {ids[0]}? Undo brings it" if len(ids) == 1 else f"{len(ids)} selected logs? Undo brings them"
+        if not messagebox.askyesno("Confirm", f"Delete {what} back."):
             return
+        self.worker.submit(self.dropLogs, ids, self.hist_pager, done=self.removed)
 
-        with sqlite3.connect(FILE) as conn:
-            cur = conn.cursor()
-            cur.execute("DELETE FROM logs WHERE id = ?", (log_id,))
-            conn.commit()
-
+    @timed
+    def removed(self, result):
+        if result is None:
+            self.historyLoad()  # already gone, e.g. deleted from the CLI
+            self.upt()
+            return
+        rows, pagers, streak = result
+        self.hist_selected -= {str(row[6]) for row in rows}
+        if len(rows) > TODAY_ROWS:
+            self.upt()
+        else:
+            for row in rows:
+                self.todayChanged(row, -1, streak)
+        self.histChanged(*pagers)
+        self.compact()
+
+    @timed
+    def undo(self):
+        self.worker.submit(undoLast, self.user_id, done=lambda done: self.undone("undo", done))
+
+    @timed
+    def redo(self):
+        self.worker.submit(redoLast, self.user_id, done=lambda done: self.undone("redo", done))
+
+    # Undo and redo can touch any number of logs on any days, so both tabs reload
+    @timed
+    def undone(self, what, done):
+        if done is None:
+            messagebox.showinfo(what.capitalize(), f"Nothing to {what}.")
+            return
         self.historyLoad()
         self.upt()
+        self.compact()
+        self.checkAlerts()
+
+    @timed
+    def tabChanged(self, event=None):
+        if self.nb.select() == str(self.tab_analytics):
+            self.analyticsLoad()
+
+    # Creating analytics tab controls: date range, period, chart and tables
+    def analyticsTab(self):
+        top = ttk.Frame(self.tab_analytics, style="Green.TFrame")
+        top.pack(fill="x")
+
+        ttk.Label(top, text="From:", style="Green.TLabel").pack(side="left")
+        self.an_start_var = tk.StringVar(value=fmtDate(date.today() - timedelta(days=364)))
+        ttk.Entry(top, textvariable=self.an_start_var, width=12).pack(side="left", padx=(4, 10))
+
+        ttk.Label(top, text="To:", style="Green.TLabel").pack(side="left")
+        self.an_end_var = tk.StringVar(value=fmtDate(date.today()))
+        ttk.Entry(top, textvariable=self.an_end_var, width=12).pack(side="left", padx=(4, 10))
+
+        ttk.Label(top, text="Group by:", style="Green.TLabel").pack(side="left")
+        self.an_period_var = tk.StringVar(value="month")
+        ttk.Combobox(
+            top, textvariable=self.an_period_var, values=list(PERIODS), state="readonly", width=8
+        ).pack(side="left", padx=(4, 10))
+
+        self.btn(top, "Apply", self.analyticsLoad, side="left")
+        self.btn(top, "Save report…", self.saveReport, side="left")
+
+        self.an_summary_lbl = ttk.Label(
+            self.tab_analytics, text="—", font=("Segoe UI", 11, "bold"), style="Green.TLabel"
+        )
+        self.an_summary_lbl.pack(anchor="w", pady=(10, 0))
+
+        self.an_canvas = tk.Canvas(self.tab_analytics, height=150, bg="white", highlightthickness=1,
+                                   highlightbackground=BRGREEN)
+        self.an_canvas.pack(fill="x", pady=(8, 0))
+        self.an_canvas.bind("<Configure>", lambda e: self.drawChart())
+        self.an_result = None
+
+        tables = ttk.Frame(self.tab_analytics, style="Green.TFrame")
+        tables.pack(fill="both", expand=True, pady=(10, 0))
+
+        cols = ("period", "entries", "kg")
+        self.an_tree = ttk.Treeview(tables, columns=cols, show="headings", height=6)
+        self.an_tree.heading("period", text="Period")
+        self.an_tree.heading("entries", text="Logs")
+        self.an_tree.heading("kg", text="kg CO₂")
+        self.an_tree.column("period", width=120, anchor="w")
+        self.an_tree.column("entries", width=80, anchor="e")
+        self.an_tree.column("kg", width=110, anchor="e")
+        self.an_tree.pack(side="left", fill="both", expand=True)
+
+        cols = ("category", "entries", "kg", "share")
+        self.an_cat_tree = ttk.Treeview(tables, columns=cols, show="headings", height=6)
+        self.an_cat_tree.heading("category", text="Category")
+        self.an_cat_tree.heading("entries", text="Logs")
+        self.an_cat_tree.heading("kg", text="kg CO₂")
+        self.an_cat_tree.heading("share", text="Share")
+        self.an_cat_tree.column("category", width=180, anchor="w")
+        self.an_cat_tree.column("entries", width=70, anchor="e")
+        self.an_cat_tree.column("kg", width=100, anchor="e")
+        self.an_cat_tree.column("share", width=70, anchor="e")
+        self.an_cat_tree.pack(side="left", fill="both", expand=True, padx=(12, 0))
+
+    # Loading rollups, category shares and the moving average for the chosen range
+    @timed
+    def analyticsLoad(self):
+        try:
+            start = datetime.strptime(self.an_start_var.get().strip(), "%Y-%m-%d").date()
+            end = datetime.strptime(self.an_end_var.get().strip(), "%Y-%m-%d").date()
+        except Exception:
+            messagebox.showerror("Error", "Dates must be YYYY-MM-DD.")
+            return
+
+        self.worker.submit(
+            summaryView,
+            fmtDate(start),
+            fmtDate(end),
+            self.an_period_var.get(),
+            7,
+            self.user_id,
+            key="analytics",
+            done=self.showAnalytics,
+        )
+
+    # Draw the monthly report (PNG or PDF) for the month of the "To" date
+    @timed
+    def saveReport(self):
+        try:
+            month = datetime.strptime(self.an_end_var.get().strip(), "%Y-%m-%d").strftime("%Y-%m")
+        except Exception:
+            messagebox.showerror("Error", "Dates must be YYYY-MM-DD.")
+            return
+        path = filedialog.asksaveasfilename(
+            title="Save report", initialfile=f"ecotrack-{month}.png", defaultextension=".png",
+            filetypes=[("PNG image", "*.png"), ("PDF document", "*.pdf")],
+        )
+        if path:
+            self.worker.submit(self.drawReport, month, path,
+                               done=lambda saved: messagebox.showinfo("Report", f"Saved {saved}"))
+
+    # Runs on the worker; PIL is only imported once a report is drawn
+    def drawReport(self, month, path):
+        from reports import saveReport
+
+        return saveReport(self.user_id, month, path)
+
+    @timed
+    def showAnalytics(self, result):
+        self.an_result = result
+        self.an_summary_lbl.config(
+            text=f"{result['total']:.3f} kg CO₂ from {result['entries']} logs, "
+            f"{result['daily_mean']:.3f} kg/day on average"
+        )
+
+        self.an_tree.delete(*self.an_tree.get_children())
+        for period, entries, kg in result["rollup"]:
+            self.an_tree.insert("", "end", values=(period, entries, f"{kg:.3f}"))
+
+        self.an_cat_tree.delete(*self.an_cat_tree.get_children())
+        for cat, entries, kg, share in result["categories"]:
+            self.an_cat_tree.insert("", "end", values=(cat, entries, f"{kg:.3f}", f"{share:.1%}"))
+
+        self.drawChart()
+
+    # Bars for each rollup period, with the 7-day moving average drawn over them
+    @timed
+    def drawChart(self):
+        c = self.an_canvas
+        c.delete("all")
+        if not self.an_result or not self.an_result["rollup"]:
+            return
+
+        width, height, pad = c.winfo_width(), c.winfo_height(), 20
+        rows = self.an_result["rollup"]
+        top = max(r[2] for r in rows) or 1.0
+        step = (width - 2 * pad) / len(rows)
+        for i, (period, _, kg) in enumerate(rows):
+            x0 = pad + i * step
+            y0 = height - pad - (height - 2 * pad) * kg / top
+            c.create_rectangle(x0 + 1, y0, x0 + max(step - 1, 2), height - pad, fill=BRGREEN, outline=DRGREEN)
+        c.create_text(pad, pad / 2, text=f"max {top:.1f} kg per {self.an_result['period']}", anchor="w",
+                      fill=DARK, font=("Segoe UI", 8))
+
+        moving = self.an_result["moving"]
+        peak = max((m[2] for m in moving), default=0) or 1.0
+        if len(moving) > 1:
+            dx = (width - 2 * pad) / (len(moving) - 1)
+            points = []
+            for i, (_, _, avg) in enumerate(moving):
+                points += [pad + i * dx, height - pad - (height - 2 * pad) * avg / peak]
+            c.create_line(*points, fill=DARK, width=1)
+            c.create_text(width - pad, pad / 2, text=f"7-day average (max {peak:.2f} kg/day)", anchor="e",
+                          fill=DARK, font=("Segoe UI", 8))
 
 # For starting the EcoTrack user interface
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+from datetime import date, timedelta
+
+from storage import db
+from querycache import VIEWS
+
+# How each rollup period groups a log_date; weeks are keyed by their Monday
+PERIODS = {
+    "day": "log_date",
+    "week": "date(log_date, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m', log_date)",
+    "year": "strftime('%Y', log_date)",
+}
+
+
+# Summary tables to read and WHERE clause for a date range. One user reads
+# their rows of daily_totals; everyone (user_id None) reads the fleet tables.
+def source(start: str, end: str, user_id: int = None):
+    if user_id is None:
+        return "fleet_daily_totals", "fleet_category_totals", " WHERE log_date BETWEEN ? AND ?", [start, end]
+    where = " WHERE user_id = ? AND log_date BETWEEN ? AND ?"
+    return "daily_totals", "daily_category_totals", where, [user_id, start, end]
+
+
+# Entries and kg per day/week/month/year between start and end (inclusive),
+# read from the per-day summaries so ten years is a few thousand rows at most
+def rollup(start: str, end: str, period: str = "month", user_id: int = None) -> list:
+    if period not in PERIODS:
+        raise ValueError(f"Period must be one of: {', '.join(PERIODS)}")
+    key = PERIODS[period]
+    days, _, where, params = source(start, end, user_id)
+    with db() as conn:
+        rows = conn.execute(
+            f"SELECT {key} AS period, SUM(entries), ROUND(SUM(kg_co2), 3) FROM {days}{where} "
+            "GROUP BY period ORDER BY period",
+            params,
+        ).fetchall()
+    return rows
+
+
+# Each category's entries, kg and share of the range's total kg, largest first
+def categoryShares(start: str, end: str, user_id: int = None) -> list:
+    _, categories, where, params = source(start, end, user_id)
+    with db() as conn:
+        rows = conn.execute(
+            f"SELECT category, SUM(entries), SUM(kg_co2) FROM {categories}{where} "
+            "GROUP BY category ORDER BY SUM(kg_co2) DESC",
+            params,
+        ).fetchall()
+    total = sum(r[2] for r in rows)
+    return [(cat, count, round(kg, 3), round(kg / total, 4) if total else 0.0) for cat, count, kg in rows]
+
+
+# Trailing moving average of daily kg over `window` days. Days without logs
+# count as 0 kg, so the series has one point per calendar day in the range.
+def movingAverage(start: str, end: str, window: int = 7, user_id: int = None) -> list:
+    if window < 1:
+        raise ValueError("Window must be at least 1 day.")
+    first = date.fromisoformat(start).toordinal()
+    last = date.fromisoformat(end).toordinal()
+    # Read window - 1 extra days so the first points average a full window
+    lead = first - (window - 1)
+    values = [0.0] * (last - lead + 1)
+    for day_s, _, kg in rollup(date.fromordinal(lead).isoformat(), end, "day", user_id):
+        values[date.fromisoformat(day_s).toordinal() - lead] = kg
+
+    out = []
+    running = sum(values[: window - 1])
+    for i in range(window - 1, len(values)):
+        running += values[i]
+        out.append((date.fromordinal(lead + i).isoformat(), values[i], round(running / window, 3)))
+        running -= values[i - window + 1]
+    return out
+
+
+# Everything the Analytics tab shows, in one call (one worker job)
+def summary(start: str, end: str, period: str = "month", window: int = 7, user_id: int = None) -> dict:
+    if start > end:
+        raise ValueError("Start date must not be after the end date.")
+    rows = rollup(start, end, period, user_id)
+    total = round(sum(r[2] for r in rows), 3)
+    days = (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+    return {
+        "start": start,
+        "end": end,
+        "period": period,
+        "rollup": rows,
+        "categories": categoryShares(start, end, user_id),
+        "moving": movingAverage(start, end, window, user_id),
+        "total": total,
+        "entries": sum(r[1] for r in rows),
+        "daily_mean": round(total / days, 3),
+    }
+
+
+# summary() from the query cache while none of the days it reads (the range
+# and the window - 1 days before it) has been written to
+def summaryView(start: str, end: str, period: str = "month", window: int = 7, user_id: int = None) -> dict:
+    lead = (date.fromisoformat(start) - timedelta(days=max(0, window - 1))).isoformat()
+    return VIEWS.get((user_id, lead, end), summary, start, end, period, window, user_id)
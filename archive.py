@@ -0,0 +1,294 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from functools import lru_cache
+
+# Archive segment file: MAGIC, the header length (u32) and a JSON header, then
+# one column after another, each starting on an 8-byte boundary. Numeric
+# columns are little-endian arrays stored as-is so they can be memory-mapped
+# and searched in place; the note text is zlib-compressed, since it is the
+# only part that compresses well and it is read the least.
+MAGIC = b"ECOARC01"
+
+# Rows are stored sorted by (day, id); (name, array typecode) of each column
+COLUMNS = (
+    ("id", "q"),
+    ("user", "i"),
+    ("day", "i"),  # date ordinal
+    ("category", "B"),  # index into the header's categories
+    ("amount", "d"),
+    ("hours", "d"),
+    ("kg", "d"),
+    ("note_end", "I"),  # end offset of each row's note in the note text
+)
+
+# Rows read or skipped per step when walking a segment for one user
+STEP = 4096
+
+
+# Segments of a database file live in a directory next to it: ecotrack.db -> ecotrack.archive/
+def directoryFor(db_path: str) -> str:
+    return os.path.splitext(os.path.abspath(db_path))[0] + ".archive"
+
+
+@lru_cache(maxsize=65536)
+def ordinal(day_s: str) -> int:
+    return date.fromisoformat(day_s).toordinal()
+
+
+@lru_cache(maxsize=65536)
+def dayString(day: int) -> str:
+    return date.fromordinal(day).isoformat()
+
+
+def align(n: int) -> int:
+    return -n % 8
+
+
+# Builds one segment from rows added in (log_date, id) order, keeping every
+# column in a compact array until it is written
+class SegmentWriter:
+    def __init__(self):
+        self.columns = {name: array(code) for name, code in COLUMNS}
+        self.categories = {}
+        self.notes = bytearray()
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    # (id, user_id, log_date, category, amount, duration_hours, kg_co2, note)
+    def add(self, row):
+        log_id, user_id, day_s, cat, amount, hours, kg, note = row
+        c = self.columns
+        c["id"].append(log_id)
+        c["user"].append(user_id)
+        c["day"].append(ordinal(day_s))
+        c["category"].append(self.categories.setdefault(cat, len(self.categories)))
+        c["amount"].append(amount)
+        c["hours"].append(hours)
+        c["kg"].append(kg)
+        if note:
+            self.notes += note.encode("utf-8")
+        c["note_end"].append(len(self.notes))
+
+    # Write the segment to path; it only appears under that name once complete
+    def write(self, path: str) -> dict:
+        if len(self.categories) > 255:
+            raise ValueError("An archive segment holds at most 255 categories.")
+        ids, days = self.columns["id"], self.columns["day"]
+        header = {
+            "rows": len(ids),
+            "first_day": dayString(days[0]),
+            "last_day": dayString(days[-1]),
+            "min_id": min(ids),
+            "max_id": max(ids),
+            "users": sorted(set(self.columns["user"])),
+            "categories": list(self.categories),
+            "columns": {},
+        }
+        blobs = []
+        for name, _ in COLUMNS:
+            column = self.columns[name]
+            if sys.byteorder == "big":
+                column = array(column.typecode, column)
+                column.byteswap()
+            blobs.append((name, column.tobytes(), "raw"))
+        blobs.append(("note", zlib.compress(bytes(self.notes), 6), "zlib"))
+
+        # Offsets depend on the header's own length, so lay it out until it is stable
+        start = 0
+        while True:
+            offset = start
+            for name, data, codec in blobs:
+                header["columns"][name] = [offset, len(data), codec]
+                offset += len(data) + align(len(data))
+            head = json.dumps(header).encode("utf-8")
+            size = len(MAGIC) + 4 + len(head)
+            if size + align(size) == start:
+                break
+            start = size + align(size)
+
+        partial = f"{path}.{os.getpid()}.tmp"
+        with open(partial, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(head)) + head + bytes(align(size)))
+            for _, data, _ in blobs:
+                f.write(data + bytes(align(len(data))))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+        return header
+
+
+# A read-only, memory-mapped segment. Columns are views straight onto the
+# mapped file; only the note text is decompressed, on first use.
+class Segment:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        if bytes(view[: len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not an EcoTrack archive segment")
+        (length,) = struct.unpack_from("<I", self.map, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(bytes(view[start:start + length]))
+        self.rows = self.header["rows"]
+        self.categories = self.header["categories"]
+        self.users = set(self.header["users"])
+        self.first = ordinal(self.header["first_day"])
+        self.last = ordinal(self.header["last_day"])
+
+        self.columns = {}
+        for name, code in COLUMNS:
+            offset, size, _ = self.header["columns"][name]
+            column = view[offset:offset + size].cast(code)
+            if sys.byteorder == "big":
+                column = array(code, column)
+                column.byteswap()
+            self.columns[name] = column
+        self.day = self.columns["day"]
+        self.ids = self.columns["id"]
+        self.user = self.columns["user"]
+        self._notes = None
+        self._by_id = None
+        self._lock = threading.Lock()
+
+    def notes(self) -> bytes:
+        with self._lock:
+            if self._notes is None:
+                offset, size, _ = self.header["columns"]["note"]
+                self._notes = zlib.decompress(self.map[offset:offset + size])
+        return self._notes
+
+    # Could this segment hold rows for the user (None: anyone) on the day (None: any)?
+    def covers(self, user_id: int = None, day_s: str = None) -> bool:
+        if user_id is not None and user_id not in self.users:
+            return False
+        return day_s is None or self.first <= ordinal(day_s) <= self.last
+
+    # Position of the first row at or after a (log_date, id) key
+    def position(self, key) -> int:
+        day = ordinal(key[0])
+        lo, hi = bisect_left(self.day, day), bisect_right(self.day, day)
+        return bisect_left(self.ids, key[1], lo, hi)
+
+    # Row range [lo, hi) of one day, or of the whole segment
+    def span(self, day_s: str = None):
+        if day_s is None:
+            return 0, self.rows
+        day = ordinal(day_s)
+        return bisect_left(self.day, day), bisect_right(self.day, day)
+
+    # One row as (log_date, category, amount, duration_hours, kg_co2, note, id),
+    # the HistoryPager column order
+    def row(self, i: int) -> tuple:
+        c = self.columns
+        ends = c["note_end"]
+        start = ends[i - 1] if i else 0
+        note = self.notes()[start:ends[i]].decode("utf-8") if ends[i] > start else ""
+        return (dayString(c["day"][i]), self.categories[c["category"][i]], c["amount"][i], c["hours"][i],
+                c["kg"][i], note, c["id"][i])
+
+    # Rows in History order (newest first) that come after the key (None: from
+    # the newest), for one user and/or day if given. Rows are only decoded as
+    # they are taken.
+    def before(self, key, user_id: int = None, day_s: str = None):
+        lo, hi = self.span(day_s)
+        if key is not None:
+            hi = min(hi, self.position(key))
+        return map(self.row, self.walk(lo, hi, user_id, reverse=True))
+
+    # ids of one day's rows, newest first, below an id if given
+    def dayIds(self, day_s: str, user_id: int = None, below: int = None) -> list:
+        lo, hi = self.span(day_s)
+        if below is not None:
+            hi = bisect_left(self.ids, below, lo, hi)
+        return [self.ids[i] for i in self.walk(lo, hi, user_id, reverse=True)]
+
+    # Positions in [lo, hi) belonging to the user, read STEP rows at a time
+    def walk(self, lo: int, hi: int, user_id: int = None, reverse: bool = False):
+        steps = range(hi, lo, -STEP) if reverse else range(lo, hi, STEP)
+        for step in steps:
+            a, b = (max(lo, step - STEP), step) if reverse else (step, min(hi, step + STEP))
+            if user_id is None:
+                found = range(a, b)
+            else:
+                users = self.user[a:b].tolist()
+                found = [a + j for j, u in enumerate(users) if u == user_id]
+            yield from (reversed(found) if reverse else found)
+
+    # Every row, oldest first, as (user_id, log_date, category, amount, hours, kg, note, id)
+    def export(self, user_id: int = None):
+        for i in self.walk(0, self.rows, user_id):
+            log_date, cat, amount, hours, kg, note, log_id = self.row(i)
+            yield self.user[i], log_date, cat, amount, hours, kg, note or None, log_id
+
+    # How many rows are dated on or after a day, in the given categories (None: any)
+    def countSince(self, day_s: str, categories=None) -> int:
+        lo = bisect_left(self.day, ordinal(day_s))
+        if categories is None:
+            return self.rows - lo
+        codes = {i for i, cat in enumerate(self.categories) if cat in categories}
+        return sum(code in codes for code in self.columns["category"][lo:].tolist())
+
+    # (user_id, log_date, category, entries, kg) per user, day and category
+    def totals(self) -> list:
+        sums = {}
+        c = self.columns
+        for key, kg in zip(zip(c["user"].tolist(), c["day"].tolist(), c["category"].tolist()), c["kg"].tolist()):
+            entry = sums.get(key)
+            sums[key] = (1, kg) if entry is None else (entry[0] + 1, entry[1] + kg)
+        return [(u, dayString(d), self.categories[cat], n, kg) for (u, d, cat), (n, kg) in sums.items()]
+
+    # (ids in order, their row positions), built on first use; rows are
+    # stored in day order, so looking one up by id needs its own index
+    def idIndex(self) -> tuple:
+        with self._lock:
+            if self._by_id is None:
+                order = sorted(range(self.rows), key=self.ids.__getitem__)
+                self._by_id = array("q", (self.ids[i] for i in order)), array("I", order)
+        return self._by_id
+
+    # {id: (user_id, log_date, category, amount, hours, kg, note)} for the
+    # given ids that are in this segment
+    def find(self, ids) -> dict:
+        lo, hi = self.header["min_id"], self.header["max_id"]
+        wanted = [log_id for log_id in ids if lo <= log_id <= hi]
+        if not wanted:
+            return {}
+        sorted_ids, order = self.idIndex()
+        found = {}
+        for log_id in wanted:
+            k = bisect_left(sorted_ids, log_id)
+            if k < len(sorted_ids) and sorted_ids[k] == log_id:
+                i = order[k]
+                log_date, cat, amount, hours, kg, note, _ = self.row(i)
+                found[log_id] = (self.user[i], log_date, cat, amount, hours, kg, note)
+        return found
+
+    def contains(self, log_id: int) -> bool:
+        if not self.header["min_id"] <= log_id <= self.header["max_id"]:
+            return False
+        sorted_ids = self.idIndex()[0]
+        k = bisect_left(sorted_ids, log_id)
+        return k < len(sorted_ids) and sorted_ids[k] == log_id
+
+
+_segments = {}
+_segments_lock = threading.Lock()
+
+
+# The open Segment for a file, mapped once per process
+def segment(path: str) -> Segment:
+    with _segments_lock:
+        seg = _segments.get(path)
+        if seg is None:
+            seg = _segments[path] = Segment(path)
+        return seg
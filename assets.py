@@ -0,0 +1,48 @@
+import hashlib
+import os
+import tkinter as tk
+
+# Resized copies of the GUI's images live here, one PNG per (source, size)
+CACHE_DIR = os.environ.get("ECOTRACK_CACHE") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "ecotrack", "assets"
+)
+
+
+# Cache file for path scaled to size. The name changes whenever the source is
+# edited or replaced (mtime or byte size), so stale thumbnails are never read.
+def cachePath(path: str, size: tuple) -> str:
+    src = os.path.abspath(path)
+    info = os.stat(src)
+    key = f"{src}|{info.st_mtime_ns}|{info.st_size}|{size[0]}x{size[1]}"
+    return os.path.join(CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+
+# Decode and scale the source with PIL and write the PNG to the cache. JPEGs
+# are decoded at a reduced scale (draft) first, which is most of the saving.
+def buildThumbnail(path: str, size: tuple, target: str):
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.draft("RGB", size)
+        img = img.convert("RGB").resize(size)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    partial = f"{target}.{os.getpid()}.tmp"
+    img.save(partial, "PNG")
+    os.replace(partial, target)  # other windows never see a half-written file
+
+
+# A PhotoImage of path scaled to size (width, height). A cached thumbnail is
+# read by Tk directly, without importing or running PIL at all.
+def photo(path: str, size: tuple, master=None) -> tk.PhotoImage:
+    target = cachePath(path, size)
+    if not os.path.exists(target):
+        try:
+            buildThumbnail(path, size, target)
+        except OSError:
+            # Read-only or full cache directory: scale in memory this time
+            from PIL import Image, ImageTk
+
+            with Image.open(path) as img:
+                img.draft("RGB", size)
+                return ImageTk.PhotoImage(img.convert("RGB").resize(size), master=master)
+    return tk.PhotoImage(file=target, master=master)
@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import storage
+import core
+from core import addLogs, batchEmissions, checkLog, fmtDate, historyView, removeLog, streakShow, todayView
+from querycache import VIEWS
+
+# Synthetic trips: (category, share of trips, typical km, typical hours)
+PROFILE = (
+    ("Travel: Car", 0.40, 9.0, 0.35),
+    ("Travel: Bus", 0.25, 6.0, 0.40),
+    ("Travel: Metro/Train", 0.25, 12.0, 0.30),
+    ("Travel: Motorcycle", 0.10, 7.0, 0.25),
+)
+
+# Share of days, outside the trailing streak, pushed over GOODLIMIT
+BAD_DAYS = 0.03
+
+# Rows per bulkInsert transaction while generating
+BATCH = 50000
+
+NOTES = (None, None, None, "commute", "school run", "groceries", "gym", "visiting family")
+
+
+# "10k", "1M", "10M" -> int
+def parseCount(text: str) -> int:
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:].lower(), 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+# Yield (user_id, log_date, category, amount, hours, note) rows, oldest day
+# first, ending today. Every user's last streak_days are all GOOD so the
+# streak is long; before that a few days are pushed over the limit.
+def syntheticLogs(rows: int, users: int = 1, per_day: int = 3, streak_days: int = 365, seed: int = 1):
+    rng = random.Random(seed)
+    cats = [p[0] for p in PROFILE]
+    weights = [p[1] for p in PROFILE]
+    typical = {p[0]: (p[2], p[3]) for p in PROFILE}
+
+    days = max(1, -(-rows // (users * per_day)))
+    first = date.today() - timedelta(days=days - 1)
+    made = 0
+    for offset in range(days):
+        day_s = fmtDate(first + timedelta(days=offset))
+        in_streak = days - offset <= streak_days
+        for user_id in range(1, users + 1):
+            bad = not in_streak and rng.random() < BAD_DAYS
+            for _ in range(per_day):
+                if made == rows:
+                    return
+                cat = rng.choices(cats, weights)[0]
+                km, hrs = typical[cat]
+                km = round(km * rng.uniform(0.3, 1.2) * (6 if bad else 1), 1)
+                yield user_id, day_s, cat, km, round(hrs * rng.uniform(0.5, 1.5), 2), rng.choice(NOTES)
+                made += 1
+
+
+# Fill the current database with rows synthetic logs, in BATCH-row transactions
+def populate(rows: int, users: int = 1, seed: int = 1) -> float:
+    for n in range(2, users + 1):
+        storage.userId(f"bench{n}")
+    started = time.perf_counter()
+    conn = storage.db()
+    batch = []
+
+    def flush():
+        kgs = batchEmissions([r[2] for r in batch], [r[3] for r in batch], [r[4] for r in batch], [r[1] for r in batch])
+        storage.bulkInsert(conn, [r[:5] + (float(kg), r[5]) for r, kg in zip(batch, kgs)])
+        batch.clear()
+
+    for row in syntheticLogs(rows, users, seed=seed):
+        batch.append(row)
+        if len(batch) >= BATCH:
+            flush()
+    if batch:
+        flush()
+    core.STREAKS.clear()  # engines load again from the new totals
+    VIEWS.clear()
+    return time.perf_counter() - started
+
+
+# Run fn() repeat times; wall-time percentiles in ms and queries per call
+def measure(fn, repeat: int) -> dict:
+    times = []
+    storage.resetStats()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    queries = storage.stats()["queries"]
+    times.sort()
+    ms = lambda s: round(s * 1000, 4)
+    return {
+        "n": repeat,
+        "mean_ms": ms(statistics.fmean(times)),
+        "p50_ms": ms(times[len(times) // 2]),
+        "p95_ms": ms(times[min(len(times) - 1, int(0.95 * len(times)))]),
+        "min_ms": ms(times[0]),
+        "max_ms": ms(times[-1]),
+        "queries_per_op": round(queries / repeat, 2),
+    }
+
+
+# The operations behind the GUI's handlers, each run the way the worker runs it
+def operations(rows: int, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    today = fmtDate(date.today())
+    with storage.db() as conn:
+        oldest = conn.execute("SELECT MIN(log_date) FROM logs WHERE deleted IS NULL").fetchone()[0] or today
+    days_back = (date.today() - date.fromisoformat(oldest)).days
+    some_day = lambda: fmtDate(date.today() - timedelta(days=rng.randint(0, days_back)))
+    added = []
+
+    def add():  # svLog: validate, then saveLog (which is addLogs for one log)
+        day_s, cat, amount, hrs = checkLog(today, "Travel: Bus", "4.5", "0.3")
+        added.append(addLogs([(storage.DEFAULT_USER, day_s, cat, amount, hrs, "bench")])[0][0])
+
+    def streakCold():
+        core.STREAKS.clear()
+        streakShow()
+
+    def todayCold():
+        VIEWS.clear()
+        todayView()
+
+    def historyPage(day=None, first=0):
+        pager = storage.HistoryPager(day)
+        pager.rows(first, 50)
+
+    def delete():
+        removeLog(added.pop())
+
+    return {
+        "add": add,
+        "today": todayView,
+        "today_cold": todayCold,
+        "streak_cold": streakCold,
+        "streak_warm": streakShow,
+        "history_full": lambda: historyPage(),
+        "history_filtered": lambda: historyPage(some_day()),
+        "history_deep": lambda: historyPage(None, rng.randrange(max(1, rows - 50))),
+        "history_cached": lambda: historyView().rows(0, 50),
+        "delete": delete,
+    }
+
+
+# Populate a throwaway database with rows logs and time every operation
+def runSize(rows: int, repeat: int, users: int, seed: int, workdir: str) -> dict:
+    path = os.path.join(workdir, f"bench-{rows}.db")
+    storage.useFile(path)
+    storage.createDtb()
+    seconds = populate(rows, users, seed)
+
+    results = {}
+    for name, fn in operations(rows, seed).items():
+        # Streak rebuilds scan every day the user has, so fewer rounds suffice
+        results[name] = measure(fn, max(1, repeat // 10) if name == "streak_cold" else repeat)
+        print(f"  {name:<18} p50 {results[name]['p50_ms']:>9.3f} ms   p95 {results[name]['p95_ms']:>9.3f} ms",
+              flush=True)
+
+    storage.closeAll()
+    return {
+        "rows": rows,
+        "users": users,
+        "populate_s": round(seconds, 3),
+        "populate_rows_per_sec": round(rows / seconds) if seconds > 0 else 0,
+        "db_bytes": os.path.getsize(path),
+        "ops": results,
+    }
+
+
+def gitCommit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=5,
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# Print each op's p50 against an earlier results file
+def compare(old: dict, new: dict):
+    before = {r["rows"]: r["ops"] for r in old["sizes"]}
+    print(f"\nCompared with {old.get('commit') or 'previous run'}:")
+    for size in new["sizes"]:
+        ops = before.get(size["rows"])
+        if ops is None:
+            continue
+        for name, result in size["ops"].items():
+            if name in ops and ops[name]["p50_ms"] > 0:
+                ratio = result["p50_ms"] / ops[name]["p50_ms"]
+                print(f"  {size['rows']:>9} {name:<18} {ops[name]['p50_ms']:>9.3f} -> {result['p50_ms']:>9.3f} ms"
+                      f"  ({ratio:.2f}x)")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="bench", description="EcoTrack benchmarks on synthetic data")
+    parser.add_argument("--rows", nargs="+", default=["10k"], help="database sizes, e.g. 10k 1M 10M")
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=200, help="timed calls per operation")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="bench_results.json", help="where the JSON results go")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the generated databases")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ecotrack-bench-")
+    results = {
+        "commit": gitCommit(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "numpy": core.numpyOrNone() is not None,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "sizes": [],
+    }
+    try:
+        for text in args.rows:
+            rows = parseCount(text)
+            print(f"{rows} rows:", flush=True)
+            results["sizes"].append(runSize(rows, args.repeat, args.users, args.seed, workdir))
+    finally:
+        storage.closeAll()
+        if args.keep:
+            print(f"Databases kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
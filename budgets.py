@@ -0,0 +1,79 @@
+from storage import db
+from core import BUDGET_PERIODS, budgetFor, factorVersions
+
+# Alerts joined with the budget that raised them, in alertText's order
+ALERTS = (
+    "SELECT a.id, a.period_start, a.kg_co2, a.created, a.seen, b.period, b.category, b.limit_kg "
+    "FROM alerts AS a JOIN budgets AS b ON b.id = a.budget_id"
+)
+
+
+# Add a budget of limit_kg per day, week or month for one category (None: all
+# of them) and return its id. A budget already over its limit alerts right away.
+def addBudget(user_id: int, period: str, limit_kg, category: str = None) -> int:
+    if period not in BUDGET_PERIODS:
+        raise ValueError(f"Invalid period: {period} (choose from {', '.join(BUDGET_PERIODS)})")
+    limit_kg = float(limit_kg)
+    if limit_kg <= 0:
+        raise ValueError("Budget must be > 0 kg.")
+    if category is not None and category not in factorVersions():
+        raise ValueError("Invalid category.")
+
+    with db() as conn:
+        budget_id = conn.execute(
+            "INSERT INTO budgets (user_id, period, category, limit_kg) VALUES (?, ?, ?, ?)",
+            (user_id, period, category, limit_kg),
+        ).lastrowid
+
+    engine = budgetFor(user_id)
+    engine.load()
+    for rule in engine.status():
+        if rule[0] == budget_id and rule[6] > limit_kg:
+            with db() as conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO alerts (user_id, budget_id, period_start, kg_co2) VALUES (?, ?, ?, ?)",
+                    (user_id, budget_id, rule[4], round(rule[6], 3)),
+                )
+    return budget_id
+
+
+# Remove one of the user's budgets and its alerts; False if there was none
+def removeBudget(user_id: int, budget_id: int) -> bool:
+    with db() as conn:
+        gone = conn.execute("DELETE FROM budgets WHERE id = ? AND user_id = ?", (budget_id, user_id)).rowcount
+    if gone:
+        budgetFor(user_id).load()
+    return bool(gone)
+
+
+# The user's budgets with this period's kg so far:
+# [(id, period, category, limit_kg, start, end, kg)]
+def listBudgets(user_id: int) -> list:
+    return budgetFor(user_id).status()
+
+
+# The user's newest alerts, newest first, in alertText's order
+def listAlerts(user_id: int, limit: int = 50) -> list:
+    return db().execute(ALERTS + " WHERE a.user_id = ? ORDER BY a.id DESC LIMIT ?", (user_id, limit)).fetchall()
+
+
+# The user's alerts not shown yet, oldest first, which are marked seen
+def newAlerts(user_id: int) -> list:
+    with db() as conn:
+        rows = conn.execute(ALERTS + " WHERE a.user_id = ? AND a.seen = 0 ORDER BY a.id", (user_id,)).fetchall()
+        if rows:
+            conn.execute("UPDATE alerts SET seen = 1 WHERE user_id = ? AND seen = 0 AND id <= ?", (user_id, rows[-1][0]))
+    return rows
+
+
+# One budget as text, e.g. "weekly Travel: Car budget of 20 kg CO₂"
+def budgetText(period: str, category: str, limit_kg: float) -> str:
+    every = {"day": "daily", "week": "weekly", "month": "monthly"}[period]
+    return f"{every} {category + ' ' if category else ''}budget of {limit_kg:g} kg CO₂"
+
+
+# One alert row (from listAlerts or newAlerts) as a line of text
+def alertText(alert) -> str:
+    _, start, kg, _, _, period, category, limit_kg = alert
+    when = {"day": f"on {start}", "week": f"in the week of {start}", "month": f"in {start[:7]}"}[period]
+    return f"Over the {budgetText(period, category, limit_kg)}: {kg:.3f} kg {when}"
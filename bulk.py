@@ -0,0 +1,344 @@
+import csv
+import json
+import os
+import time
+from datetime import date, timedelta
+from heapq import merge
+from itertools import islice
+
+import storage
+from archive import directoryFor
+from storage import COMPACT_BATCH, DEFAULT_USER, archiveChunk, archiveSegments, bulkInsert, compactChunk, db, userId
+from core import batchEmissions, checkLog, fmtDate, parseDay, touchTotals
+from querycache import VIEWS
+
+# Rows per executemany() call; each batch is one transaction
+BATCH = 20000
+
+# Columns written by exportLogs and read back by importLogs
+FIELDS = ("user", "log_date", "category", "amount", "duration_hours", "kg_co2", "note")
+
+# Keep this many bad-row messages for the report; the rest are only counted
+MAX_ERRORS = 20
+
+# archiveLogs without a cutoff date moves logs older than this many days
+ARCHIVE_AFTER_DAYS = 730
+
+# Characters read per step from a .json file
+JSON_CHUNK = 1 << 16
+
+
+# Work out the file format from its extension
+def fileFormat(path: str) -> str:
+    lower = path.lower()
+    if lower.endswith(".csv"):
+        return "csv"
+    if lower.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if lower.endswith(".json"):
+        return "json"
+    raise ValueError(f"Unknown file type for {path} (use .csv, .json or .jsonl)")
+
+
+# A .json file that is not valid JSON, or not shaped as expected
+class JsonError(ValueError):
+    pass
+
+
+# A JSON text read JSON_CHUNK characters at a time. peek() and take() look at
+# the next non-blank character, decode() decodes the value starting there, and
+# items() the elements of an array one by one, so only the value being decoded
+# is ever held in memory.
+class JsonStream:
+    def __init__(self, f):
+        self.f = f
+        self.decoder = json.JSONDecoder()
+        self.buf, self.pos, self.line, self.eof = "", 0, 1, False
+
+    # The next non-blank character, reading on when the buffer runs out; "" at the end
+    def peek(self) -> str:
+        if self.pos < len(self.buf) and self.buf[self.pos] not in " \t\r\n":
+            return self.buf[self.pos]
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.line += self.buf[self.pos] == "\n"
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self.buf, self.pos = self.f.read(JSON_CHUNK), 0
+            self.eof = not self.buf
+
+    def take(self) -> str:
+        c = self.peek()
+        self.pos += len(c)
+        return c
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                item, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                end = None
+            if end is None or (end == len(self.buf) and not self.eof):
+                if self.eof:
+                    raise JsonError(f"line {self.line}: invalid JSON record")
+                # The value runs past the buffer: read on and decode it again,
+                # doubling what is held each time so a long value is not
+                # decoded over and over a chunk at a time
+                more = self.f.read(max(JSON_CHUNK, len(self.buf) - self.pos))
+                self.buf, self.pos, self.eof = self.buf[self.pos:] + more, 0, not more
+                continue
+            self.line += self.buf.count("\n", self.pos, end)
+            self.pos = end
+            return item
+
+    # Yield (line number, item) for each element of the array that starts here
+    def items(self):
+        if self.take() != "[":
+            raise JsonError(f"line {self.line}: expected '['")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            if not self.peek():
+                raise JsonError("The JSON array is not closed.")
+            yield self.line, self.decode()
+            c = self.take()
+            if c == "]":
+                return
+            if not c:
+                raise JsonError("The JSON array is not closed.")
+            if c != ",":
+                raise JsonError(f"line {self.line}: expected ',' or ']' after a record")
+
+
+# Yield (line number, item) for each element of the JSON array a file holds,
+# decoding it a chunk at a time so the whole array is never in memory
+def readJsonArray(f):
+    stream = JsonStream(f)
+    c = stream.peek()
+    if not c:
+        raise JsonError("The JSON array is not closed.")
+    if c != "[":
+        raise JsonError("A .json file must hold an array of records (use .jsonl for one per line).")
+    yield from stream.items()
+
+
+# Yield (line number, dict) records from a CSV, JSON Lines or JSON array file,
+# one at a time
+def readRecords(path: str, fmt: str):
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for number, record in enumerate(csv.DictReader(f), start=2):
+                yield number, record
+        elif fmt == "json":
+            yield from readJsonArray(f)
+        else:
+            for number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield number, json.loads(line)
+
+
+# Turn one record into (user_id, log_date, category, amount, hours, note),
+# validated like the Add form; kg is filled in for the whole batch by flush.
+# A record's own "user" column wins over the importing user; a new user is
+# only created once the record has passed validation.
+def toRow(record: dict, user_id: int, users: dict) -> tuple:
+    day_s, cat, amount, hrs = checkLog(
+        record.get("log_date") or record.get("date") or "",
+        record.get("category"),
+        record.get("amount"),
+        record.get("duration_hours", record.get("hours")),
+    )
+    note = (record.get("note") or "").strip()
+
+    name = (record.get("user") or "").strip()
+    if name:
+        if name not in users:
+            users[name] = userId(name)
+        user_id = users[name]
+    return user_id, day_s, cat, amount, hrs, note if note else None
+
+
+# Compute the batch's emissions in one pass, insert it in a single transaction
+# (journaled into the import's undo entries, see bulkInsert) and feed its days
+# to the streak and budget engines
+def flush(conn, rows: list, journal: dict = None):
+    kgs = batchEmissions([r[2] for r in rows], [r[3] for r in rows], [r[4] for r in rows], [r[1] for r in rows])
+    rows = [row[:5] + (float(kg), row[5]) for row, kg in zip(rows, kgs)]
+    touchTotals(*bulkInsert(conn, rows, journal))
+
+
+# Stream a CSV, JSON Lines or JSON array file into logs. Bad rows are skipped
+# and reported, unless strict is set, in which case the first one stops the
+# import (rows from batches already written stay in). Each user's imported
+# rows are one undo step.
+def importLogs(path: str, strict: bool = False, user_id: int = DEFAULT_USER) -> dict:
+    fmt = fileFormat(path)
+    conn = db()
+    started = time.perf_counter()
+    rows, errors, journal = [], [], {}
+    users = {}  # user name -> id, for files with a "user" column
+    added = skipped = 0
+
+    for number, record in readRecords(path, fmt):
+        try:
+            rows.append(toRow(record, user_id, users))
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+            if strict:
+                raise ValueError(f"{path} line {number}: {e}")
+            skipped += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(f"line {number}: {e}")
+            continue
+
+        if len(rows) >= BATCH:
+            flush(conn, rows, journal)
+            added += len(rows)
+            rows = []
+
+    if rows:
+        flush(conn, rows, journal)
+        added += len(rows)
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows": added,
+        "skipped": skipped,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(added / seconds) if seconds > 0 else 0,
+    }
+
+
+# Stream logs (one user's, or everyone's for user_id None) out to CSV, JSON
+# Lines or a JSON array, oldest first, fetching BATCH rows at a time so the
+# table is never held in memory. Archived logs are merged in by date.
+def exportLogs(path: str, user_id: int = None) -> dict:
+    fmt = fileFormat(path)
+    started = time.perf_counter()
+    written = 0
+
+    query = (
+        "SELECT u.name, l.log_date, l.category, l.amount, l.duration_hours, l.kg_co2, l.note, l.id "
+        "FROM logs AS l JOIN users AS u ON u.id = l.user_id"
+    )
+    params = ()
+    query += " WHERE l.deleted IS NULL"
+    if user_id is not None:
+        query += " AND l.user_id = ?"
+        params = (user_id,)
+    cur = db().cursor()
+    cur.execute(query + " ORDER BY l.log_date, l.id", params)
+    rows = (row for batch in iter(lambda: cur.fetchmany(BATCH), []) for row in batch)
+
+    segments = archiveSegments(user_id)
+    if segments:
+        names = dict(db().execute("SELECT id, name FROM users").fetchall())
+        archived = [((names[r[0]],) + r[1:] for r in seg.export(user_id)) for seg in segments]
+        rows = merge(rows, *archived, key=lambda r: (r[1], r[7]))
+
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(FIELDS)
+        elif fmt == "json":
+            f.write("[")
+
+        while True:
+            batch = [row[:7] for row in islice(rows, BATCH)]
+            if not batch:
+                break
+            if writer:
+                writer.writerows(batch)
+            elif fmt == "json":
+                f.writelines(
+                    ("\n" if written + i == 0 else ",\n") + json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False)
+                    for i, row in enumerate(batch)
+                )
+            else:
+                f.writelines(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n" for row in batch)
+            written += len(batch)
+
+        if fmt == "json":
+            f.write("\n]\n")
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows": written,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(written / seconds) if seconds > 0 else 0,
+    }
+
+
+# Move logs dated before `before` (default: ARCHIVE_AFTER_DAYS ago) out of the
+# database into columnar archive segments, one transaction per segment so other
+# writers get a turn in between. History, exports, analytics and streaks still
+# see the archived logs; only recalculation and note search leave them out.
+# vacuum rewrites the database afterwards to hand the freed space back.
+def archiveLogs(before: str = None, vacuum: bool = False) -> dict:
+    today = fmtDate(date.today())
+    before = parseDay(before) if before else fmtDate(date.today() - timedelta(days=ARCHIVE_AFTER_DAYS))
+    if before > today:
+        raise ValueError("Only logs dated before today can be archived.")
+
+    conn = db()
+    started = time.perf_counter()
+    moved = segments = 0
+    key = None
+    while True:
+        done = archiveChunk(conn, before, key)
+        if done is None:
+            break
+        key, rows = done
+        moved += rows
+        segments += 1
+
+    if moved:
+        VIEWS.clear()  # cached History pagers do not know about the new segments
+    if vacuum and moved:
+        conn.execute("VACUUM")
+
+    seconds = time.perf_counter() - started
+    directory = directoryFor(storage.FILE)
+    return {
+        "before": before,
+        "rows": moved,
+        "segments": segments,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(moved / seconds) if seconds > 0 else 0,
+        "db_bytes": os.path.getsize(storage.FILE),
+        "archive_bytes": sum(
+            os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+        ) if os.path.isdir(directory) else 0,
+    }
+
+
+# Purge deleted logs that are past undoing, COMPACT_BATCH per transaction.
+# forget drops the undo journal first, so every deleted log goes. vacuum
+# rewrites the database afterwards to hand the freed space back.
+def compactLogs(forget: bool = False, vacuum: bool = False) -> dict:
+    conn = db()
+    started = time.perf_counter()
+    if forget:
+        with conn:
+            conn.execute("DELETE FROM journal")
+
+    purged = 0
+    while True:
+        rows = compactChunk(conn)
+        purged += rows
+        if rows < COMPACT_BATCH:
+            break
+
+    if vacuum and purged:
+        conn.execute("VACUUM")
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows": purged,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(purged / seconds) if seconds > 0 else 0,
+        "db_bytes": os.path.getsize(storage.FILE),
+    }
@@ -0,0 +1,683 @@
+import json
+import threading
+from bisect import bisect_right
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+
+from storage import (
+    DEFAULT_USER, FIRST_DAY, HistoryPager, NoteSearch, db, dayTotal, endTotals, journalEntry, snapshot, startTotals,
+    totalsGen,
+)
+from querycache import VIEWS
+
+# Transport categories with emission elements like time taken and km traveled.
+# These are the built-in factors; the emission_factors table can version them
+# and add categories, and refreshFactors() keeps this dict on today's values.
+TRANSPORT = {
+    "Travel: Car": {"unit": "km", "kg_per_unit": 0.192, "kg_per_hour": 0.30},
+    "Travel: Bus": {"unit": "km", "kg_per_unit": 0.105, "kg_per_hour": 0.10},
+    "Travel: Metro/Train": {"unit": "km", "kg_per_unit": 0.041, "kg_per_hour": 0.03},
+    "Travel: Motorcycle": {"unit": "km", "kg_per_unit": 0.090, "kg_per_hour": 0.15},
+}
+
+# Newest logs shown for today on the Add logs tab
+TODAY_ROWS = 50
+
+# Rating for the daily carbon footprints:
+GOODLIMIT = 6.0
+OKLIMIT = 12.0
+
+
+# NumPy is optional and only loaded by the batch functions that use it, so
+# importing this module stays fast
+@lru_cache(maxsize=None)
+def numpyOrNone():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+# Versioned factors from the emission_factors table: category ->
+# [(effective_from, kg_per_unit, kg_per_hour), ...], oldest first.
+# refreshFactors swaps in a whole new dict, so readers never see it half-built.
+FACTORS = {}
+_factors_lock = threading.Lock()
+
+
+# (Re)read emission_factors; call after the table changes. TRANSPORT is updated
+# in place with the version in effect today, so new categories appear in it.
+def refreshFactors():
+    global FACTORS
+    with db() as conn:
+        rows = conn.execute(
+            "SELECT category, effective_from, unit, kg_per_unit, kg_per_hour FROM emission_factors "
+            "ORDER BY category, effective_from"
+        ).fetchall()
+
+    today = fmtDate(date.today())
+    versions, current = {}, {}
+    for cat, since, unit, per_km, per_hr in rows:
+        versions.setdefault(cat, []).append((since, per_km, per_hr))
+        if since <= today or cat not in current:
+            current[cat] = {"unit": unit, "kg_per_unit": per_km, "kg_per_hour": per_hr}
+
+    with _factors_lock:
+        TRANSPORT.update(current)
+        for cat, factor in TRANSPORT.items():
+            versions.setdefault(cat, [(FIRST_DAY, factor["kg_per_unit"], factor.get("kg_per_hour", 0.0))])
+        FACTORS = versions
+
+
+def factorVersions() -> dict:
+    if not FACTORS:
+        refreshFactors()
+    return FACTORS
+
+
+# (kg_per_unit, kg_per_hour) for a category on a day (default today)
+def factorsOn(category: str, day_s: str = None) -> tuple:
+    versions = factorVersions()[category]
+    i = bisect_right(versions, day_s or fmtDate(date.today()), key=lambda v: v[0])
+    _, per_km, per_hr = versions[max(0, i - 1)]
+    return per_km, per_hr
+
+
+# Calculate CO2 emissions based on time and distance, with the factors in
+# effect on the trip's day
+def Emissions(category: str, km: float, hr: float, day_s: str = None) -> float:
+    perunit, perhr = factorsOn(category, day_s)
+    return round((km * perunit) + (hr * perhr), 3)
+
+
+# Per-category factor tables for batch work: a category's code is its position
+# in TRANSPORT, and entry i of versions is that category's factor history
+def emissionTables():
+    table = factorVersions()
+    names = list(TRANSPORT)
+    return {c: i for i, c in enumerate(names)}, [table[c] for c in names]
+
+
+# Per-row (kg_per_unit, kg_per_hour) columns for coded categories on the given
+# days (default today). Categories with one version need no date lookup at all.
+def factorColumns(cat_codes, days, versions):
+    np = numpyOrNone()
+    today = fmtDate(date.today())
+    if np is not None:
+        cat_codes = np.asarray(cat_codes, dtype=np.intp)
+        if days is None or all(len(v) == 1 for v in versions):
+            pick = [versions[c][max(0, bisect_right(versions[c], today, key=lambda v: v[0]) - 1)]
+                    for c in range(len(versions))]
+            return np.array([p[1] for p in pick])[cat_codes], np.array([p[2] for p in pick])[cat_codes]
+
+        days = np.asarray(days, dtype=str)
+        per_km = np.empty(len(cat_codes))
+        per_hr = np.empty(len(cat_codes))
+        for c in np.unique(cat_codes).tolist():
+            mask = cat_codes == c
+            starts = np.array([v[0] for v in versions[c]])
+            pick = np.maximum(np.searchsorted(starts, days[mask], side="right") - 1, 0)
+            per_km[mask] = np.array([v[1] for v in versions[c]])[pick]
+            per_hr[mask] = np.array([v[2] for v in versions[c]])[pick]
+        return per_km, per_hr
+
+    if days is None:
+        days = [today] * len(cat_codes)
+    pick = [versions[c][max(0, bisect_right(versions[c], d, key=lambda v: v[0]) - 1)] for c, d in zip(cat_codes, days)]
+    return [p[1] for p in pick], [p[2] for p in pick]
+
+
+# Turn category names (or already-coded ints) into codes for emissionTables
+def categoryCodes(categories, codes: dict):
+    np = numpyOrNone()
+    if np is not None:
+        cats = np.asarray(categories)
+        if cats.dtype.kind in "iu":
+            return cats
+        # Only the few distinct names are looked up in Python
+        names, inverse = np.unique(cats, return_inverse=True)
+        unknown = [str(n) for n in names if n not in codes]
+        if unknown:
+            raise ValueError("Invalid category: " + ", ".join(unknown))
+        return np.array([codes[n] for n in names], dtype=np.intp)[inverse.reshape(-1)]
+
+    try:
+        return [c if isinstance(c, int) else codes[c] for c in categories]
+    except KeyError as e:
+        raise ValueError(f"Invalid category: {e.args[0]}")
+
+
+# Emissions for whole columns of trips at once. With NumPy this is one
+# vectorized pass (factor lookup by category code and day, multiply-add, round)
+# that gives the same values as calling Emissions on each trip; without NumPy
+# it falls back to a plain loop over the same tables.
+def batchEmissions(categories, km, hr, days=None):
+    np = numpyOrNone()
+    codes, versions = emissionTables()
+    cat_codes = categoryCodes(categories, codes)
+    per_km, per_hr = factorColumns(cat_codes, days, versions)
+
+    if np is not None:
+        km = np.asarray(km, dtype=np.float64)
+        hr = np.asarray(hr, dtype=np.float64)
+        raw = (km * per_km) + (hr * per_hr)
+        out = np.round(raw, 3)
+        # np.round scales by 1000 first, which can tip values lying next to a
+        # .0005 boundary the other way; redo those few with Python's round
+        near = np.nonzero(np.abs(raw * 1000 % 1 - 0.5) < 1e-6)[0]
+        out[near] = [round(x, 3) for x in raw[near].tolist()]
+        return out
+
+    return [round((k * pk) + (h * ph), 3) for k, h, pk, ph in zip(km, hr, per_km, per_hr)]
+
+
+# Format date as YYYY-MM-DD
+def fmtDate(d: date) -> str:
+    return d.isoformat()
+
+
+# Return a rating based on daliy emission limits
+def totalLimit(total_kg: float) -> str:
+    if total_kg <= GOODLIMIT:
+        return "LOW (low footprint today)"
+    elif total_kg <= OKLIMIT:
+        return "OK (decent footprint today)"
+    else:
+        return "HIGH (very high footprint today, try reducing emissions)"
+
+
+# Convert hours input to float
+def crovertHours(s: str) -> float:
+    s = s.strip()
+    if not s:
+        return 0.0
+    try:
+        return float(s)
+    except ValueError:
+        raise ValueError("Time spent (hours) must be a number")
+
+# Parse a YYYY-MM-DD string into its canonical form; imports repeat the same
+# few dates many times, so parsed values are cached
+@lru_cache(maxsize=4096)
+def parseDay(day_s: str) -> str:
+    return fmtDate(datetime.strptime(day_s.strip(), "%Y-%m-%d").date())
+
+
+# Validate one log's fields with the Add form's rules, returning clean values
+def checkLog(day, cat, amount, hrs):
+    day_s = parseDay(str(day))
+    if cat not in factorVersions():
+        raise ValueError("Invalid category.")
+
+    amount = float(amount)
+    if amount <= 0:
+        raise ValueError("Amount must be > 0.")
+
+    hrs = crovertHours("" if hrs is None else str(hrs))
+    if hrs < 0:
+        raise ValueError("Time must be ≥ 0.")
+
+    return day_s, cat, amount, hrs
+
+
+# A day counts towards the streak when it has logs and stays within GOODLIMIT
+def goodDay(count: int, total: float) -> bool:
+    return count > 0 and total <= GOODLIMIT
+
+
+# Keeps one user's per-day (count, kg) totals in memory so the streak is read with
+# one query over daily_totals and then only adjusted for the single day a write
+# touches. Writers and readers may be on different threads, so every entry point locks.
+# The engine remembers the user's totals generation (storage.TOTALS_GEN_SCHEMA)
+# its days are current for, so a read checks them with one lookup on whichever
+# connection the thread has. Only a write not fed to the engine (another
+# process's, say) makes it read the days again.
+class StreakEngine:
+    def __init__(self, user_id: int = DEFAULT_USER):
+        self.user_id = user_id
+        self.days = {}  # "YYYY-MM-DD" -> [count, total kg]
+        self.anchor = None  # the day the streak is counted back from
+        self.streak = 0
+        self.gen = None  # users.totals_gen the days are current for
+        self.lock = threading.RLock()
+
+    # Load every day's totals from daily_totals and count the streak
+    def load(self):
+        with self.lock:
+            self.reload()
+
+    # Reload if the user's totals have moved since the days were read
+    def refresh(self):
+        if self.gen is None or self.gen != totalsGen(db(), self.user_id):
+            self.reload()
+
+    def reload(self):
+        # The generation and the days as of one moment
+        with snapshot() as conn:
+            self.gen = totalsGen(conn, self.user_id)
+            cur = conn.cursor()
+            cur.execute("SELECT log_date, entries, kg_co2 FROM daily_totals WHERE user_id = ?", (self.user_id,))
+            rows = cur.fetchall()
+
+        self.days = {d: [count, float(total)] for d, count, total in rows}
+        self.anchor = date.today()
+        self.streak = 0
+        self.extend()
+
+    def isGood(self, day: date) -> bool:
+        entry = self.days.get(fmtDate(day))
+        return entry is not None and goodDay(entry[0], entry[1])
+
+    # Walk back from the first day not yet counted while days stay GOOD
+    def extend(self):
+        day = self.anchor.toordinal() - self.streak
+        while self.isGood(date.fromordinal(day)):
+            self.streak += 1
+            day -= 1
+
+    # Day rolled over since the last count: start again from the new today
+    def rollover(self):
+        if self.anchor is None:
+            self.reload()
+        elif self.anchor != date.today():
+            self.anchor = date.today()
+            self.streak = 0
+            self.extend()
+
+    def current(self) -> int:
+        with self.lock:
+            self.refresh()
+            self.rollover()
+            return self.streak
+
+    # Apply one write's (day, count, kg) changes together (count/kg are deltas,
+    # negative for deletes). gens is the user's totals generation (before,
+    # after) the write, from storage.endTotals: the changes only go on top of
+    # days read just before it. Days read later already include them, and after
+    # a write the engine missed, the days are read again on the next use.
+    def touchAll(self, changes, gens):
+        before, after = gens
+        with self.lock:
+            if self.gen == before:
+                for day_s, count, kg in changes:
+                    self.apply(day_s, count, kg)
+                self.gen = after
+            elif self.gen is not None and self.gen < after:
+                self.gen = None
+
+    def apply(self, day_s: str, count: int, kg: float):
+        entry = self.days.setdefault(day_s, [0, 0.0])
+        entry[0] += count
+        entry[1] = round(entry[1] + kg, 6)
+        if entry[0] <= 0:
+            del self.days[day_s]
+
+        self.rollover()
+        offset = self.anchor.toordinal() - datetime.strptime(day_s, "%Y-%m-%d").date().toordinal()
+        if offset < 0 or offset > self.streak:
+            return  # future day, or older than the day that ends the streak
+
+        good = self.isGood(date.fromordinal(self.anchor.toordinal() - offset))
+        if offset < self.streak and not good:
+            self.streak = offset  # a day inside the streak broke it
+        elif offset == self.streak and good:
+            self.extend()  # the day that ended the streak is now GOOD
+
+
+STREAKS = {}  # user id -> StreakEngine
+_streaks_lock = threading.Lock()
+
+
+# The streak engine for one user, created on first use
+def streakFor(user_id: int = DEFAULT_USER) -> StreakEngine:
+    with _streaks_lock:
+        engine = STREAKS.get(user_id)
+        if engine is None:
+            engine = STREAKS[user_id] = StreakEngine(user_id)
+        return engine
+
+
+# Budget periods (budgets.period)
+BUDGET_PERIODS = ("day", "week", "month")
+
+# Budget windows whose kg a BudgetEngine keeps before it starts over
+MAX_WINDOWS = 4096
+
+
+# First and last day of the day, week (Monday to Sunday) or month a day falls in
+@lru_cache(maxsize=4096)
+def periodSpan(period: str, day_s: str) -> tuple:
+    day = date.fromisoformat(day_s)
+    if period == "day":
+        return day_s, day_s
+    if period == "week":
+        start = day - timedelta(days=day.weekday())
+        return fmtDate(start), fmtDate(start + timedelta(days=6))
+    start = day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return fmtDate(start), fmtDate(end)
+
+
+# Keeps a running kg sum for each of one user's budget windows (budget, period)
+# that has been written to, so a write moves the sums by its kg instead of
+# summing the window again. A window is read from the totals tables once, on its
+# first write. When a write takes a window from within its limit to over it,
+# an alert is stored; it is raised once per budget and period. Rules and sums
+# are read again when the user's totals generation moves without the engine,
+# as StreakEngine's days are; budget changes move it too.
+class BudgetEngine:
+    def __init__(self, user_id: int = DEFAULT_USER):
+        self.user_id = user_id
+        self.rules = None  # [(id, period, category or None, limit_kg)], None until loaded
+        self.sums = {}  # (budget id, period start) -> kg
+        self.gen = None  # users.totals_gen the rules and sums are current for
+        self.lock = threading.RLock()
+
+    # Reread the rules if the user's totals or budgets have moved since
+    def refresh(self, conn):
+        if self.gen is None or self.gen != totalsGen(conn, self.user_id):
+            self.read(conn)
+
+    # (Re)read the user's budgets and forget the sums
+    def load(self):
+        with self.lock, snapshot() as conn:
+            self.read(conn)
+
+    def read(self, conn):
+        self.gen = totalsGen(conn, self.user_id)
+        self.rules = conn.execute(
+            "SELECT id, period, category, limit_kg FROM budgets WHERE user_id = ? ORDER BY id",
+            (self.user_id,),
+        ).fetchall()
+        self.sums = {}
+
+    # kg in one budget's window, from daily_totals or, for one category, daily_category_totals
+    def windowSum(self, conn, rule, start: str, end: str) -> float:
+        if rule[2] is None:
+            row = conn.execute(
+                "SELECT TOTAL(kg_co2) FROM daily_totals WHERE user_id = ? AND log_date BETWEEN ? AND ?",
+                (self.user_id, start, end),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT TOTAL(kg_co2) FROM daily_category_totals "
+                "WHERE user_id = ? AND log_date BETWEEN ? AND ? AND category = ?",
+                (self.user_id, start, end, rule[2]),
+            ).fetchone()
+        return round(row[0], 6)
+
+    # Each budget with its window around a day (default today) and the kg in it:
+    # [(id, period, category, limit_kg, start, end, kg)]
+    def status(self, day_s: str = None) -> list:
+        with self.lock, snapshot() as conn:
+            self.refresh(conn)
+            out = []
+            for rule in self.rules:
+                start, end = periodSpan(rule[1], day_s or fmtDate(date.today()))
+                kg = self.sums.get((rule[0], start))
+                if kg is None:
+                    kg = self.sums[(rule[0], start)] = self.windowSum(conn, rule, start, end)
+                out.append(rule + (start, end, kg))
+            return out
+
+    # Apply one write's (day, category, kg) changes (kg negative for deletes).
+    # gens is the user's totals generation (before, after) the write: sums
+    # read just before it are moved by its kg. Windows not summed yet are read
+    # from the totals tables, which already include the write; one read after
+    # later writes too still decides the alert but is not kept.
+    def touchAll(self, changes, gens):
+        before, after = gens
+        crossed = []
+        with self.lock:
+            with snapshot() as conn:
+                if self.gen != before:
+                    self.read(conn)
+                    after = self.gen
+                if not self.rules:
+                    self.gen = after
+                    return
+
+                moved = {}
+                for day_s, cat, kg in changes:
+                    for rule in self.rules:
+                        if rule[2] is None or rule[2] == cat:
+                            key = (rule, periodSpan(rule[1], day_s))
+                            moved[key] = moved.get(key, 0.0) + kg
+
+                if len(self.sums) + len(moved) > MAX_WINDOWS:
+                    self.sums = {}
+                keep = totalsGen(conn, self.user_id) == after
+                for (rule, (start, end)), kg in moved.items():
+                    key = (rule[0], start)
+                    if key in self.sums:
+                        new = self.sums[key] = round(self.sums[key] + kg, 6)
+                    else:
+                        new = self.windowSum(conn, rule, start, end)
+                        if keep:
+                            self.sums[key] = new
+                    if round(new - kg, 6) <= rule[3] < new:
+                        crossed.append((self.user_id, rule[0], start, round(new, 3)))
+                self.gen = after
+
+            if crossed:
+                with db() as conn:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO alerts (user_id, budget_id, period_start, kg_co2) VALUES (?, ?, ?, ?)",
+                        crossed,
+                    )
+
+
+BUDGETS = {}  # user id -> BudgetEngine
+_budgets_lock = threading.Lock()
+
+
+# The budget engine for one user, created on first use
+def budgetFor(user_id: int = DEFAULT_USER) -> BudgetEngine:
+    with _budgets_lock:
+        engine = BUDGETS.get(user_id)
+        if engine is None:
+            engine = BUDGETS[user_id] = BudgetEngine(user_id)
+        return engine
+
+
+# Read the users' streaks and budget sums again from the totals tables after a
+# change that moved many days at once (recalculation, sync); engines not yet
+# loaded are left be. Such changes raise no budget alerts.
+def reloadUsers(user_ids):
+    VIEWS.invalidate({user_id: None for user_id in user_ids})
+    for user_id in user_ids:
+        for engines in (STREAKS, BUDGETS):
+            engine = engines.get(user_id)
+            if engine is not None:
+                engine.load()
+
+
+# Calculating continuous streak of GOOD days (aka GOODLIMIT)
+def streakShow(user_id: int = DEFAULT_USER) -> int:
+    return streakFor(user_id).current()
+
+
+# Insert validated (user_id, log_date, category, amount, hours, note) logs in
+# one transaction, returning (id, kg CO2) for each. Each user's logs are one
+# journal entry, so one undo takes them all back out.
+def addLogs(logs: list) -> list:
+    added = []
+    with db() as conn:
+        started = startTotals(conn, [log[0] for log in logs])
+        cur = conn.cursor()
+        for user_id, day_s, cat, amount, hrs, note in logs:
+            kg = Emissions(cat, amount, hrs, day_s)
+            cur.execute(
+                "INSERT INTO logs (user_id, log_date, category, amount, duration_hours, kg_co2, note) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, day_s, cat, amount, hrs, kg, note if note else None),
+            )
+            added.append((cur.lastrowid, kg))
+
+        owners = {}
+        for log, (log_id, _) in zip(logs, added):
+            owners.setdefault(log[0], []).append(log_id)
+        for user_id, ids in owners.items():
+            journalEntry(conn, user_id, "add", ids)
+        gens = endTotals(conn, started)
+
+    touchDays([(log[0], log[1], log[2], kg) for log, (_, kg) in zip(logs, added)], 1, gens)
+    return added
+
+
+# Insert one validated log and return its kg CO2
+def saveLog(day_s: str, cat: str, amount: float, hrs: float, note: str, user_id: int = DEFAULT_USER) -> float:
+    return addLogs([(user_id, day_s, cat, amount, hrs, note)])[0][1]
+
+
+# Move the streaks and budgets by logs (user_id, log_date, category, kg) that
+# came (sign 1) or went (sign -1) in a write with the given generations
+def touchDays(logs, sign: int, gens: dict):
+    cats = {}
+    for user_id, day_s, cat, kg in logs:
+        count, total = cats.get((user_id, day_s, cat), (0, 0.0))
+        cats[(user_id, day_s, cat)] = (count + sign, total + sign * kg)
+    touchTotals(cats, gens)
+
+
+# Feed {(user_id, log_date, category): (count, kg)} changes to the users' streak
+# engines, one change per user and day, and to their budget engines, and drop
+# the cached views of those days. gens is the write's {user_id: (generation
+# before, after)} from storage.endTotals; a user without a users row has none,
+# and their engines read everything each time anyway.
+def touchTotals(cats: dict, gens: dict):
+    days, budgets = {}, {}
+    for (user_id, day_s, cat), (count, kg) in cats.items():
+        n, total = days.get((user_id, day_s), (0, 0.0))
+        days[(user_id, day_s)] = (n + count, total + kg)
+        budgets.setdefault(user_id, []).append((day_s, cat, kg))
+    streaks = {}
+    for (user_id, day_s), (count, kg) in days.items():
+        streaks.setdefault(user_id, []).append((day_s, count, kg))
+    VIEWS.invalidate({user_id: [day_s for day_s, _, _ in changes] for user_id, changes in streaks.items()})
+    for user_id, changes in streaks.items():
+        if user_id in gens:
+            streakFor(user_id).touchAll(changes, gens[user_id])
+    for user_id, changes in budgets.items():
+        if user_id in gens:
+            budgetFor(user_id).touchAll(changes, gens[user_id])
+
+
+# Delete logs by id in one transaction, returning the ones deleted as
+# (user_id, row in HistoryPager.COLUMNS order). The rows are only marked
+# deleted; each owner's share is one journal entry, so undo brings them back.
+# With a user_id, only that user's logs can be deleted.
+def deleteLogs(ids: list, user_id: int = None) -> list:
+    # The unary + keep the user's index out of it: each id is looked up by primary key
+    query = (
+        f"SELECT user_id, {HistoryPager.COLUMNS} FROM logs "
+        "WHERE id IN (SELECT value FROM json_each(?)) AND +deleted IS NULL"
+    )
+    params = [json.dumps([int(i) for i in ids])]
+    if user_id is not None:
+        query += " AND +user_id = ?"
+        params.append(user_id)
+
+    with db() as conn:
+        # IMMEDIATE: no other writer can delete the logs between the read and the update
+        conn.execute("BEGIN IMMEDIATE")
+        found = conn.execute(query, params).fetchall()
+        owners = {}
+        for row in found:
+            owners.setdefault(row[0], []).append(row[7])
+        started = startTotals(conn, owners)
+        for owner, owned in owners.items():
+            entry = journalEntry(conn, owner, "delete", owned)
+            conn.execute(
+                "UPDATE logs SET deleted = ?1 WHERE id IN (SELECT log_id FROM journal_logs WHERE entry_id = ?1)",
+                (entry,),
+            )
+        gens = endTotals(conn, started)
+
+    touchDays([(row[0], row[1], row[2], row[5]) for row in found], -1, gens)
+    return [(row[0], row[1:]) for row in found]
+
+
+# Delete logs by id in one transaction, returning the ids that existed.
+# With a user_id, only that user's logs can be deleted.
+def removeLogs(ids: list, user_id: int = None) -> list:
+    return [row[6] for _, row in deleteLogs(ids, user_id)]
+
+
+# Delete one log by id
+def removeLog(log_id, user_id: int = None):
+    removeLogs([log_id], user_id)
+
+
+# Undo the user's latest add or delete (or, with redo, redo the latest undone
+# one) in one transaction. Returns (action, logs changed) of the entry, or None
+# when there is nothing to undo/redo.
+def undoLast(user_id: int = DEFAULT_USER, redo: bool = False):
+    with db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT id, action FROM journal WHERE user_id = ? AND undone = ? ORDER BY id "
+            + ("LIMIT 1" if redo else "DESC LIMIT 1"),
+            (user_id, int(redo)),
+        ).fetchone()
+        if row is None:
+            return None
+        entry, action = row
+        started = startTotals(conn, [user_id])
+
+        # Undoing an add or redoing a delete hides the entry's logs; the other two bring them back
+        hide = (action == "add") != redo
+        if hide:
+            changed = conn.execute(
+                "UPDATE logs SET deleted = ?1 WHERE deleted IS NULL "
+                "AND id IN (SELECT log_id FROM journal_logs WHERE entry_id = ?1) RETURNING user_id, log_date, category, kg_co2",
+                (entry,),
+            ).fetchall()
+        else:
+            changed = conn.execute(
+                "UPDATE logs SET deleted = NULL WHERE user_id = ? AND deleted = ? RETURNING user_id, log_date, category, kg_co2",
+                (user_id, entry),
+            ).fetchall()
+        conn.execute("UPDATE journal SET undone = ? WHERE id = ?", (int(not redo), entry))
+        gens = endTotals(conn, started)
+
+    touchDays(changed, -1 if hide else 1, gens)
+    return action, len(changed)
+
+
+def redoLast(user_id: int = DEFAULT_USER):
+    return undoLast(user_id, redo=True)
+
+
+# Today's total, streak and newest logs for the Add logs tab. Total and logs
+# come from the query cache until today is written to; the streak is kept in
+# memory anyway.
+def todayView(user_id: int = DEFAULT_USER):
+    today = fmtDate(date.today())
+    total, rows = VIEWS.get((user_id, today, today), dayView, user_id, today)
+    return total, streakShow(user_id), rows
+
+
+# One day's kg total (kept by daily_totals) and newest logs
+def dayView(user_id: int, day_s: str):
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT category, amount, duration_hours, kg_co2, id FROM logs "
+            "WHERE user_id = ? AND deleted IS NULL AND log_date = ? ORDER BY id DESC LIMIT ?",
+            (user_id, day_s, TODAY_ROWS),
+        )
+        rows = cur.fetchall()
+    return dayTotal(day_s, user_id)[1], rows
+
+
+# The History tab's pager for a date filter (None: every day) and, with text,
+# a note search, from the query cache while none of the days it shows has been
+# written to. The cached pager is shared, so it is never patched: after its own
+# writes the caller patches a copy() instead.
+def historyView(day_s: str = None, user_id: int = None, text: str = None):
+    scope = (user_id, day_s, day_s)
+    if text:
+        return VIEWS.get(scope, NoteSearch, text, day_s, user_id)
+    return VIEWS.get(scope, HistoryPager, day_s, user_id)
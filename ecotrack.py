@@ -0,0 +1,435 @@
+import argparse
+import sys
+from datetime import date, timedelta
+
+import profiling
+import storage
+from core import (
+    TRANSPORT,
+    GOODLIMIT,
+    checkLog,
+    deleteLogs,
+    fmtDate,
+    parseDay,
+    redoLast,
+    refreshFactors,
+    saveLog,
+    streakShow,
+    totalLimit,
+    undoLast,
+)
+
+
+# Accept a category's full name or its short form ("car", "metro/train")
+def matchCategory(name: str) -> str:
+    if name in TRANSPORT:
+        return name
+    wanted = name.strip().lower()
+    for cat in TRANSPORT:
+        if cat.lower() == wanted or cat.split(": ", 1)[-1].lower() == wanted:
+            return cat
+    raise ValueError(f"Invalid category: {name} (choose from {', '.join(TRANSPORT)})")
+
+
+def cmdAdd(args):
+    day_s, cat, amount, hrs = checkLog(args.date, matchCategory(args.category), args.amount, args.hours)
+    kg = saveLog(day_s, cat, amount, hrs, args.note, args.user_id)
+    print(f"Added: {kg:.3f} kg CO₂ ({cat}, {day_s})")
+    printAlerts(args.user_id)
+
+
+# Print the user's budget alerts not shown yet
+def printAlerts(user_id: int):
+    from budgets import alertText, newAlerts
+
+    for alert in newAlerts(user_id):
+        print("Alert: " + alertText(alert))
+
+
+def cmdToday(args):
+    count, total = storage.dayTotal(fmtDate(date.today()), args.user_id)
+    print(f"{total:.3f} kg CO₂ today from {count} log{'s' if count != 1 else ''}")
+    print(f"Rating: {totalLimit(total)}")
+
+
+def cmdHistory(args):
+    pager = storage.HistoryPager(parseDay(args.date) if args.date else None, None if args.all else args.user_id)
+    for r in pager.rows(args.offset, args.limit):
+        print(f"{r[0]}  {r[1]:<20} {r[2]:>8g} {r[3]:>6g}h {r[4]:>9.3f} kg  #{r[6]}  {r[5]}")
+    shown = min(args.limit, max(0, pager.count - args.offset))
+    print(f"Showing {shown} of {pager.count} logs. Total: {pager.total:.3f} kg CO₂")
+
+
+def cmdSearch(args):
+    search = storage.NoteSearch(args.text, parseDay(args.date) if args.date else None,
+                                None if args.all else args.user_id)
+    for r in search.rows(args.offset, args.limit):
+        print(f"{r[0]}  {r[1]:<20} {r[2]:>8g} {r[3]:>6g}h {r[4]:>9.3f} kg  #{r[6]}  {r[5]}")
+    shown = min(args.limit, max(0, search.count - args.offset))
+    print(f"Showing {shown} of {search.count} matching logs. Total: {search.total:.3f} kg CO₂")
+
+
+def cmdDelete(args):
+    deleted = deleteLogs(args.ids, args.user_id)
+    print(f"Deleted {len(deleted)} log{'s' if len(deleted) != 1 else ''}")
+    missing = sorted(set(args.ids) - {row[6] for _, row in deleted})
+    archived = [i for i in missing if storage.isArchived(i)]
+    if archived:
+        print("Archived, so they cannot be deleted: " + ", ".join(f"#{i}" for i in archived))
+    missing = [i for i in missing if i not in archived]
+    if missing:
+        print("Not found: " + ", ".join(f"#{i}" for i in missing))
+    return 1 if archived or missing else 0
+
+
+def cmdUndo(args):
+    done = (redoLast if args.command == "redo" else undoLast)(args.user_id)
+    if done is None:
+        print(f"Nothing to {args.command}")
+        return 1
+    action, logs = done
+    print(f"{args.command.capitalize()}: {action} of {logs} log{'s' if logs != 1 else ''}")
+    printAlerts(args.user_id)
+
+
+def cmdStreak(args):
+    streak = streakShow(args.user_id)
+    print(f"Streak: {streak} day{'s' if streak != 1 else ''} (daily total ≤ {GOODLIMIT} kg CO₂)")
+
+
+def cmdImport(args):
+    from bulk import importLogs
+
+    report = importLogs(args.path, strict=args.strict, user_id=args.user_id)
+    print(f"Imported {report['rows']} rows ({report['skipped']} skipped) "
+          f"in {report['seconds']}s: {report['rows_per_sec']} rows/sec")
+    for error in report["errors"]:
+        print("  " + error)
+    printAlerts(args.user_id)
+
+
+def cmdImportTracks(args):
+    from tracks import importTracks
+
+    category = matchCategory(args.category) if args.category else None
+    report = importTracks(args.paths, category, args.user_id, args.strict)
+    print(f"Imported {report['trips']} trips ({report['skipped']} skipped), {report['km']:g} km from "
+          f"{report['points']} points in {report['seconds']}s: {report['points_per_sec']} points/sec")
+    for cat, trips in sorted(report["categories"].items()):
+        print(f"  {cat:<22} {trips} trip{'s' if trips != 1 else ''}")
+    for error in report["errors"]:
+        print("  " + error)
+    printAlerts(args.user_id)
+
+
+def cmdExport(args):
+    from bulk import exportLogs
+
+    report = exportLogs(args.path, None if args.all else args.user_id)
+    print(f"Exported {report['rows']} rows in {report['seconds']}s: {report['rows_per_sec']} rows/sec")
+
+
+def cmdArchive(args):
+    from bulk import archiveLogs
+
+    before = args.before
+    if before is None and args.days is not None:
+        before = fmtDate(date.today() - timedelta(days=args.days))
+    report = archiveLogs(before, args.vacuum)
+    print(f"Archived {report['rows']} logs dated before {report['before']} into {report['segments']} "
+          f"segment{'s' if report['segments'] != 1 else ''} in {report['seconds']}s: "
+          f"{report['rows_per_sec']} rows/sec")
+    print(f"Database {report['db_bytes']} bytes, archive {report['archive_bytes']} bytes")
+
+
+def cmdCompact(args):
+    from bulk import compactLogs
+
+    report = compactLogs(args.forget, args.vacuum)
+    print(f"Purged {report['rows']} deleted logs in {report['seconds']}s: {report['rows_per_sec']} rows/sec")
+    print(f"Database {report['db_bytes']} bytes")
+
+
+def cmdSync(args):
+    from sync import syncWith
+
+    report = syncWith(args.target)
+    for way in ("pulled", "pushed"):
+        r = report[way]
+        print(f"{way.capitalize()} {r['changes']} changes: {r['added']} added, {r['deleted']} deleted, "
+              f"{r['restored']} restored")
+        if "stopped" in r:
+            print(f"{way.capitalize()} only in part: {r['stopped']}")
+    print(f"Synced in {report['seconds']}s: {report['changes_per_sec']} changes/sec")
+
+
+def cmdBudgets(args):
+    from budgets import budgetText, listBudgets
+
+    budgets = listBudgets(args.user_id)
+    for budget_id, period, category, limit_kg, start, end, kg in budgets:
+        print(f"#{budget_id:<4} {budgetText(period, category, limit_kg):<48} {kg:>9.3f} kg from {start} to {end}")
+    if not budgets:
+        print("No budgets")
+
+
+def cmdAddBudget(args):
+    from budgets import addBudget, budgetText
+
+    category = matchCategory(args.category) if args.category else None
+    budget_id = addBudget(args.user_id, args.period, args.kg, category)
+    print(f"Added budget #{budget_id}: {budgetText(args.period, category, float(args.kg))}")
+    printAlerts(args.user_id)
+
+
+def cmdRemoveBudget(args):
+    from budgets import removeBudget
+
+    if not removeBudget(args.user_id, args.id):
+        print(f"Not found: #{args.id}")
+        return 1
+    print(f"Removed budget #{args.id}")
+
+
+def cmdAlerts(args):
+    from budgets import alertText, listAlerts, newAlerts
+
+    alerts = listAlerts(args.user_id, args.limit)
+    newAlerts(args.user_id)  # listed here, so they count as shown
+    for alert in alerts:
+        print(f"{alert[3]}  {'' if alert[4] else '(new) '}{alertText(alert)}")
+    if not alerts:
+        print("No alerts")
+
+
+def cmdReport(args):
+    from reports import writeReports
+
+    report = writeReports(args.month, args.out, args.format, None if args.all else args.user_id,
+                          args.workers, args.force)
+    print(f"Wrote {report['written']} {args.format.upper()} reports for {report['month']} "
+          f"({report['skipped']} unchanged, skipped) to {report['directory']} "
+          f"in {report['seconds']}s: {report['reports_per_sec']} reports/sec")
+
+
+def cmdUsers(args):
+    for user_id, name, created in storage.listUsers():
+        print(f"{user_id:>5}  {name}  (since {created})")
+
+
+def cmdRebuildTotals(args):
+    storage.rebuildTotals()
+    print("daily totals rebuilt")
+
+
+def cmdVerifyTotals(args):
+    bad = storage.verifyTotals()
+    print("daily totals OK" if not bad else "Mismatched dates: " + ", ".join(bad))
+    return 1 if bad else 0
+
+
+def cmdFactors(args):
+    from factors import listFactors
+
+    for category, since, unit, per_unit, per_hour in listFactors():
+        print(f"{category:<22} from {since}  {per_unit:g} kg/{unit}  {per_hour:g} kg/h")
+
+
+def cmdLoadFactors(args):
+    from factors import loadFactors
+
+    report = loadFactors(args.path)
+    print(f"Loaded {report['factors']} factor versions for {', '.join(report['categories']) or 'no categories'}")
+    if args.recalc and report["since"]:
+        args.since, args.category = report["since"], report["categories"]
+        cmdRecalc(args)
+
+
+def cmdRecalc(args):
+    from factors import recalcEmissions
+
+    report = recalcEmissions(args.since, args.category or None)
+    print(f"Recalculated {report['rows']} logs on {report['days']} days "
+          f"in {report['seconds']}s: {report['rows_per_sec']} rows/sec")
+    if report["archived"]:
+        print(f"Skipped {report['archived']} archived logs; they and their days' totals keep their old kg CO₂",
+              file=sys.stderr)
+
+
+def cmdServe(args):
+    from server import serve
+
+    serve(args.host, args.port)
+
+
+# Tk and PIL are only imported when the window is actually wanted
+def cmdGui(args):
+    from Eviproject import Main
+
+    Main(args.user_id).mainloop()
+
+
+def buildParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="ecotrack", description="EcoTrack carbon footprint logs")
+    parser.add_argument("--db", help=f"database file (default {storage.FILE})")
+    parser.add_argument("--user", default="default", help="whose logs to use (created on first use)")
+    parser.add_argument(
+        "--profile",
+        metavar="OUT",
+        help=f"record timings and query counts; OUT is a .json Chrome trace, a report file or 1 for stderr "
+             f"(same as {profiling.ENV})",
+    )
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("add", help="log one trip")
+    p.add_argument("category", help="e.g. car, bus, metro/train, motorcycle")
+    p.add_argument("amount", help="distance in km")
+    p.add_argument("--hours", default="0", help="time spent (hours)")
+    p.add_argument("--date", default=fmtDate(date.today()), help="YYYY-MM-DD (default today)")
+    p.add_argument("--note", default="")
+    p.set_defaults(run=cmdAdd)
+
+    p = sub.add_parser("today", help="today's total and rating")
+    p.set_defaults(run=cmdToday)
+
+    p = sub.add_parser("history", help="list logs, newest first")
+    p.add_argument("--date", help="only this day (YYYY-MM-DD)")
+    p.add_argument("--limit", type=int, default=50)
+    p.add_argument("--offset", type=int, default=0)
+    p.add_argument("--all", action="store_true", help="every user's logs")
+    p.set_defaults(run=cmdHistory)
+
+    p = sub.add_parser("search", help="logs whose note matches, best match first")
+    p.add_argument("text", help='words to find; "word*" matches a prefix')
+    p.add_argument("--date", help="only this day (YYYY-MM-DD)")
+    p.add_argument("--limit", type=int, default=50)
+    p.add_argument("--offset", type=int, default=0)
+    p.add_argument("--all", action="store_true", help="every user's logs")
+    p.set_defaults(run=cmdSearch)
+
+    p = sub.add_parser("delete", help="delete logs by id")
+    p.add_argument("ids", type=int, nargs="+", metavar="ID")
+    p.set_defaults(run=cmdDelete)
+
+    p = sub.add_parser("undo", help="undo the latest add or delete")
+    p.set_defaults(run=cmdUndo)
+
+    p = sub.add_parser("redo", help="redo the latest undone add or delete")
+    p.set_defaults(run=cmdUndo)
+
+    p = sub.add_parser("streak", help="current streak of GOOD days")
+    p.set_defaults(run=cmdStreak)
+
+    p = sub.add_parser("import", help="import a .csv, .json or .jsonl file of trips")
+    p.add_argument("path")
+    p.add_argument("--strict", action="store_true", help="stop at the first invalid row")
+    p.set_defaults(run=cmdImport)
+
+    p = sub.add_parser("import-tracks", help="log each track in .gpx/.geojson files as a trip")
+    p.add_argument("paths", nargs="+", metavar="PATH", help="track files, or directories to search for them")
+    p.add_argument("--category", help="category of every trip (default: guessed from each trip's speeds)")
+    p.add_argument("--strict", action="store_true", help="stop at the first unreadable track")
+    p.set_defaults(run=cmdImportTracks)
+
+    p = sub.add_parser("export", help="export logs to .csv, .json or .jsonl")
+    p.add_argument("path")
+    p.add_argument("--all", action="store_true", help="every user's logs")
+    p.set_defaults(run=cmdExport)
+
+    p = sub.add_parser("archive", help="move old logs into the compact read-only archive")
+    when = p.add_mutually_exclusive_group()
+    when.add_argument("--before", help="archive logs dated before this day (YYYY-MM-DD)")
+    when.add_argument("--days", type=int, help="archive logs older than this many days (default 730)")
+    p.add_argument("--vacuum", action="store_true", help="shrink the database file afterwards")
+    p.set_defaults(run=cmdArchive)
+
+    p = sub.add_parser("compact", help="purge deleted logs that can no longer be undone")
+    p.add_argument("--forget", action="store_true", help="drop the undo history first, purging every deleted log")
+    p.add_argument("--vacuum", action="store_true", help="shrink the database file afterwards")
+    p.set_defaults(run=cmdCompact)
+
+    p = sub.add_parser("sync", help="exchange new logs and deletes with another database")
+    p.add_argument("target", help="another ecotrack .db file, or the URL of an `ecotrack.py serve` server")
+    p.set_defaults(run=cmdSync)
+
+    p = sub.add_parser("budgets", help="list budgets and this period's kg CO₂ against them")
+    p.set_defaults(run=cmdBudgets)
+
+    p = sub.add_parser("add-budget", help="alert when a day, week or month goes over a kg CO₂ limit")
+    p.add_argument("period", choices=("day", "week", "month"))
+    p.add_argument("kg", help="limit in kg CO₂")
+    p.add_argument("--category", help="only count this category, e.g. car")
+    p.set_defaults(run=cmdAddBudget)
+
+    p = sub.add_parser("remove-budget", help="remove a budget and its alerts")
+    p.add_argument("id", type=int)
+    p.set_defaults(run=cmdRemoveBudget)
+
+    p = sub.add_parser("alerts", help="budget alerts, newest first")
+    p.add_argument("--limit", type=int, default=50)
+    p.set_defaults(run=cmdAlerts)
+
+    p = sub.add_parser("report", help="draw monthly footprint reports as PNG or PDF")
+    p.add_argument("--month", help="YYYY-MM (default this month)")
+    p.add_argument("--format", choices=("png", "pdf"), default="png")
+    p.add_argument("--out", default="reports", help="directory; reports go in OUT/YYYY-MM/ (default reports)")
+    p.add_argument("--all", action="store_true", help="every user with logs that month")
+    p.add_argument("--workers", type=int, help="processes drawing reports (default one per CPU)")
+    p.add_argument("--force", action="store_true", help="draw reports again even if their totals have not changed")
+    p.set_defaults(run=cmdReport)
+
+    p = sub.add_parser("users", help="list users")
+    p.set_defaults(run=cmdUsers)
+
+    p = sub.add_parser("rebuild-totals", help="recompute daily_totals from logs")
+    p.set_defaults(run=cmdRebuildTotals)
+
+    p = sub.add_parser("verify-totals", help="check daily_totals against logs")
+    p.set_defaults(run=cmdVerifyTotals)
+
+    p = sub.add_parser("factors", help="list emission factor versions")
+    p.set_defaults(run=cmdFactors)
+
+    p = sub.add_parser("load-factors", help="add factor versions from a .csv/.json file")
+    p.add_argument("path")
+    p.add_argument("--recalc", action="store_true", help="recalculate the logs the new versions apply to")
+    p.set_defaults(run=cmdLoadFactors)
+
+    p = sub.add_parser("recalc", help="recalculate kg CO₂ of stored logs from the factor versions")
+    p.add_argument("--since", help="only logs on or after this day (YYYY-MM-DD)")
+    p.add_argument("--category", action="append", help="only this category (repeatable)")
+    p.set_defaults(run=cmdRecalc)
+
+    p = sub.add_parser("serve", help="run the HTTP/JSON API")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.set_defaults(run=cmdServe)
+
+    p = sub.add_parser("gui", help="open the EcoTrack window (default)")
+    p.set_defaults(run=cmdGui)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = buildParser().parse_args(argv)
+    if args.profile:
+        profiling.enable(args.profile)
+    if args.db:
+        storage.useFile(args.db)
+    with profiling.span("cli.createDtb", "startup"):
+        storage.createDtb()
+        refreshFactors()
+
+    run = getattr(args, "run", cmdGui)
+    try:
+        args.user_id = storage.userId(args.user)
+        with profiling.span(f"cli.{args.command or 'gui'}", "command"):
+            return run(args) or 0
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
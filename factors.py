@@ -0,0 +1,111 @@
+import csv
+import json
+import time
+
+from storage import FIRST_DAY, archiveSegments, db, recalcChunk
+from core import parseDay, refreshFactors, reloadUsers
+
+# Log ids per recalculation transaction; other writers get the database
+# between chunks, so a long recalculation never holds the GUI up
+RECALC_CHUNK = 50000
+
+# Columns of a factors file (CSV header or JSON keys)
+FIELDS = ("category", "effective_from", "unit", "kg_per_unit", "kg_per_hour")
+
+
+# Records from a .csv file or a .json array / .jsonl file of factor versions
+def readFactors(path: str) -> list:
+    lower = path.lower()
+    with open(path, newline="", encoding="utf-8") as f:
+        if lower.endswith(".csv"):
+            return list(csv.DictReader(f))
+        if lower.endswith((".jsonl", ".ndjson")):
+            return [json.loads(line) for line in f if line.strip()]
+        if lower.endswith(".json"):
+            data = json.load(f)
+            return data.get("factors", []) if isinstance(data, dict) else data
+    raise ValueError(f"Unknown file type for {path} (use .csv, .json or .jsonl)")
+
+
+# Validate one factor version into a row for emission_factors
+def toFactor(record: dict) -> tuple:
+    category = str(record.get("category") or "").strip()
+    if not category:
+        raise ValueError("category is required")
+    since = parseDay(str(record.get("effective_from") or FIRST_DAY))
+    per_unit = float(record.get("kg_per_unit"))
+    per_hour = float(record.get("kg_per_hour") or 0)
+    if per_unit < 0 or per_hour < 0:
+        raise ValueError("factors must be ≥ 0")
+    return category, since, str(record.get("unit") or "km").strip(), per_unit, per_hour
+
+
+# Add or replace factor versions from a file. Returns how many were written and
+# the earliest date they affect, which is where a recalculation has to start.
+def loadFactors(path: str) -> dict:
+    rows = []
+    for number, record in enumerate(readFactors(path), start=1):
+        try:
+            rows.append(toFactor(record))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"{path} entry {number}: {e}")
+
+    with db() as conn:
+        conn.executemany(
+            "INSERT INTO emission_factors (category, effective_from, unit, kg_per_unit, kg_per_hour) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT(category, effective_from) DO UPDATE SET "
+            "unit = excluded.unit, kg_per_unit = excluded.kg_per_unit, kg_per_hour = excluded.kg_per_hour",
+            rows,
+        )
+    refreshFactors()
+    return {
+        "factors": len(rows),
+        "since": min((r[1] for r in rows), default=None),
+        "categories": sorted({r[0] for r in rows}),
+    }
+
+
+# Every factor version as (category, effective_from, unit, kg_per_unit, kg_per_hour)
+def listFactors() -> list:
+    with db() as conn:
+        return conn.execute(
+            "SELECT category, effective_from, unit, kg_per_unit, kg_per_hour FROM emission_factors "
+            "ORDER BY category, effective_from"
+        ).fetchall()
+
+
+# Re-derive kg_co2 of logs dated since or later (optionally only some
+# categories) from the current factor versions, RECALC_CHUNK ids per
+# transaction. progress(done, total) is called after each chunk. Archived logs
+# are read-only and keep their kg, and so do the totals of their days; the
+# report counts them as "archived".
+def recalcEmissions(since: str = None, categories=None, chunk: int = RECALC_CHUNK, progress=None) -> dict:
+    since = parseDay(since) if since else FIRST_DAY
+    conn = db()
+    started = time.perf_counter()
+    lo, hi = conn.execute("SELECT MIN(id), MAX(id) FROM logs").fetchone()
+    changed = 0
+    days = set()
+
+    if lo is not None:
+        for start in range(lo, hi + 1, chunk):
+            logs = recalcChunk(conn, start, min(hi, start + chunk - 1), since, categories)
+            changed += len(logs)
+            days.update(logs)
+            if progress is not None:
+                progress(min(hi, start + chunk - 1) - lo + 1, hi - lo + 1)
+
+    # Day totals moved, so streaks and budget sums are read again from them
+    users = {user_id for user_id, _ in days}
+    reloadUsers(users)
+    archived = sum(seg.countSince(since, categories) for seg in archiveSegments())
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows": changed,
+        "days": len(days),
+        "users": len(users),
+        "archived": archived,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(changed / seconds) if seconds > 0 else 0,
+    }
@@ -0,0 +1,178 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import storage
+
+# Set ECOTRACK_PROFILE (or pass --profile to ecotrack.py) to record timings.
+# Its value says where they go at exit: a path ending in .json gets a Chrome
+# trace (chrome://tracing, Perfetto), any other path a text report, and "1"
+# prints the report to stderr.
+ENV = "ECOTRACK_PROFILE"
+
+# Finished spans: (name, category, thread id, start, seconds, queries)
+_spans = []
+_threads = {}  # thread id -> name, for the trace
+_lock = threading.Lock()
+_target = None
+_origin = time.perf_counter()
+
+
+def enabled() -> bool:
+    return _target is not None
+
+
+# Start recording; the results are written to target when the process exits
+def enable(target: str = "1"):
+    global _target
+    if _target is None:
+        atexit.register(dump)
+    _target = target
+
+
+def record(name: str, category: str, start: float, seconds: float, queries: int = 0):
+    thread = threading.current_thread()
+    with _lock:
+        _spans.append((name, category, thread.ident, start, seconds, queries))
+        _threads.setdefault(thread.ident, thread.name)
+
+
+# Time a block and count the SQL statements this thread ran inside it:
+#     with span("startup.createDtb", "startup"): createDtb()
+@contextmanager
+def span(name: str, category: str = "app"):
+    if _target is None:
+        yield
+        return
+    queries = storage.threadQueries()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, category, start, time.perf_counter() - start, storage.threadQueries() - queries)
+
+
+# Consecutive phases of one long function without re-indenting it: each
+# lap(name) records the time (and queries) since the previous lap.
+#     laps = Laps("startup"); createDtb(); laps.lap("startup.createDtb")
+class Laps:
+    def __init__(self, category: str = "app"):
+        self.category = category
+        self.mark()
+
+    def mark(self):
+        self.start = time.perf_counter()
+        self.queries = storage.threadQueries()
+
+    def lap(self, name: str):
+        if _target is not None:
+            record(name, self.category, self.start, time.perf_counter() - self.start,
+                   storage.threadQueries() - self.queries)
+        self.mark()
+
+
+# Decorator form of span for handlers, named after the function. Costs one
+# check per call while profiling is off.
+def timed(fn=None, *, category: str = "handler"):
+    if fn is None:
+        return lambda f: timed(f, category=category)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _target is None:
+            return fn(*args, **kwargs)
+        with span(fn.__qualname__, category):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+# Per-name totals, slowest total first
+def summary() -> list:
+    with _lock:
+        spans = list(_spans)
+    groups = {}
+    for name, category, _, _, seconds, queries in spans:
+        groups.setdefault((category, name), []).append((seconds, queries))
+
+    rows = []
+    for (category, name), items in groups.items():
+        times = sorted(s for s, _ in items)
+        total = sum(times)
+        rows.append({
+            "name": name,
+            "category": category,
+            "calls": len(times),
+            "total_ms": round(total * 1000, 3),
+            "mean_ms": round(total / len(times) * 1000, 3),
+            "p95_ms": round(times[min(len(times) - 1, int(0.95 * len(times)))] * 1000, 3),
+            "max_ms": round(times[-1] * 1000, 3),
+            "queries": sum(q for _, q in items),
+        })
+    rows.sort(key=lambda r: r["total_ms"], reverse=True)
+    return rows
+
+
+def report() -> str:
+    rows = summary()
+    counts = storage.stats()
+    lines = [
+        f"EcoTrack profile: {time.perf_counter() - _origin:.3f}s, {sum(r['calls'] for r in rows)} spans",
+        f"{counts['queries']} queries, {counts['connects']} connects; query cache {counts['cache_hits']} hits, "
+        f"{counts['cache_misses']} misses",
+        f"{'name':<34} {'category':<9} {'calls':>6} {'total ms':>10} {'mean ms':>9} "
+        f"{'p95 ms':>9} {'max ms':>9} {'queries':>8}",
+    ]
+    for r in rows:
+        lines.append(
+            f"{r['name'][:34]:<34} {r['category']:<9} {r['calls']:>6} {r['total_ms']:>10.3f} {r['mean_ms']:>9.3f} "
+            f"{r['p95_ms']:>9.3f} {r['max_ms']:>9.3f} {r['queries']:>8}"
+        )
+    return "\n".join(lines)
+
+
+# Chrome trace event format: one complete ("X") event per span, in microseconds
+def trace() -> dict:
+    pid = os.getpid()
+    with _lock:
+        spans = list(_spans)
+        threads = dict(_threads)
+    events = [
+        {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+        for tid, name in threads.items()
+    ]
+    for name, category, tid, start, seconds, queries in spans:
+        events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "pid": pid,
+            "tid": tid,
+            "ts": round((start - _origin) * 1e6, 1),
+            "dur": round(seconds * 1e6, 1),
+            "args": {"queries": queries},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": storage.stats()}
+
+
+def dump(target: str = None):
+    target = target or _target
+    if not target:
+        return
+    if target == "1":
+        print(report(), file=sys.stderr)
+    elif target.lower().endswith(".json"):
+        with open(target, "w", encoding="utf-8") as f:
+            json.dump(trace(), f)
+    else:
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(report() + "\n")
+
+
+if os.environ.get(ENV):
+    enable(os.environ[ENV])
@@ -0,0 +1,73 @@
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+import storage
+
+# Results kept before the least recently used one is dropped
+MAX_ENTRIES = 64
+
+
+# Results of read-only views (today's logs, a History filter, an Analytics
+# range) keyed by the function and its arguments, least recently used first.
+# Each result has a scope, (user_id, first day, last day): None for the user is
+# every user's logs and None for a day is no bound. Writes made by this process
+# drop only the results whose scope holds a day they touched (invalidate).
+# Commits from anywhere else (another process, or another connection here)
+# show up as a new PRAGMA data_version on the connection that filled a result,
+# and its results are then read again.
+class QueryCache:
+    def __init__(self, size: int = MAX_ENTRIES):
+        self.size = size
+        self.entries = OrderedDict()  # key -> (scope, (conn, data_version), result)
+        self.lock = threading.Lock()
+
+    # fn(*args), from the cache while nothing in scope has been written since
+    def get(self, scope: tuple, fn, *args):
+        key = (fn.__module__, fn.__qualname__) + args
+        conn = storage.db()
+        version = (conn, conn.execute("PRAGMA data_version").fetchone()[0])
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1][0] is conn and entry[1][1] == version[1]:
+                self.entries.move_to_end(key)
+                storage.countCache(True)
+                return entry[2]
+
+        storage.countCache(False)
+        result = fn(*args)
+        with self.lock:
+            self.entries[key] = (scope, version, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return result
+
+    # Drop the results that logs written on {user_id: [days]} can change;
+    # days None means any day of that user's
+    def invalidate(self, touched: dict):
+        days = {user_id: None if d is None else sorted(d) for user_id, d in touched.items()}
+        with self.lock:
+            stale = [key for key, (scope, _, _) in self.entries.items() if self.covers(scope, days)]
+            for key in stale:
+                del self.entries[key]
+
+    @staticmethod
+    def covers(scope: tuple, days: dict) -> bool:
+        user_id, first, last = scope
+        for owner, written in days.items():
+            if user_id is not None and user_id != owner:
+                continue
+            if written is None:
+                return True
+            i = bisect_left(written, first or "")
+            if i < len(written) and (last is None or written[i] <= last):
+                return True
+        return False
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+VIEWS = QueryCache()
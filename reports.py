@@ -0,0 +1,321 @@
+import calendar
+import hashlib
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date
+from functools import lru_cache
+from itertools import groupby
+
+from storage import db
+from core import GOODLIMIT, OKLIMIT, fmtDate, goodDay, parseDay, totalLimit
+
+# Bump when the layout changes, so every report is drawn again
+REPORT_VERSION = 1
+
+# File formats a report can be saved in, as PIL names them
+FORMATS = {"png": "PNG", "pdf": "PDF"}
+
+# Page size in pixels; PDFs are written at PDF_DPI, which makes it about A4
+PAGE = (900, 1240)
+PDF_DPI = 110
+
+# PNGs are saved with a fixed palette: the colors below, and the shades text
+# edges blend through on its two backgrounds. That is a quarter of the RGB file
+# size and quicker to compress.
+PNG_SHADES = 8
+
+# Jobs queued per worker process; more would only hold rows in memory longer
+QUEUE_PER_WORKER = 4
+
+# Finished reports recorded in the reports table per transaction
+RECORD_BATCH = 500
+
+# Colors, matching the GUI's
+DARK = "#1B3A2F"
+LIGREEN = "#DFF5D8"
+BRGREEN = "#8CCF9A"
+YLW = "#E8D36A"
+HIGH = "#D9534F"
+GRAY = "#8A8A8A"
+
+
+# "YYYY-MM" -> (first day, last day) of that month
+def monthSpan(month: str) -> tuple:
+    first = date.fromisoformat(parseDay(f"{month}-01"))
+    last = first.replace(day=calendar.monthrange(first.year, first.month)[1])
+    return fmtDate(first), fmtDate(last)
+
+
+# Report file name for a user: id first, so two names that clean up the same never clash
+def reportName(user_id: int, name: str, fmt: str) -> str:
+    return f"{user_id}-{re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('._') or 'user'}.{fmt}"
+
+
+# Figures for one user's month from its per-day, per-category totals
+# [(log_date, category, entries, kg)] in date order
+def monthFigures(month: str, rows: list) -> dict:
+    days, cats = {}, {}
+    for day_s, cat, entries, kg in rows:
+        count, total = days.get(day_s, (0, 0.0))
+        days[day_s] = (count + entries, total + kg)
+        count, total = cats.get(cat, (0, 0.0))
+        cats[cat] = (count + entries, total + kg)
+
+    first, last = monthSpan(month)
+    daily = []  # (day of month, entries, kg) for every calendar day
+    run = best = 0
+    good = ok = high = 0
+    for n in range(1, int(last[-2:]) + 1):
+        count, kg = days.get(f"{month}-{n:02d}", (0, 0.0))
+        kg = round(kg, 3)
+        daily.append((n, count, kg))
+        if count:
+            if kg <= GOODLIMIT:
+                good += 1
+            elif kg <= OKLIMIT:
+                ok += 1
+            else:
+                high += 1
+        run = run + 1 if goodDay(count, kg) else 0
+        best = max(best, run)
+
+    total = round(sum(kg for _, _, kg in daily), 3)
+    logged = good + ok + high
+    mean = round(total / logged, 3) if logged else 0.0
+    return {
+        "month": month,
+        "first": first,
+        "last": last,
+        "daily": daily,
+        "categories": sorted(
+            ((cat, count, round(kg, 3)) for cat, (count, kg) in cats.items()), key=lambda c: -c[2]
+        ),
+        "total": total,
+        "entries": sum(count for _, count, _ in daily),
+        "logged_days": logged,
+        "mean": mean,
+        "rating": totalLimit(mean).split(" (")[0],
+        "good_days": good,
+        "ok_days": ok,
+        "high_days": high,
+        "best_streak": best,
+        "streak_to_end": run,
+    }
+
+
+@lru_cache(maxsize=None)
+def palette():
+    from PIL import Image, ImageColor
+
+    colors = [ImageColor.getrgb(c) for c in ("white", DARK, LIGREEN, BRGREEN, YLW, HIGH, GRAY)]
+    for back in colors[0], colors[2]:
+        for ink in colors[1], colors[6]:
+            for n in range(1, PNG_SHADES):
+                colors.append(tuple(round(b + (i - b) * n / PNG_SHADES) for b, i in zip(back, ink)))
+    img = Image.new("P", (1, 1))
+    img.putpalette([v for rgb in colors for v in rgb])
+    return img
+
+
+@lru_cache(maxsize=None)
+def font(size: int):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:  # Pillow before 10.1 has one fixed-size default font
+        return ImageFont.load_default()
+
+
+# Draw one report and save it to path (PNG or PDF, from fmt). Runs in the
+# worker processes, so it takes and returns plain data only.
+def renderReport(job: dict) -> dict:
+    from PIL import Image, ImageDraw
+
+    f = monthFigures(job["month"], job["rows"])
+    img = Image.new("RGB", PAGE, "white")
+    draw = ImageDraw.Draw(img)
+    width = PAGE[0]
+    big, mid, small = font(34), font(20), font(15)
+
+    draw.rectangle((0, 0, width, 110), fill=LIGREEN)
+    draw.text((40, 22), "EcoTrack monthly footprint", font=big, fill=DARK)
+    title = date.fromisoformat(f["first"]).strftime("%B %Y")
+    draw.text((40, 70), f"{job['user']}  ·  {title}", font=mid, fill=DARK)
+
+    lines = [
+        f"Total: {f['total']:.3f} kg CO2 from {f['entries']} logs on {f['logged_days']} days",
+        f"Per logged day: {f['mean']:.3f} kg CO2  ·  rating {f['rating']}",
+        f"Days: {f['good_days']} LOW (up to {GOODLIMIT:g} kg), {f['ok_days']} OK (up to {OKLIMIT:g} kg), "
+        f"{f['high_days']} HIGH",
+        f"Longest streak of LOW days: {f['best_streak']}  ·  at month end: {f['streak_to_end']}",
+    ]
+    y = 140
+    for line in lines:
+        draw.text((40, y), line, font=mid, fill=DARK)
+        y += 34
+
+    # Daily bars against the rating limits
+    y += 20
+    draw.text((40, y), "kg CO2 per day", font=mid, fill=DARK)
+    top, bottom, left, right = y + 40, y + 380, 70, width - 40
+    peak = max([kg for _, _, kg in f["daily"]] + [OKLIMIT * 1.15])
+    scale = (bottom - top) / peak
+    draw.line((left, bottom, right, bottom), fill=DARK, width=2)
+    for limit, color in ((GOODLIMIT, BRGREEN), (OKLIMIT, YLW)):
+        ly = bottom - limit * scale
+        draw.line((left, ly, right, ly), fill=color, width=2)
+        draw.text((left - 36, ly - 9), f"{limit:g}", font=small, fill=GRAY)
+    slot = (right - left) / len(f["daily"])
+    for n, count, kg in f["daily"]:
+        x = left + (n - 1) * slot
+        if count:
+            color = BRGREEN if kg <= GOODLIMIT else YLW if kg <= OKLIMIT else HIGH
+            draw.rectangle((x + 2, bottom - max(1, kg * scale), x + slot - 2, bottom), fill=color)
+        if n == 1 or n % 5 == 0:
+            draw.text((x + 2, bottom + 6), str(n), font=small, fill=GRAY)
+
+    # Category breakdown
+    y = bottom + 50
+    draw.text((40, y), "By category", font=mid, fill=DARK)
+    y += 40
+    most = f["categories"][0][2] if f["categories"] else 0
+    for cat, count, kg in f["categories"]:
+        share = kg / f["total"] if f["total"] else 0
+        draw.text((40, y), cat, font=small, fill=DARK)
+        bar = (width - 420) * (kg / most if most else 0)
+        draw.rectangle((240, y + 2, 240 + max(1, bar), y + 18), fill=BRGREEN)
+        draw.text((width - 170, y), f"{kg:.3f} kg  {share:.0%}", font=small, fill=DARK)
+        y += 30
+
+    draw.text((40, PAGE[1] - 40), f"{f['first']} to {f['last']}", font=small, fill=GRAY)
+
+    path = job["path"]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = f"{path}.{os.getpid()}.tmp"
+    if job["format"] == "pdf":
+        img.save(partial, "PDF", resolution=PDF_DPI)
+    else:
+        img.quantize(palette=palette(), dither=Image.Dither.NONE).save(partial, "PNG")
+    os.replace(partial, path)  # a half-written report is never left behind
+    return {key: job[key] for key in ("user_id", "month", "format", "digest", "path")}
+
+
+# (user_id, name, rows) for every user (or one) with logs in the month, one
+# user at a time from an ordered cursor, so the fleet is never held in memory.
+# Rows come from daily_category_totals, which archived logs count in too.
+def monthRows(month: str, user_id: int = None):
+    first, last = monthSpan(month)
+    query = (
+        "SELECT u.id, u.name, d.log_date, d.category, d.entries, d.kg_co2 "
+        "FROM users AS u JOIN daily_category_totals AS d ON d.user_id = u.id AND d.log_date BETWEEN ? AND ?"
+    )
+    params = [first, last]
+    if user_id is not None:
+        query += " WHERE u.id = ?"
+        params.append(user_id)
+    cur = db().cursor()
+    cur.execute(query + " ORDER BY u.id, d.log_date, d.category", params)
+    rows = (row for batch in iter(lambda: cur.fetchmany(1000), []) for row in batch)
+    for (uid, name), group in groupby(rows, key=lambda r: (r[0], r[1])):
+        yield uid, name, [(r[2], r[3], r[4], round(r[5], 6)) for r in group]
+
+
+# What a report is drawn from; the same digest means the same picture
+def reportDigest(name: str, fmt: str, rows: list) -> str:
+    key = repr((REPORT_VERSION, GOODLIMIT, OKLIMIT, name, fmt, rows))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+# Run renderReport over jobs, in worker processes when there is more than
+# one, yielding each result as it finishes. Only a few jobs per worker are
+# queued at a time, so the jobs generator is read as the workers keep up.
+def renderAll(jobs, workers: int):
+    if workers <= 1:
+        for job in jobs:
+            yield renderReport(job)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for job in jobs:
+            pending.add(pool.submit(renderReport, job))
+            if len(pending) >= workers * QUEUE_PER_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in wait(pending).done:
+            yield future.result()
+
+
+def recordReports(rows: list):
+    with db() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO reports (user_id, month, format, digest, path) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+# Draw monthly reports ("YYYY-MM", default this month) for every user with
+# logs that month, or one user, into out/<month>/. A report whose totals are
+# unchanged since it was last drawn (and whose file is still there) is
+# skipped unless force is set.
+def writeReports(month: str = None, out: str = "reports", fmt: str = "png", user_id: int = None,
+                 workers: int = None, force: bool = False) -> dict:
+    month = month or fmtDate(date.today())[:7]
+    monthSpan(month)  # validates it
+    if fmt not in FORMATS:
+        raise ValueError(f"Format must be one of: {', '.join(FORMATS)}")
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+
+    with db() as conn:
+        previous = dict(conn.execute(
+            "SELECT user_id, digest FROM reports WHERE month = ? AND format = ?", (month, fmt)
+        ).fetchall())
+    counts = {"skipped": 0}
+
+    def jobs():
+        for uid, name, rows in monthRows(month, user_id):
+            path = os.path.join(out, month, reportName(uid, name, fmt))
+            digest = reportDigest(name, fmt, rows)
+            if not force and previous.get(uid) == digest and os.path.exists(path):
+                counts["skipped"] += 1
+                continue
+            yield {"user_id": uid, "user": name, "month": month, "format": fmt, "rows": rows,
+                   "digest": digest, "path": path}
+
+    # Finished reports are recorded in batches, so a run that is cut short
+    # still skips what it got done the next time
+    written, batch = 0, []
+    for done in renderAll(jobs(), workers):
+        batch.append(tuple(done[key] for key in ("user_id", "month", "format", "digest", "path")))
+        if len(batch) >= RECORD_BATCH:
+            recordReports(batch)
+            written, batch = written + len(batch), []
+    recordReports(batch)
+    written += len(batch)
+
+    seconds = time.perf_counter() - started
+    return {
+        "month": month,
+        "written": written,
+        "skipped": counts["skipped"],
+        "directory": os.path.join(out, month),
+        "seconds": round(seconds, 3),
+        "reports_per_sec": round(written / seconds) if seconds > 0 else 0,
+    }
+
+
+# Draw one user's report for a month straight to path (the GUI's "Save
+# report"); the format comes from the file's extension
+def saveReport(user_id: int, month: str, path: str) -> str:
+    fmt = os.path.splitext(path.lower())[1].lstrip(".")
+    if fmt not in FORMATS:
+        raise ValueError("Save the report as .png or .pdf")
+    for uid, name, rows in monthRows(month, user_id):
+        return renderReport({"user_id": uid, "user": name, "month": month, "format": fmt, "rows": rows,
+                             "digest": reportDigest(name, fmt, rows), "path": path})["path"]
+    raise ValueError(f"No logs in {month}.")
@@ -0,0 +1,316 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import storage
+from core import addLogs, checkLog, fmtDate, parseDay, reloadUsers, removeLogs, streakShow, totalLimit
+
+# Every endpoint takes ?user=NAME (or "user" in a POST body); this is the default
+DEFAULT_NAME = "default"
+
+# Group commit: the writer waits this long for more writes before committing,
+# and never puts more than MAX_GROUP writes in one transaction
+GROUP_WAIT = 0.005
+MAX_GROUP = 500
+
+# After this many idle seconds the writer purges a batch of deleted logs that
+# are past undoing (storage.compactChunk), between writes instead of during them
+COMPACT_IDLE = 1.0
+
+# Latency samples kept per endpoint for the percentiles in /metrics
+SAMPLES = 2000
+
+
+# The only thread that writes to the database. Request threads queue adds,
+# deletes and sync batches and wait on a Future; the writer drains whatever has queued up and
+# commits it as one transaction, so N concurrent requests cost one commit.
+class Writer:
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.groups = 0
+        self.writes = 0
+        self.thread = threading.Thread(target=self.run, name="ecotrack-writer", daemon=True)
+        self.thread.start()
+
+    # kind is "add" (payload: validated log tuple), "delete" (payload: (log id,
+    # user id)) or "sync" (payload: (device, changes, last) for storage.applyChanges)
+    def submit(self, kind: str, payload) -> Future:
+        future = Future()
+        self.jobs.put((kind, payload, future))
+        return future
+
+    def run(self):
+        idle = COMPACT_IDLE
+        while True:
+            try:
+                group = [self.jobs.get(timeout=idle)]
+            except queue.Empty:
+                # Keep going while there is more to purge, then wait for writes again
+                idle = 0 if self.compact() == storage.COMPACT_BATCH else None
+                continue
+            idle = COMPACT_IDLE
+            deadline = time.perf_counter() + GROUP_WAIT
+            while len(group) < MAX_GROUP:
+                left = deadline - time.perf_counter()
+                try:
+                    group.append(self.jobs.get(timeout=left) if left > 0 else self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self.commit(group)
+
+    def compact(self) -> int:
+        try:
+            return storage.compactChunk(storage.db())
+        except Exception:
+            return 0  # busy or failed; tried again after the next writes
+
+    def commit(self, group: list):
+        adds = [job for job in group if job[0] == "add"]
+        deletes = [job for job in group if job[0] == "delete"]
+        syncs = [job for job in group if job[0] == "sync"]
+        try:
+            # addLogs and removeLogs each run one transaction on this thread's connection
+            added = addLogs([payload for _, payload, _ in adds]) if adds else []
+            for (_, _, future), (log_id, kg) in zip(adds, added):
+                future.set_result({"id": log_id, "kg_co2": kg})
+            removed = set()
+            for user_id in {payload[1] for _, payload, _ in deletes}:
+                removed.update(removeLogs([p[0] for _, p, _ in deletes if p[1] == user_id], user_id))
+            for _, (log_id, _), future in deletes:
+                future.set_result({"deleted": int(log_id in removed)})
+        except Exception as e:
+            for _, _, future in adds + deletes:
+                if not future.done():
+                    future.set_exception(e)
+        # A sync batch is its own transaction and fails on its own
+        for _, payload, future in syncs:
+            try:
+                done = storage.applyChanges(storage.db(), *payload)
+                reloadUsers(done["users"])
+                future.set_result(done)
+            except Exception as e:
+                future.set_exception(e)
+        self.groups += 1
+        self.writes += len(group)
+
+
+# Per-endpoint request counts and latency percentiles
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}  # endpoint -> deque of seconds
+        self.counts = {}
+
+    def record(self, endpoint: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(endpoint, deque(maxlen=SAMPLES)).append(seconds)
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def report(self) -> dict:
+        with self.lock:
+            snapshot = {name: sorted(values) for name, values in self.samples.items()}
+            counts = dict(self.counts)
+
+        out = {}
+        for name, values in snapshot.items():
+            pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+            out[name] = {
+                "count": counts[name],
+                "mean_ms": round(sum(values) / len(values) * 1000, 3),
+                "p50_ms": pick(0.50),
+                "p95_ms": pick(0.95),
+                "p99_ms": pick(0.99),
+                "max_ms": round(values[-1] * 1000, 3),
+            }
+        return out
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "EcoTrack/1.0"
+    writer = None
+    metrics = None
+
+    # Routes: (method, first path segment) -> handler name
+    ROUTES = {
+        ("GET", "logs"): "listLogs",
+        ("POST", "logs"): "addLog",
+        ("DELETE", "logs"): "deleteLog",
+        ("GET", "today"): "today",
+        ("GET", "streak"): "streak",
+        ("GET", "metrics"): "showMetrics",
+        ("GET", "sync"): "syncState",
+        ("GET", "changes"): "listChanges",
+        ("POST", "changes"): "pushChanges",
+    }
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method: str):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        route = self.ROUTES.get((method, parts[0] if parts else ""))
+        endpoint = f"{method} /{parts[0]}" if route else "unknown"
+        try:
+            if route is None:
+                raise ApiError(404, "no such endpoint")
+            with storage.borrowed():
+                status, body = getattr(self, route)(parts[1:], parse_qs(url.query))
+        except ApiError as e:
+            status, body = e.status, {"error": str(e)}
+        except (ValueError, TypeError) as e:
+            status, body = 400, {"error": str(e)}
+        except Exception as e:
+            status, body = 500, {"error": str(e)}
+        self.reply(status, body)
+        self.metrics.record(endpoint, time.perf_counter() - started)
+
+    def reply(self, status: int, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def readJson(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            raise ApiError(400, f"invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise ApiError(400, "expected a JSON object")
+        return body
+
+    # The user named in the query string, which must already exist
+    def user(self, query) -> int:
+        return storage.userId(query.get("user", [DEFAULT_NAME])[0], create=False)
+
+    def log_message(self, format, *args):
+        pass  # one line per request is too much noise under load
+
+    # GET /logs?date=YYYY-MM-DD&limit=50&offset=0
+    def listLogs(self, rest, query):
+        day = query.get("date", [""])[0]
+        limit = min(int(query.get("limit", ["50"])[0]), 1000)
+        offset = int(query.get("offset", ["0"])[0])
+        pager = storage.HistoryPager(parseDay(day) if day else None, self.user(query))
+        keys = ("log_date", "category", "amount", "duration_hours", "kg_co2", "note", "id")
+        rows = [dict(zip(keys, r)) for r in pager.rows(offset, limit)]
+        return 200, {"count": pager.count, "total_kg": pager.total, "logs": rows}
+
+    # POST /logs {"user", "log_date", "category", "amount", "duration_hours", "note"};
+    # the user must already exist, as for every other endpoint
+    def addLog(self, rest, query):
+        body = self.readJson()
+        user_id = storage.userId(str(body.get("user") or DEFAULT_NAME), create=False)
+        day_s, cat, amount, hrs = checkLog(
+            body.get("log_date") or fmtDate(date.today()),
+            body.get("category"),
+            body.get("amount"),
+            body.get("duration_hours"),
+        )
+        note = str(body.get("note") or "").strip()
+        return 201, self.writer.submit("add", (user_id, day_s, cat, amount, hrs, note)).result()
+
+    # DELETE /logs/<id>
+    def deleteLog(self, rest, query):
+        if len(rest) != 1 or not rest[0].isdigit():
+            raise ApiError(400, "use DELETE /logs/<id>")
+        result = self.writer.submit("delete", (int(rest[0]), self.user(query))).result()
+        if not result["deleted"]:
+            raise ApiError(404, f"log {rest[0]} not found")
+        return 200, result
+
+    # GET /today
+    def today(self, rest, query):
+        count, total = storage.dayTotal(fmtDate(date.today()), self.user(query))
+        return 200, {"date": fmtDate(date.today()), "entries": count, "kg_co2": total, "rating": totalLimit(total)}
+
+    # GET /streak
+    def streak(self, rest, query):
+        return 200, {"streak": streakShow(self.user(query))}
+
+    # GET /sync?device=UUID: this server's device id and how far that device's changes have been applied here
+    def syncState(self, rest, query):
+        conn = storage.db()
+        device = query.get("device", [""])[0]
+        return 200, {"device": storage.deviceId(conn), "pulled": storage.pulledFrom(conn, device) if device else 0}
+
+    # GET /changes?since=0&limit=5000&device=UUID: this server's changes after
+    # seq `since`, less the ones it got from that device, and the last seq looked at
+    def listChanges(self, rest, query):
+        since = int(query.get("since", ["0"])[0])
+        limit = min(int(query.get("limit", [str(storage.SYNC_BATCH)])[0]), storage.SYNC_BATCH)
+        rows, last = storage.changesSince(storage.db(), since, limit, query.get("device", [None])[0])
+        return 200, {"changes": rows, "last": last}
+
+    # POST /changes {"device", "changes", "last"}: apply a batch of another device's changes
+    def pushChanges(self, rest, query):
+        body = self.readJson()
+        device, rows, last = body.get("device"), body.get("changes"), body.get("last")
+        if not isinstance(device, str) or not isinstance(rows, list) or not isinstance(last, int):
+            raise ApiError(400, 'expected {"device": str, "changes": [...], "last": int}')
+        if len(rows) > storage.SYNC_BATCH:
+            raise ApiError(413, f"at most {storage.SYNC_BATCH} changes per request")
+        return 200, self.writer.submit("sync", (device, rows, last)).result()
+
+    # GET /metrics
+    def showMetrics(self, rest, query):
+        return 200, {
+            "endpoints": self.metrics.report(),
+            "writer": {
+                "groups": self.writer.groups,
+                "writes": self.writer.writes,
+                "per_group": round(self.writer.writes / self.writer.groups, 2) if self.writer.groups else 0,
+            },
+            "storage": storage.stats(),
+        }
+
+
+# Connections the listening socket holds until they are accepted. The
+# socketserver default of 5 resets clients when a burst of writes arrives at once.
+REQUEST_QUEUE = 128
+
+
+class Server(ThreadingHTTPServer):
+    request_queue_size = REQUEST_QUEUE
+    daemon_threads = True
+
+
+# Build a server bound to host:port; call serve_forever() to run it
+def makeServer(host: str = "127.0.0.1", port: int = 8080) -> Server:
+    storage.createDtb()
+    handler = type("EcoTrackHandler", (Handler,), {"writer": Writer(), "metrics": Metrics()})
+    return Server((host, port), handler)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080):
+    server = makeServer(host, port)
+    print(f"EcoTrack API on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
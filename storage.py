@@ -0,0 +1,1793 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from array import array
+from copy import copy
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from heapq import merge
+from itertools import islice
+
+import archive
+
+# Database file:
+FILE = "ecotrack.db"
+
+# Pragmas applied to every connection: WAL lets readers and the writer overlap
+# and with synchronous=NORMAL a commit no longer waits on a full fsync
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16000",
+)
+
+# How many compiled statements each connection keeps for reuse
+STATEMENT_CACHE = 256
+
+# Counters for connections opened, SQL statements run and view results served
+# from the query cache (querycache.py) or read again
+STATS = {"connects": 0, "queries": 0, "cache_hits": 0, "cache_misses": 0}
+_stats_lock = threading.Lock()
+
+# One long-lived connection per thread (the Tk thread plus any workers).
+# closeAll() bumps the generation so every thread reopens on its next db() call.
+_local = threading.local()
+_open = []
+_open_lock = threading.Lock()
+_generation = 0
+
+# Idle connections lent to short-lived threads by borrowed(), at most POOL_SIZE kept
+_pool = []
+POOL_SIZE = 8
+
+
+# Trace callback: SQLite reports every statement it runs, trigger steps included.
+# It runs on the thread that ran the statement, so each thread also keeps its own count.
+def countQuery(sql: str):
+    _local.queries = getattr(_local, "queries", 0) + 1
+    with _stats_lock:
+        STATS["queries"] += 1
+
+
+# Statements run so far by the calling thread (see profiling.span)
+def threadQueries() -> int:
+    return getattr(_local, "queries", 0)
+
+
+# Open a new connection to FILE with the shared pragmas
+def openConn(path: str = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or FILE, cached_statements=STATEMENT_CACHE, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    conn.set_trace_callback(countQuery)
+    # Python's round, so kg computed in SQL matches core.Emissions to the last
+    # digit (SQLite's ROUND goes the other way on some values next to a .0005)
+    conn.create_function("pyround", 2, round, deterministic=True)
+    with _stats_lock:
+        STATS["connects"] += 1
+    return conn
+
+
+# The calling thread's shared connection, opened on first use
+def db() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.generation != _generation:
+        conn = openConn()
+        with _open_lock:
+            _open.append(conn)
+            _local.conn = conn
+            _local.generation = _generation
+    return conn
+
+
+# Lend a pooled connection to a short-lived thread (one HTTP request, say) as
+# its db() for the duration of the block, instead of opening one per thread
+@contextmanager
+def borrowed():
+    with _open_lock:
+        conn = _pool.pop() if _pool else None
+        generation = _generation
+    if conn is None:
+        conn = openConn()
+        with _open_lock:
+            _open.append(conn)
+
+    _local.conn, _local.generation = conn, generation
+    try:
+        yield conn
+    finally:
+        del _local.conn
+        if conn.in_transaction:
+            conn.rollback()
+        with _open_lock:
+            if generation == _generation and len(_pool) < POOL_SIZE:
+                _pool.append(conn)
+                conn = None
+            elif conn in _open:
+                _open.remove(conn)
+        if conn is not None:
+            conn.close()
+
+
+# Close every shared connection, e.g. before switching FILE or on exit
+def closeAll():
+    global _generation
+    with _open_lock:
+        for conn in _open:
+            conn.close()
+        _open.clear()
+        _pool.clear()
+        _generation += 1
+
+
+# Point the storage layer at another database file
+def useFile(path: str):
+    global FILE
+    closeAll()
+    FILE = path
+
+
+def countCache(hit: bool):
+    with _stats_lock:
+        STATS["cache_hits" if hit else "cache_misses"] += 1
+
+
+def stats() -> dict:
+    with _stats_lock:
+        return dict(STATS)
+
+
+def resetStats():
+    with _stats_lock:
+        for key in STATS:
+            STATS[key] = 0
+
+
+# Count the connects/queries made inside a block:
+#     with counting() as used: app.svLog()
+#     print(used)  # {"connects": 0, "queries": 5, "cache_hits": 0, "cache_misses": 0}
+@contextmanager
+def counting():
+    before = stats()
+    used = {}
+    try:
+        yield used
+    finally:
+        after = stats()
+        used.update({key: after[key] - before[key] for key in after})
+
+
+# Schema version 2 of the per-day summaries (before users), kept as it was
+# so migration 2 still runs unchanged on old files
+TOTALS_SCHEMA_V2 = """
+CREATE TABLE IF NOT EXISTS daily_totals (
+    log_date TEXT PRIMARY KEY,
+    entries INTEGER NOT NULL DEFAULT 0,
+    kg_co2 REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS daily_category_totals (
+    log_date TEXT NOT NULL,
+    category TEXT NOT NULL,
+    entries INTEGER NOT NULL DEFAULT 0,
+    kg_co2 REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (log_date, category)
+);
+
+CREATE TRIGGER IF NOT EXISTS logs_totals_insert AFTER INSERT ON logs BEGIN
+    INSERT INTO daily_totals (log_date, entries, kg_co2) VALUES (NEW.log_date, 1, NEW.kg_co2)
+        ON CONFLICT(log_date) DO UPDATE SET entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+    INSERT INTO daily_category_totals (log_date, category, entries, kg_co2)
+        VALUES (NEW.log_date, NEW.category, 1, NEW.kg_co2)
+        ON CONFLICT(log_date, category) DO UPDATE SET entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_totals_delete AFTER DELETE ON logs BEGIN
+    UPDATE daily_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE log_date = OLD.log_date;
+    DELETE FROM daily_totals WHERE log_date = OLD.log_date AND entries <= 0;
+    UPDATE daily_category_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE log_date = OLD.log_date AND category = OLD.category;
+    DELETE FROM daily_category_totals
+        WHERE log_date = OLD.log_date AND category = OLD.category AND entries <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_totals_update AFTER UPDATE OF log_date, category, kg_co2 ON logs BEGIN
+    UPDATE daily_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE log_date = OLD.log_date;
+    DELETE FROM daily_totals WHERE log_date = OLD.log_date AND entries <= 0;
+    UPDATE daily_category_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE log_date = OLD.log_date AND category = OLD.category;
+    DELETE FROM daily_category_totals
+        WHERE log_date = OLD.log_date AND category = OLD.category AND entries <= 0;
+    INSERT INTO daily_totals (log_date, entries, kg_co2) VALUES (NEW.log_date, 1, NEW.kg_co2)
+        ON CONFLICT(log_date) DO UPDATE SET entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+    INSERT INTO daily_category_totals (log_date, category, entries, kg_co2)
+        VALUES (NEW.log_date, NEW.category, 1, NEW.kg_co2)
+        ON CONFLICT(log_date, category) DO UPDATE SET entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+END;
+"""
+
+
+REBUILD_TOTALS_V2 = """
+DELETE FROM daily_totals;
+DELETE FROM daily_category_totals;
+INSERT INTO daily_totals (log_date, entries, kg_co2)
+    SELECT log_date, COUNT(*), SUM(kg_co2) FROM logs GROUP BY log_date;
+INSERT INTO daily_category_totals (log_date, category, entries, kg_co2)
+    SELECT log_date, category, COUNT(*), SUM(kg_co2) FROM logs GROUP BY log_date, category;
+"""
+
+
+# Per-user, per-day summaries of logs, kept in step with every INSERT/UPDATE/DELETE by triggers
+TOTALS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_totals (
+    user_id INTEGER NOT NULL,
+    log_date TEXT NOT NULL,
+    entries INTEGER NOT NULL DEFAULT 0,
+    kg_co2 REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, log_date)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_totals_date ON daily_totals (log_date);
+
+CREATE TABLE IF NOT EXISTS daily_category_totals (
+    user_id INTEGER NOT NULL,
+    log_date TEXT NOT NULL,
+    category TEXT NOT NULL,
+    entries INTEGER NOT NULL DEFAULT 0,
+    kg_co2 REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, log_date, category)
+);
+
+CREATE TRIGGER IF NOT EXISTS logs_totals_insert AFTER INSERT ON logs BEGIN
+    INSERT INTO daily_totals (user_id, log_date, entries, kg_co2) VALUES (NEW.user_id, NEW.log_date, 1, NEW.kg_co2)
+        ON CONFLICT(user_id, log_date) DO UPDATE SET entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+    INSERT INTO daily_category_totals (user_id, log_date, category, entries, kg_co2)
+        VALUES (NEW.user_id, NEW.log_date, NEW.category, 1, NEW.kg_co2)
+        ON CONFLICT(user_id, log_date, category) DO UPDATE SET
+            entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_totals_delete AFTER DELETE ON logs BEGIN
+    UPDATE daily_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE user_id = OLD.user_id AND log_date = OLD.log_date;
+    DELETE FROM daily_totals WHERE user_id = OLD.user_id AND log_date = OLD.log_date AND entries <= 0;
+    UPDATE daily_category_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE user_id = OLD.user_id AND log_date = OLD.log_date AND category = OLD.category;
+    DELETE FROM daily_category_totals
+        WHERE user_id = OLD.user_id AND log_date = OLD.log_date AND category = OLD.category AND entries <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_totals_update AFTER UPDATE OF user_id, log_date, category, kg_co2 ON logs BEGIN
+    UPDATE daily_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE user_id = OLD.user_id AND log_date = OLD.log_date;
+    DELETE FROM daily_totals WHERE user_id = OLD.user_id AND log_date = OLD.log_date AND entries <= 0;
+    UPDATE daily_category_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE user_id = OLD.user_id AND log_date = OLD.log_date AND category = OLD.category;
+    DELETE FROM daily_category_totals
+        WHERE user_id = OLD.user_id AND log_date = OLD.log_date AND category = OLD.category AND entries <= 0;
+    INSERT INTO daily_totals (user_id, log_date, entries, kg_co2) VALUES (NEW.user_id, NEW.log_date, 1, NEW.kg_co2)
+        ON CONFLICT(user_id, log_date) DO UPDATE SET entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+    INSERT INTO daily_category_totals (user_id, log_date, category, entries, kg_co2)
+        VALUES (NEW.user_id, NEW.log_date, NEW.category, 1, NEW.kg_co2)
+        ON CONFLICT(user_id, log_date, category) DO UPDATE SET
+            entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+END;
+"""
+
+
+# Recompute both totals tables from scratch out of the logs table
+REBUILD_TOTALS = """
+DELETE FROM daily_totals;
+DELETE FROM daily_category_totals;
+INSERT INTO daily_totals (user_id, log_date, entries, kg_co2)
+    SELECT user_id, log_date, COUNT(*), SUM(kg_co2) FROM logs GROUP BY user_id, log_date;
+INSERT INTO daily_category_totals (user_id, log_date, category, entries, kg_co2)
+    SELECT user_id, log_date, category, COUNT(*), SUM(kg_co2) FROM logs GROUP BY user_id, log_date, category;
+"""
+
+
+# Whole-fleet (all users) per-day summaries for long-range analytics, kept in
+# step by triggers on the per-user tables so fleet reports never scan every user
+FLEET_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fleet_daily_totals (
+    log_date TEXT PRIMARY KEY,
+    entries INTEGER NOT NULL DEFAULT 0,
+    kg_co2 REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS fleet_category_totals (
+    log_date TEXT NOT NULL,
+    category TEXT NOT NULL,
+    entries INTEGER NOT NULL DEFAULT 0,
+    kg_co2 REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (log_date, category)
+);
+
+CREATE TRIGGER IF NOT EXISTS daily_totals_fleet_insert AFTER INSERT ON daily_totals BEGIN
+    INSERT INTO fleet_daily_totals (log_date, entries, kg_co2) VALUES (NEW.log_date, NEW.entries, NEW.kg_co2)
+        ON CONFLICT(log_date) DO UPDATE SET
+            entries = entries + excluded.entries, kg_co2 = kg_co2 + excluded.kg_co2;
+END;
+
+CREATE TRIGGER IF NOT EXISTS daily_totals_fleet_update AFTER UPDATE ON daily_totals BEGIN
+    UPDATE fleet_daily_totals SET entries = entries - OLD.entries, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE log_date = OLD.log_date;
+    INSERT INTO fleet_daily_totals (log_date, entries, kg_co2) VALUES (NEW.log_date, NEW.entries, NEW.kg_co2)
+        ON CONFLICT(log_date) DO UPDATE SET
+            entries = entries + excluded.entries, kg_co2 = kg_co2 + excluded.kg_co2;
+    DELETE FROM fleet_daily_totals WHERE log_date = OLD.log_date AND entries <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS daily_totals_fleet_delete AFTER DELETE ON daily_totals BEGIN
+    UPDATE fleet_daily_totals SET entries = entries - OLD.entries, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE log_date = OLD.log_date;
+    DELETE FROM fleet_daily_totals WHERE log_date = OLD.log_date AND entries <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS daily_category_totals_fleet_insert AFTER INSERT ON daily_category_totals BEGIN
+    INSERT INTO fleet_category_totals (log_date, category, entries, kg_co2)
+        VALUES (NEW.log_date, NEW.category, NEW.entries, NEW.kg_co2)
+        ON CONFLICT(log_date, category) DO UPDATE SET
+            entries = entries + excluded.entries, kg_co2 = kg_co2 + excluded.kg_co2;
+END;
+
+CREATE TRIGGER IF NOT EXISTS daily_category_totals_fleet_update AFTER UPDATE ON daily_category_totals BEGIN
+    UPDATE fleet_category_totals SET entries = entries - OLD.entries, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE log_date = OLD.log_date AND category = OLD.category;
+    INSERT INTO fleet_category_totals (log_date, category, entries, kg_co2)
+        VALUES (NEW.log_date, NEW.category, NEW.entries, NEW.kg_co2)
+        ON CONFLICT(log_date, category) DO UPDATE SET
+            entries = entries + excluded.entries, kg_co2 = kg_co2 + excluded.kg_co2;
+    DELETE FROM fleet_category_totals
+        WHERE log_date = OLD.log_date AND category = OLD.category AND entries <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS daily_category_totals_fleet_delete AFTER DELETE ON daily_category_totals BEGIN
+    UPDATE fleet_category_totals SET entries = entries - OLD.entries, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE log_date = OLD.log_date AND category = OLD.category;
+    DELETE FROM fleet_category_totals
+        WHERE log_date = OLD.log_date AND category = OLD.category AND entries <= 0;
+END;
+"""
+
+
+REBUILD_FLEET = """
+DELETE FROM fleet_daily_totals;
+DELETE FROM fleet_category_totals;
+INSERT INTO fleet_daily_totals (log_date, entries, kg_co2)
+    SELECT log_date, SUM(entries), SUM(kg_co2) FROM daily_totals GROUP BY log_date;
+INSERT INTO fleet_category_totals (log_date, category, entries, kg_co2)
+    SELECT log_date, category, SUM(entries), SUM(kg_co2) FROM daily_category_totals GROUP BY log_date, category;
+"""
+
+
+# Full-text index over log notes (FTS5, external content: the text lives only
+# in logs). Porter stemming so "commuting" finds "commute", and prefix indexes
+# for "comm*". Only logs with a note are indexed.
+NOTES_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(
+    note, content = 'logs', content_rowid = 'id',
+    tokenize = 'porter unicode61 remove_diacritics 2', prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS logs_fts_insert AFTER INSERT ON logs WHEN NEW.note <> '' BEGIN
+    INSERT INTO logs_fts (rowid, note) VALUES (NEW.id, NEW.note);
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_fts_delete AFTER DELETE ON logs WHEN OLD.note <> '' BEGIN
+    INSERT INTO logs_fts (logs_fts, rowid, note) VALUES ('delete', OLD.id, OLD.note);
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_fts_update AFTER UPDATE OF note ON logs BEGIN
+    INSERT INTO logs_fts (logs_fts, rowid, note) SELECT 'delete', OLD.id, OLD.note WHERE OLD.note <> '';
+    INSERT INTO logs_fts (rowid, note) SELECT NEW.id, NEW.note WHERE NEW.note <> '';
+END;
+"""
+
+
+REBUILD_NOTES = """
+INSERT INTO logs_fts (logs_fts) VALUES ('delete-all');
+INSERT INTO logs_fts (rowid, note) SELECT id, note FROM logs WHERE note <> '';
+"""
+
+
+# Archive segment files of this database (see archiveChunk)
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive_segments (
+    name TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    first_day TEXT NOT NULL,
+    last_day TEXT NOT NULL,
+    created TEXT NOT NULL DEFAULT (datetime('now'))
+);
+"""
+
+
+# What one log adds to / takes from the per-user totals, for the triggers below
+ADD_TO_TOTALS = """
+    INSERT INTO daily_totals (user_id, log_date, entries, kg_co2) VALUES (NEW.user_id, NEW.log_date, 1, NEW.kg_co2)
+        ON CONFLICT(user_id, log_date) DO UPDATE SET entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+    INSERT INTO daily_category_totals (user_id, log_date, category, entries, kg_co2)
+        VALUES (NEW.user_id, NEW.log_date, NEW.category, 1, NEW.kg_co2)
+        ON CONFLICT(user_id, log_date, category) DO UPDATE SET
+            entries = entries + 1, kg_co2 = kg_co2 + excluded.kg_co2;
+"""
+
+TAKE_FROM_TOTALS = """
+    UPDATE daily_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE user_id = OLD.user_id AND log_date = OLD.log_date;
+    DELETE FROM daily_totals WHERE user_id = OLD.user_id AND log_date = OLD.log_date AND entries <= 0;
+    UPDATE daily_category_totals SET entries = entries - 1, kg_co2 = kg_co2 - OLD.kg_co2
+        WHERE user_id = OLD.user_id AND log_date = OLD.log_date AND category = OLD.category;
+    DELETE FROM daily_category_totals
+        WHERE user_id = OLD.user_id AND log_date = OLD.log_date AND category = OLD.category AND entries <= 0;
+"""
+
+# Soft deletes and the undo/redo journal. A deleted log keeps its row, with
+# `deleted` set to the journal entry that deleted it, so undo is one UPDATE.
+# Readers take only deleted IS NULL rows, and the date indexes hold nothing
+# else, so they never step over tombstones; a small index of the tombstones
+# serves undo and compaction. For the totals, setting and clearing `deleted`
+# count as a delete and an insert, and purging a tombstone changes nothing.
+# journal_logs lists the logs each entry added or deleted.
+JOURNAL_SCHEMA = f"""
+ALTER TABLE logs ADD COLUMN deleted INTEGER;
+DROP INDEX IF EXISTS idx_logs_date_id;
+DROP INDEX IF EXISTS idx_logs_user_date_id;
+CREATE INDEX IF NOT EXISTS idx_logs_live_date_id ON logs (log_date, id, deleted) WHERE deleted IS NULL;
+CREATE INDEX IF NOT EXISTS idx_logs_live_user_date_id ON logs (user_id, log_date, id, deleted) WHERE deleted IS NULL;
+CREATE INDEX IF NOT EXISTS idx_logs_deleted ON logs (deleted) WHERE deleted IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    logs INTEGER NOT NULL,
+    undone INTEGER NOT NULL DEFAULT 0,
+    created TEXT NOT NULL DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS idx_journal_user ON journal (user_id, id);
+
+CREATE TABLE IF NOT EXISTS journal_logs (
+    entry_id INTEGER NOT NULL,
+    log_id INTEGER NOT NULL,
+    PRIMARY KEY (entry_id, log_id)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS journal_forget AFTER DELETE ON journal BEGIN
+    DELETE FROM journal_logs WHERE entry_id = OLD.id;
+END;
+
+DROP TRIGGER IF EXISTS logs_totals_delete;
+DROP TRIGGER IF EXISTS logs_totals_update;
+
+CREATE TRIGGER logs_totals_delete AFTER DELETE ON logs WHEN OLD.deleted IS NULL BEGIN
+{TAKE_FROM_TOTALS}
+END;
+
+CREATE TRIGGER logs_totals_update AFTER UPDATE OF user_id, log_date, category, kg_co2 ON logs
+WHEN NEW.deleted IS NULL BEGIN
+{TAKE_FROM_TOTALS}
+{ADD_TO_TOTALS}
+END;
+
+CREATE TRIGGER logs_totals_tombstone AFTER UPDATE OF deleted ON logs
+WHEN OLD.deleted IS NULL AND NEW.deleted IS NOT NULL BEGIN
+{TAKE_FROM_TOTALS}
+END;
+
+CREATE TRIGGER logs_totals_restore AFTER UPDATE OF deleted ON logs
+WHEN OLD.deleted IS NOT NULL AND NEW.deleted IS NULL BEGIN
+{ADD_TO_TOTALS}
+END;
+"""
+
+# Sync between database files. Every database gets a random device id (devices
+# row 0); a log's global id is (device it was first written on, its id there).
+# Logs written here leave origin/origin_id NULL, so they cost nothing extra;
+# logs synced in keep their origin's number in devices and their id there.
+# `changes` is the stream peers read from: one row per log inserted, deleted
+# or restored, numbered by seq (origin 0: this database). Purging tombstones
+# and archiving are local housekeeping and add nothing. It starts out with the
+# logs already stored. A change's stamp orders it against changes to the same
+# log made elsewhere (a Lamport clock: seq is kept past every stamp seen, and a
+# change made here stores NULL for a stamp equal to its seq); the newer one
+# wins and a delete wins a tie. source is the device whose sync brought a
+# change in (NULL: made here), which it is not sent back to.
+# sync_peers holds how far each peer's stream has been applied here.
+SYNC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL UNIQUE
+);
+INSERT OR IGNORE INTO devices (id, uuid) VALUES (0, lower(hex(randomblob(16))));
+
+ALTER TABLE logs ADD COLUMN origin INTEGER;
+ALTER TABLE logs ADD COLUMN origin_id INTEGER;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_logs_origin ON logs (origin, origin_id) WHERE origin IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    log_id INTEGER NOT NULL,
+    origin INTEGER NOT NULL,
+    origin_id INTEGER NOT NULL,
+    live INTEGER NOT NULL,
+    stamp INTEGER,
+    source INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_changes_log ON changes (origin, origin_id);
+INSERT INTO changes (log_id, origin, origin_id, live) SELECT id, 0, id, 1 FROM logs WHERE deleted IS NULL ORDER BY id;
+
+CREATE TABLE IF NOT EXISTS sync_peers (
+    device TEXT PRIMARY KEY,
+    pulled INTEGER NOT NULL DEFAULT 0,
+    synced TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
+CREATE TRIGGER IF NOT EXISTS logs_changes_insert AFTER INSERT ON logs BEGIN
+    INSERT INTO changes (log_id, origin, origin_id, live)
+        VALUES (NEW.id, COALESCE(NEW.origin, 0), COALESCE(NEW.origin_id, NEW.id), 1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_changes_delete AFTER UPDATE OF deleted ON logs
+WHEN OLD.deleted IS NULL AND NEW.deleted IS NOT NULL BEGIN
+    INSERT INTO changes (log_id, origin, origin_id, live)
+        VALUES (NEW.id, COALESCE(NEW.origin, 0), COALESCE(NEW.origin_id, NEW.id), 0);
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_changes_restore AFTER UPDATE OF deleted ON logs
+WHEN OLD.deleted IS NOT NULL AND NEW.deleted IS NULL BEGIN
+    INSERT INTO changes (log_id, origin, origin_id, live)
+        VALUES (NEW.id, COALESCE(NEW.origin, 0), COALESCE(NEW.origin_id, NEW.id), 1);
+END;
+"""
+
+
+# Per-user carbon budgets: at most limit_kg in a day, week (Monday to Sunday)
+# or calendar month, over every category or only one. alerts holds one row per
+# budget and period the budget was exceeded in; seen is set once shown.
+BUDGETS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS budgets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    period TEXT NOT NULL CHECK (period IN ('day', 'week', 'month')),
+    category TEXT,
+    limit_kg REAL NOT NULL,
+    created TEXT NOT NULL DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS idx_budgets_user ON budgets (user_id);
+
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    budget_id INTEGER NOT NULL,
+    period_start TEXT NOT NULL,
+    kg_co2 REAL NOT NULL,
+    created TEXT NOT NULL DEFAULT (datetime('now')),
+    seen INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (budget_id, period_start)
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_user ON alerts (user_id, id);
+
+CREATE TRIGGER IF NOT EXISTS budgets_forget AFTER DELETE ON budgets BEGIN
+    DELETE FROM alerts WHERE budget_id = OLD.id;
+END;
+"""
+
+# Monthly report files written by reports.py: one row per user, month and
+# format, with a digest of the totals it was drawn from, so a report whose
+# totals have not changed since is not drawn again
+REPORTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    user_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    format TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created TEXT NOT NULL DEFAULT (datetime('now')),
+    PRIMARY KEY (user_id, month, format)
+) WITHOUT ROWID;
+"""
+
+# A per-user generation that moves with every change to the user's daily totals
+# or budgets, whoever makes it. The streak and budget engines remember the one
+# their memory is current for, so checking them costs one lookup by primary
+# key, on any connection.
+TOTALS_GEN_SCHEMA = """
+ALTER TABLE users ADD COLUMN totals_gen INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER IF NOT EXISTS daily_totals_gen_insert AFTER INSERT ON daily_totals BEGIN
+    UPDATE users SET totals_gen = totals_gen + 1 WHERE id = NEW.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS daily_totals_gen_update AFTER UPDATE ON daily_totals BEGIN
+    UPDATE users SET totals_gen = totals_gen + 1 WHERE id = NEW.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS daily_totals_gen_delete AFTER DELETE ON daily_totals BEGIN
+    UPDATE users SET totals_gen = totals_gen + 1 WHERE id = OLD.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS budgets_gen_insert AFTER INSERT ON budgets BEGIN
+    UPDATE users SET totals_gen = totals_gen + 1 WHERE id = NEW.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS budgets_gen_update AFTER UPDATE ON budgets BEGIN
+    UPDATE users SET totals_gen = totals_gen + 1 WHERE id IN (OLD.user_id, NEW.user_id);
+END;
+CREATE TRIGGER IF NOT EXISTS budgets_gen_delete AFTER DELETE ON budgets BEGIN
+    UPDATE users SET totals_gen = totals_gen + 1 WHERE id = OLD.user_id;
+END;
+"""
+
+
+# Fill temp.archived_totals with what the archived logs add to each user, day
+# and category, read from the segments; only rebuilds and checks need it
+def loadArchivedTotals(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS archived_totals "
+        "(user_id INTEGER, log_date TEXT, category TEXT, entries INTEGER, kg_co2 REAL)"
+    )
+    with conn:
+        conn.execute("DELETE FROM temp.archived_totals")
+        # A day can span two segments; allLogTotals groups the rows anyway
+        for seg in archiveSegments():
+            conn.executemany("INSERT INTO temp.archived_totals VALUES (?, ?, ?, ?, ?)", seg.totals())
+
+
+# Totals from the live logs plus the archived ones (loadArchivedTotals first), grouped by keys
+def allLogTotals(keys: str) -> str:
+    return (
+        f"SELECT {keys}, SUM(n) AS entries, SUM(kg) AS kg_co2 FROM ("
+        f"SELECT {keys}, COUNT(*) AS n, SUM(kg_co2) AS kg FROM logs WHERE deleted IS NULL GROUP BY {keys} "
+        f"UNION ALL SELECT {keys}, entries, kg_co2 FROM archived_totals) GROUP BY {keys}"
+    )
+
+
+# Recompute the totals tables from the logs, archived ones included
+def rebuildTotals():
+    with db() as conn:
+        loadArchivedTotals(conn)
+        conn.executescript(
+            "BEGIN;"
+            "DELETE FROM daily_totals;"
+            "DELETE FROM daily_category_totals;"
+            "INSERT INTO daily_totals (user_id, log_date, entries, kg_co2) "
+            f"{allLogTotals('user_id, log_date')};"
+            "INSERT INTO daily_category_totals (user_id, log_date, category, entries, kg_co2) "
+            f"{allLogTotals('user_id, log_date, category')};"
+            + REBUILD_FLEET + "COMMIT;"
+        )
+
+
+# Change rows for archived logs that have none. Migration 10 seeded the change
+# stream from the logs table only, so logs archived before it were never synced.
+def seedArchivedChanges(conn: sqlite3.Connection):
+    names = conn.execute("SELECT name FROM archive_segments ORDER BY first_day, name").fetchall()
+    if not names:
+        return
+    directory = archive.directoryFor(conn.execute("PRAGMA database_list").fetchone()[2])
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archived_ids (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.archived_ids")
+    for (name,) in names:
+        ids = archive.segment(os.path.join(directory, name)).ids.tolist()
+        conn.executemany("INSERT OR IGNORE INTO temp.archived_ids VALUES (?)", ((i,) for i in ids))
+    conn.execute(
+        "INSERT INTO changes (log_id, origin, origin_id, live) SELECT id, 0, id, 1 FROM temp.archived_ids "
+        "WHERE id NOT IN (SELECT log_id FROM changes) ORDER BY id"
+    )
+    conn.execute("DELETE FROM temp.archived_ids")
+
+
+# Schema changes in order, each a script or, where the data needs Python, a
+# function of the connection. PRAGMA user_version stores how many have been
+# applied, so existing ecotrack.db files are brought forward in place. Only
+# ever append.
+MIGRATIONS = [
+    # 1: the original logs table
+    """
+    CREATE TABLE IF NOT EXISTS logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        log_date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        amount REAL NOT NULL,
+        duration_hours REAL NOT NULL DEFAULT 0,
+        kg_co2 REAL NOT NULL,
+        note TEXT
+    );
+    """,
+    # 2: daily totals, filled from the logs already stored
+    TOTALS_SCHEMA_V2 + REBUILD_TOTALS_V2,
+    # 3: indexes for date filters, newest-first ordering and category lookups
+    """
+    CREATE INDEX IF NOT EXISTS idx_logs_date_id ON logs (log_date, id);
+    CREATE INDEX IF NOT EXISTS idx_logs_category_date ON logs (category, log_date);
+    """,
+    # 4: users; existing logs belong to the default user, totals become per user
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        created TEXT NOT NULL DEFAULT (date('now'))
+    );
+    INSERT OR IGNORE INTO users (id, name) VALUES (1, 'default');
+    ALTER TABLE logs ADD COLUMN user_id INTEGER NOT NULL DEFAULT 1;
+    CREATE INDEX IF NOT EXISTS idx_logs_user_date_id ON logs (user_id, log_date, id);
+    CREATE INDEX IF NOT EXISTS idx_logs_user_category_date ON logs (user_id, category, log_date);
+    DROP TRIGGER IF EXISTS logs_totals_insert;
+    DROP TRIGGER IF EXISTS logs_totals_delete;
+    DROP TRIGGER IF EXISTS logs_totals_update;
+    DROP TABLE IF EXISTS daily_totals;
+    DROP TABLE IF EXISTS daily_category_totals;
+    """
+    + TOTALS_SCHEMA
+    + REBUILD_TOTALS,
+    # 5: whole-fleet per-day totals for analytics
+    FLEET_SCHEMA + REBUILD_FLEET,
+    # 6: versioned emission factors, starting from the built-in ones
+    """
+    CREATE TABLE IF NOT EXISTS emission_factors (
+        category TEXT NOT NULL,
+        effective_from TEXT NOT NULL,
+        unit TEXT NOT NULL DEFAULT 'km',
+        kg_per_unit REAL NOT NULL,
+        kg_per_hour REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (category, effective_from)
+    ) WITHOUT ROWID;
+    INSERT OR IGNORE INTO emission_factors VALUES
+        ('Travel: Car', '0001-01-01', 'km', 0.192, 0.30),
+        ('Travel: Bus', '0001-01-01', 'km', 0.105, 0.10),
+        ('Travel: Metro/Train', '0001-01-01', 'km', 0.041, 0.03),
+        ('Travel: Motorcycle', '0001-01-01', 'km', 0.090, 0.15);
+    """,
+    # 7: full-text search over notes, indexing the notes already stored
+    NOTES_SCHEMA + REBUILD_NOTES,
+    # 8: columnar archive of old logs
+    ARCHIVE_SCHEMA,
+    # 9: soft deletes and the undo/redo journal
+    JOURNAL_SCHEMA,
+    # 10: global log ids and the change stream for sync
+    SYNC_SCHEMA,
+    # 11: per-user budgets and the alerts they raised
+    BUDGETS_SCHEMA,
+    # 12: monthly report files and the totals they were drawn from
+    REPORTS_SCHEMA,
+    # 13: per-user totals generations for the in-memory engines
+    TOTALS_GEN_SCHEMA,
+    # 14: logs archived before migration 10 join the change stream
+    seedArchivedChanges,
+]
+
+# The user that logs belong to when none is named
+DEFAULT_USER = 1
+
+# effective_from of the factors that apply to every date
+FIRST_DAY = "0001-01-01"
+
+
+# Create the database or migrate it to the latest schema version
+def createDtb():
+    migrate(db(), FILE)
+
+
+# Bring the database behind conn (path is only for the error message) to the latest schema version
+def migrate(conn: sqlite3.Connection, path: str):
+    with conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > len(MIGRATIONS):
+            raise RuntimeError(f"{path} has schema version {version}, newer than this app supports")
+
+        # Each step runs in its own transaction together with its version bump
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            try:
+                if callable(step):
+                    conn.execute("BEGIN")
+                    step(conn)
+                    conn.execute(f"PRAGMA user_version = {number}")
+                    conn.execute("COMMIT")
+                else:
+                    conn.executescript(f"BEGIN; {step} PRAGMA user_version = {number}; COMMIT;")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
+
+# Compare the totals tables with the logs, archived ones included, returning the dates that disagree
+def verifyTotals() -> list:
+    bad = set()
+    with db() as conn:
+        loadArchivedTotals(conn)
+        cur = conn.cursor()
+        for table, keys in (
+            ("daily_totals", "user_id, log_date"),
+            ("daily_category_totals", "user_id, log_date, category"),
+            ("fleet_daily_totals", "log_date"),
+            ("fleet_category_totals", "log_date, category"),
+        ):
+            from_logs = f"SELECT {keys}, entries, ROUND(kg_co2, 3) FROM ({allLogTotals(keys)})"
+            from_totals = f"SELECT {keys}, entries, ROUND(kg_co2, 3) FROM {table}"
+            cur.execute(
+                f"WITH expected AS MATERIALIZED ({from_logs}) "
+                f"SELECT log_date FROM (SELECT * FROM expected EXCEPT {from_totals}) "
+                f"UNION SELECT log_date FROM ({from_totals} EXCEPT SELECT * FROM expected)"
+            )
+            bad.update(r[0] for r in cur.fetchall())
+    return sorted(bad)
+
+
+# Look up a user's id by name, creating the user if asked to
+def userId(name: str, create: bool = True) -> int:
+    name = name.strip()
+    if not name:
+        raise ValueError("User name must not be empty.")
+    with db() as conn:
+        row = conn.execute("SELECT id FROM users WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            if not create:
+                raise ValueError(f"Unknown user: {name}")
+            row = (conn.execute("INSERT INTO users (name) VALUES (?)", (name,)).lastrowid,)
+    return row[0]
+
+
+# Run a block of reads on one snapshot of the database: a read transaction,
+# or the transaction the connection already has open
+@contextmanager
+def snapshot():
+    conn = db()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+
+# The user's totals generation (see TOTALS_GEN_SCHEMA), None for no such user
+def totalsGen(conn: sqlite3.Connection, user_id: int):
+    row = conn.execute("SELECT totals_gen FROM users WHERE id = ?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+# First statement of a write that moves these users' totals: bump their
+# generations, which takes the write lock, and return {user_id: generation
+# before the write}. Pass it to endTotals before the commit.
+def startTotals(conn: sqlite3.Connection, user_ids) -> dict:
+    rows = conn.execute(
+        "UPDATE users SET totals_gen = totals_gen + 1 WHERE id IN (SELECT value FROM json_each(?)) "
+        "RETURNING id, totals_gen",
+        (json.dumps(sorted(set(user_ids))),),
+    ).fetchall()
+    return {user_id: gen - 1 for user_id, gen in rows}
+
+
+# {user_id: (generation before, generation after)} of the write startTotals began
+def endTotals(conn: sqlite3.Connection, started: dict) -> dict:
+    rows = conn.execute(
+        "SELECT id, totals_gen FROM users WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(started)),),
+    ).fetchall()
+    return {user_id: (started[user_id], gen) for user_id, gen in rows}
+
+
+# All users as (id, name, created), in id order
+def listUsers() -> list:
+    with db() as conn:
+        return conn.execute("SELECT id, name, created FROM users ORDER BY id").fetchall()
+
+
+INSERT_LOG = (
+    "INSERT INTO logs (user_id, log_date, category, amount, duration_hours, kg_co2, note) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+# Triggers bulkInsert replaces with its own set-based statements
+BULK_TRIGGERS = ("logs_totals_insert", "logs_fts_insert", "logs_changes_insert")
+
+
+# Insert many (user_id, log_date, category, amount, duration_hours, kg_co2, note)
+# rows in one transaction. The per-row insert triggers are dropped for the batch:
+# the batch's totals are added with one upsert per user, day and category, and its
+# notes indexed and its change rows written with one INSERT ... SELECT each instead. It is all one transaction, so
+# no other connection ever sees the triggers missing.
+# With a journal ({user_id: journal entry id}, filled in as users turn up), each
+# user's rows join one "add" entry, so an import spread over many batches is
+# undone in one step.
+# Returns {(user_id, log_date, category): (count, kg)} for what the batch added,
+# and the users' totals generations around it (see endTotals).
+def bulkInsert(conn: sqlite3.Connection, rows: list, journal: dict = None):
+    days, cats = {}, {}
+    for row in rows:
+        count, kg = days.get(row[:2], (0, 0.0))
+        days[row[:2]] = (count + 1, kg + row[5])
+        count, kg = cats.get(row[:3], (0, 0.0))
+        cats[row[:3]] = (count + 1, kg + row[5])
+
+    triggers = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name IN (?, ?, ?)", BULK_TRIGGERS
+    ).fetchall()
+
+    # Tracing every row costs as much as the insert itself; count the batch by hand
+    conn.set_trace_callback(None)
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            started = startTotals(conn, {row[0] for row in rows})
+            for name in BULK_TRIGGERS:
+                conn.execute(f"DROP TRIGGER {name}")
+            first = conn.execute("SELECT COALESCE(MAX(id), 0) FROM logs").fetchone()[0]
+            conn.executemany(INSERT_LOG, rows)
+            conn.execute("INSERT INTO logs_fts (rowid, note) SELECT id, note FROM logs WHERE id > ? AND note <> ''",
+                         (first,))
+            conn.execute("INSERT INTO changes (log_id, origin, origin_id, live) SELECT id, 0, id, 1 FROM logs WHERE id > ?",
+                         (first,))
+            if journal is not None:
+                for user_id in sorted({row[0] for row in rows}):
+                    if user_id not in journal:
+                        journal[user_id] = journalEntry(conn, user_id, "add", [])
+                    n = conn.execute(
+                        "INSERT INTO journal_logs (entry_id, log_id) SELECT ?, id FROM logs WHERE id > ? AND +user_id = ?",
+                        (journal[user_id], first, user_id),
+                    ).rowcount
+                    conn.execute("UPDATE journal SET logs = logs + ? WHERE id = ?", (n, journal[user_id]))
+            conn.executemany(
+                "INSERT INTO daily_totals (user_id, log_date, entries, kg_co2) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id, log_date) DO UPDATE SET "
+                "entries = entries + excluded.entries, kg_co2 = kg_co2 + excluded.kg_co2",
+                [key + value for key, value in days.items()],
+            )
+            conn.executemany(
+                "INSERT INTO daily_category_totals (user_id, log_date, category, entries, kg_co2) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id, log_date, category) DO UPDATE SET "
+                "entries = entries + excluded.entries, kg_co2 = kg_co2 + excluded.kg_co2",
+                [key + value for key, value in cats.items()],
+            )
+            for (sql,) in triggers:
+                conn.execute(sql)
+            gens = endTotals(conn, started)
+    finally:
+        conn.set_trace_callback(countQuery)
+        with _stats_lock:
+            STATS["queries"] += len(rows) + len(days) + len(cats) + 13
+
+    return cats, gens
+
+
+# Triggers recalcChunk stands in for with set-based updates of the summaries
+RECALC_TRIGGERS = ("logs_totals_update", "daily_totals_fleet_update", "daily_category_totals_fleet_update")
+
+# Scratch table of one chunk's changed logs: new kg and the change from the old
+# (none for deleted logs, which the totals already leave out)
+RECALC_LOGS = """
+CREATE TEMP TABLE IF NOT EXISTS recalc_logs (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    log_date TEXT,
+    category TEXT,
+    kg REAL,
+    delta REAL
+)
+"""
+
+# Apply temp.recalc_logs: new kg to the logs and the summed changes to every
+# summary table, the way the dropped triggers would have row by row.
+# Separate statements, as executescript would commit the open transaction.
+APPLY_RECALC = (
+    "UPDATE logs SET kg_co2 = r.kg FROM temp.recalc_logs AS r WHERE logs.id = r.id",
+    """
+    UPDATE daily_totals SET kg_co2 = kg_co2 + s.delta
+    FROM (SELECT user_id, log_date, SUM(delta) AS delta FROM temp.recalc_logs GROUP BY user_id, log_date) AS s
+    WHERE daily_totals.user_id = s.user_id AND daily_totals.log_date = s.log_date
+    """,
+    """
+    UPDATE daily_category_totals SET kg_co2 = kg_co2 + s.delta
+    FROM (
+        SELECT user_id, log_date, category, SUM(delta) AS delta FROM temp.recalc_logs
+        GROUP BY user_id, log_date, category
+    ) AS s
+    WHERE daily_category_totals.user_id = s.user_id AND daily_category_totals.log_date = s.log_date
+        AND daily_category_totals.category = s.category
+    """,
+    """
+    UPDATE fleet_daily_totals SET kg_co2 = kg_co2 + s.delta
+    FROM (SELECT log_date, SUM(delta) AS delta FROM temp.recalc_logs GROUP BY log_date) AS s
+    WHERE fleet_daily_totals.log_date = s.log_date
+    """,
+    """
+    UPDATE fleet_category_totals SET kg_co2 = kg_co2 + s.delta
+    FROM (SELECT log_date, category, SUM(delta) AS delta FROM temp.recalc_logs GROUP BY log_date, category) AS s
+    WHERE fleet_category_totals.log_date = s.log_date AND fleet_category_totals.category = s.category
+    """,
+)
+
+
+# Re-derive kg_co2 for logs with ids lo..hi dated since or later (optionally
+# only some categories) from the emission_factors version in effect on each
+# log's day, set-based and in one transaction: the changed logs are collected
+# in one pass, then logs and summaries are updated from that list. Like
+# bulkInsert, the per-row triggers are dropped meanwhile.
+# Returns (user_id, log_date) for every log changed.
+def recalcChunk(conn: sqlite3.Connection, lo: int, hi: int, since: str = FIRST_DAY, categories=None) -> list:
+    only = ""
+    params = [lo, hi, since]
+    if categories:
+        only = f" AND l.category IN ({', '.join('?' * len(categories))})"
+        params.extend(categories)
+
+    triggers = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name IN (?, ?, ?)", RECALC_TRIGGERS
+    ).fetchall()
+
+    changed = []
+    conn.set_trace_callback(None)
+    try:
+        with conn:
+            conn.execute(RECALC_LOGS)
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM temp.recalc_logs")
+            conn.execute(
+                f"""
+                WITH f AS (
+                    SELECT category, effective_from, kg_per_unit, kg_per_hour,
+                           LEAD(effective_from, 1, '9999-12-31')
+                               OVER (PARTITION BY category ORDER BY effective_from) AS until
+                    FROM emission_factors
+                )
+                INSERT INTO temp.recalc_logs (id, user_id, log_date, category, kg, delta)
+                SELECT id, user_id, log_date, category, kg, CASE WHEN deleted IS NULL THEN kg - kg_co2 ELSE 0 END
+                FROM (
+                    SELECT l.id, l.user_id, l.log_date, l.category, l.kg_co2, l.deleted,
+                           pyround(l.amount * f.kg_per_unit + l.duration_hours * f.kg_per_hour, 3) AS kg
+                    FROM logs AS l NOT INDEXED  -- walk the id range, not a category index
+                    JOIN f ON f.category = l.category AND l.log_date >= f.effective_from AND l.log_date < f.until
+                    WHERE l.id BETWEEN ? AND ? AND l.log_date >= ?{only}
+                )
+                WHERE kg IS NOT kg_co2
+                """,
+                params,
+            )
+            changed = conn.execute("SELECT user_id, log_date FROM temp.recalc_logs").fetchall()
+            if changed:
+                for name in RECALC_TRIGGERS:
+                    conn.execute(f"DROP TRIGGER {name}")
+                for sql in APPLY_RECALC:
+                    conn.execute(sql)
+                for (sql,) in triggers:
+                    conn.execute(sql)
+    finally:
+        conn.set_trace_callback(countQuery)
+        with _stats_lock:
+            STATS["queries"] += 4 + (len(APPLY_RECALC) + 6 if changed else 0)
+
+    return changed
+
+
+# Logs per archive segment, and so per archiving transaction
+ARCHIVE_CHUNK = 250000
+
+
+# Move up to limit logs dated before `before` (and after the (log_date, id) key
+# `after`, if given) into a new archive segment, in one transaction. Deleted
+# logs stay behind until compacted, so undo can still bring them back. The rows
+# are deleted with the totals delete trigger dropped, so daily totals, streaks
+# and analytics go on counting them.
+# The segment is registered in the same transaction, so a crash leaves at most
+# an unregistered file behind. Returns the last key archived and how many logs
+# were moved, or None when there was nothing left to move.
+def archiveChunk(conn: sqlite3.Connection, before: str, after=None, limit: int = ARCHIVE_CHUNK):
+    directory = archive.directoryFor(FILE)
+    os.makedirs(directory, exist_ok=True)
+    where, params = "deleted IS NULL AND log_date < ?", [before]
+    if after is not None:
+        where += " AND (log_date, id) > (?, ?)"
+        params.extend(after)
+
+    trigger = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'logs_totals_delete'"
+    ).fetchone()[0]
+
+    path = None
+    conn.set_trace_callback(None)
+    try:
+        with conn:
+            # IMMEDIATE: no other writer can change these rows between the read and the delete
+            conn.execute("BEGIN IMMEDIATE")
+            writer = archive.SegmentWriter()
+            for row in conn.execute(
+                "SELECT id, user_id, log_date, category, amount, duration_hours, kg_co2, note "
+                f"FROM logs WHERE {where} ORDER BY log_date, id LIMIT ?",
+                params + [limit],
+            ):
+                writer.add(row)
+            if not len(writer):
+                return None
+
+            last = (archive.dayString(writer.columns["day"][-1]), writer.columns["id"][-1])
+            where += " AND (log_date, id) <= (?, ?)"
+            params.extend(last)
+            name = f"logs-{archive.dayString(writer.columns['day'][0])}-{last[0]}-{last[1]}.seg"
+            path = os.path.join(directory, name)
+            header = writer.write(path)
+
+            conn.execute("DROP TRIGGER logs_totals_delete")
+            conn.execute(f"DELETE FROM logs WHERE {where}", params)
+            conn.execute(trigger)
+            conn.execute(
+                "INSERT INTO archive_segments (name, rows, first_day, last_day) VALUES (?, ?, ?, ?)",
+                (name, header["rows"], header["first_day"], header["last_day"]),
+            )
+        path = None
+        return last, header["rows"]
+    finally:
+        conn.set_trace_callback(countQuery)
+        with _stats_lock:
+            STATS["queries"] += 6
+        if path is not None and os.path.exists(path):
+            os.remove(path)  # the transaction was rolled back
+
+
+# Open segments of the current database, oldest first, limited to those that
+# can hold the user's (None: anyone's) logs on the day (None: any day)
+def archiveSegments(user_id: int = None, day: str = None) -> list:
+    with db() as conn:
+        names = conn.execute("SELECT name FROM archive_segments ORDER BY first_day, name").fetchall()
+    if not names:
+        return []
+    directory = archive.directoryFor(FILE)
+    segments = [archive.segment(os.path.join(directory, name)) for (name,) in names]
+    return [seg for seg in segments if seg.covers(user_id, day)]
+
+
+# Archived logs are read-only; tells a delete that found nothing why
+def isArchived(log_id: int) -> bool:
+    return any(seg.contains(log_id) for seg in archiveSegments())
+
+
+# Undo steps kept per user. Logs deleted by an entry that drops off the end can
+# no longer come back, and compactChunk purges them.
+JOURNAL_KEEP = 100
+
+
+# Record that user_id's logs `ids` were just added or deleted ("add"/"delete"),
+# inside the caller's transaction, and return the new entry's id. A new entry
+# drops the user's undone entries (redo starts over) and all but the newest
+# JOURNAL_KEEP.
+def journalEntry(conn: sqlite3.Connection, user_id: int, action: str, ids: list) -> int:
+    entry = conn.execute(
+        "INSERT INTO journal (user_id, action, logs) VALUES (?, ?, ?)", (user_id, action, len(ids))
+    ).lastrowid
+    conn.execute(
+        "INSERT INTO journal_logs (entry_id, log_id) SELECT ?, value FROM json_each(?)", (entry, json.dumps(ids))
+    )
+    conn.execute(
+        "DELETE FROM journal WHERE user_id = ?1 AND (undone OR id <= ("
+        "SELECT id FROM journal WHERE user_id = ?1 ORDER BY id DESC LIMIT 1 OFFSET ?2))",
+        (user_id, JOURNAL_KEEP),
+    )
+    return entry
+
+
+# Tombstones purged per compaction transaction
+COMPACT_BATCH = 5000
+
+
+# Purge up to limit deleted logs that can no longer be undone (their journal
+# entry is gone) in one transaction, returning how many were purged. The totals
+# left them out when they were deleted, so this only shrinks the table and the
+# notes index; it runs in small batches so writers get a turn in between.
+def compactChunk(conn: sqlite3.Connection, limit: int = COMPACT_BATCH) -> int:
+    with conn:
+        purged = conn.execute(
+            "DELETE FROM logs WHERE id IN (SELECT id FROM logs WHERE deleted IS NOT NULL "
+            "AND deleted NOT IN (SELECT id FROM journal) LIMIT ?)",
+            (limit,),
+        ).rowcount
+    return purged
+
+
+# Changes exchanged per sync transaction
+SYNC_BATCH = 5000
+
+# What one change carries: (seq, stamp, origin device, origin id, live) and,
+# for a live log, its data. An archived log's data is read from its segment.
+CHANGE_FIELDS = ("seq", "stamp", "device", "origin_id", "live", "user", "log_date", "category", "amount",
+                 "duration_hours", "kg_co2", "note")
+
+# The last two columns are the log's id here and, for a live change whose log
+# is no longer in logs, whether a later change to the same log follows (the
+# log was deleted and then purged, so that later change says what became of it)
+CHANGES_SINCE = """
+SELECT c.source, c.seq, COALESCE(c.stamp, c.seq), d.uuid, c.origin_id, c.live,
+       u.name, l.log_date, l.category, l.amount, l.duration_hours, l.kg_co2, l.note,
+       c.log_id, c.live AND l.id IS NULL AND EXISTS (
+           SELECT 1 FROM changes AS n WHERE n.origin = c.origin AND n.origin_id = c.origin_id AND n.seq > c.seq)
+FROM changes AS c
+JOIN devices AS d ON d.id = c.origin
+LEFT JOIN logs AS l ON c.live AND l.id = c.log_id
+LEFT JOIN users AS u ON u.id = l.user_id
+WHERE c.seq > ? ORDER BY c.seq LIMIT ?
+"""
+
+
+# This database's device id
+def deviceId(conn: sqlite3.Connection) -> str:
+    return conn.execute("SELECT uuid FROM devices WHERE id = 0").fetchone()[0]
+
+
+# How far the device's change stream has been applied here (0: never)
+def pulledFrom(conn: sqlite3.Connection, device: str) -> int:
+    row = conn.execute("SELECT pulled FROM sync_peers WHERE device = ?", (device,)).fetchone()
+    return row[0] if row else 0
+
+
+# {log id: (user_id, log_date, category, amount, duration_hours, kg_co2, note)}
+# for the ids found in the archive segments of conn's database file
+def archivedLogs(conn: sqlite3.Connection, ids: list) -> dict:
+    names = conn.execute("SELECT name FROM archive_segments ORDER BY first_day, name").fetchall()
+    if not names:
+        return {}
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    directory = archive.directoryFor(path)
+    found = {}
+    for (name,) in names:
+        found.update(archive.segment(os.path.join(directory, name)).find(ids))
+    return found
+
+
+# The changes among the next limit after seq `since` that did not come from
+# `device`, oldest first, as CHANGE_FIELDS lists, and the last seq looked at
+# (`since` once there is nothing newer). Archived logs go out with their data
+# from the archive; a live change to a purged log is left out, as the delete
+# that follows it in the stream supersedes it.
+def changesSince(conn: sqlite3.Connection, since: int, limit: int = SYNC_BATCH, device: str = None) -> tuple:
+    row = conn.execute("SELECT id FROM devices WHERE uuid = ?", (device,)).fetchone()
+    skip = row[0] if row else -1
+    rows = conn.execute(CHANGES_SINCE, (since, limit)).fetchall()
+    last = rows[-1][1] if rows else since
+    rows = [r for r in rows if r[0] != skip and not r[14]]
+
+    missing = [r[13] for r in rows if r[5] and r[7] is None]
+    archived = archivedLogs(conn, missing) if missing else {}
+    names = dict(conn.execute(
+        "SELECT id, name FROM users WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted({log[0] for log in archived.values()})),),
+    )) if archived else {}
+
+    out = []
+    for r in rows:
+        change = list(r[1:13])
+        if r[5] and r[7] is None:
+            log = archived.get(r[13])
+            if log is None:
+                raise ValueError(f"Log {r[13]} is neither in the logs nor in the archive; cannot send it.")
+            change[5:] = [names[log[0]], *log[1:]]
+        out.append(change)
+    return out, last
+
+
+# Staging table for one batch of incoming changes, and the set-based steps that
+# apply it: keep each log's last change, give new origins a device number, drop
+# changes no newer than what this database last did to the log (stamp * 2, plus
+# one for a delete, so deletes win ties), find the logs already here, then
+# insert, restore and delete in one statement each. A log that started here and
+# has been purged comes back under its old id. Deletes from a peer point at no
+# journal entry (deleted = 0): they cannot be undone here, and compaction
+# purges them.
+SYNC_IN = """
+CREATE TEMP TABLE IF NOT EXISTS sync_in (
+    seq INTEGER PRIMARY KEY, stamp INTEGER, device TEXT, origin_id INTEGER, live INTEGER, user TEXT,
+    log_date TEXT, category TEXT, amount REAL, duration_hours REAL, kg_co2 REAL, note TEXT,
+    origin INTEGER, log_id INTEGER
+)
+"""
+
+APPLY_SYNC = (
+    "DELETE FROM temp.sync_in WHERE seq NOT IN (SELECT MAX(seq) FROM temp.sync_in GROUP BY device, origin_id)",
+    "INSERT OR IGNORE INTO devices (uuid) SELECT DISTINCT device FROM temp.sync_in",
+    "UPDATE temp.sync_in SET origin = (SELECT d.id FROM devices AS d WHERE d.uuid = sync_in.device)",
+    "DELETE FROM temp.sync_in WHERE stamp * 2 + 1 - live <= COALESCE(("
+    "SELECT COALESCE(c.stamp, c.seq) * 2 + 1 - c.live FROM changes AS c "
+    "WHERE c.origin = sync_in.origin AND c.origin_id = sync_in.origin_id ORDER BY c.seq DESC LIMIT 1), -1)",
+    "UPDATE temp.sync_in SET log_id = CASE WHEN origin = 0 "
+    "THEN (SELECT l.id FROM logs AS l WHERE l.id = sync_in.origin_id AND l.origin IS NULL) "
+    "ELSE (SELECT l.id FROM logs AS l WHERE l.origin = sync_in.origin AND l.origin_id = sync_in.origin_id) END",
+    "INSERT OR IGNORE INTO users (name) SELECT DISTINCT user FROM temp.sync_in "
+    "WHERE live AND log_id IS NULL AND user IS NOT NULL",
+)
+
+SYNC_INSERT = """
+INSERT INTO logs (user_id, log_date, category, amount, duration_hours, kg_co2, note, origin, origin_id)
+SELECT u.id, s.log_date, s.category, s.amount, s.duration_hours, s.kg_co2, s.note, s.origin, s.origin_id
+FROM temp.sync_in AS s JOIN users AS u ON u.name = s.user
+WHERE s.live AND s.log_id IS NULL AND s.origin <> 0
+ORDER BY s.log_date, s.seq
+RETURNING user_id
+"""
+
+SYNC_REINSERT = """
+INSERT INTO logs (id, user_id, log_date, category, amount, duration_hours, kg_co2, note)
+SELECT s.origin_id, u.id, s.log_date, s.category, s.amount, s.duration_hours, s.kg_co2, s.note
+FROM temp.sync_in AS s JOIN users AS u ON u.name = s.user
+WHERE s.live AND s.log_id IS NULL AND s.origin = 0
+RETURNING user_id
+"""
+
+# What BULK_TRIGGERS would have done for the logs a sync batch inserted (id > ?);
+# NOT INDEXED keeps the totals to the new id range instead of a whole index
+SYNC_CATCH_UP = (
+    "INSERT INTO logs_fts (rowid, note) SELECT id, note FROM logs WHERE id > ? AND note <> ''",
+    "INSERT INTO changes (log_id, origin, origin_id, live) SELECT id, origin, origin_id, 1 FROM logs WHERE id > ? "
+    "ORDER BY id",
+    "INSERT INTO daily_totals (user_id, log_date, entries, kg_co2) "
+    "SELECT user_id, log_date, COUNT(*), SUM(kg_co2) FROM logs NOT INDEXED WHERE id > ? GROUP BY user_id, log_date "
+    "ON CONFLICT(user_id, log_date) DO UPDATE SET "
+    "entries = entries + excluded.entries, kg_co2 = kg_co2 + excluded.kg_co2",
+    "INSERT INTO daily_category_totals (user_id, log_date, category, entries, kg_co2) "
+    "SELECT user_id, log_date, category, COUNT(*), SUM(kg_co2) FROM logs NOT INDEXED WHERE id > ? "
+    "GROUP BY user_id, log_date, category "
+    "ON CONFLICT(user_id, log_date, category) DO UPDATE SET "
+    "entries = entries + excluded.entries, kg_co2 = kg_co2 + excluded.kg_co2",
+)
+
+SYNC_RESTORE = """
+UPDATE logs SET deleted = NULL
+WHERE deleted IS NOT NULL AND id IN (SELECT log_id FROM temp.sync_in WHERE live AND log_id IS NOT NULL)
+RETURNING user_id
+"""
+
+SYNC_DELETE = """
+UPDATE logs SET deleted = 0
+WHERE deleted IS NULL AND id IN (SELECT log_id FROM temp.sync_in WHERE NOT live AND log_id IS NOT NULL)
+RETURNING user_id
+"""
+
+# Every change that won is recorded with its own stamp, including ones that
+# changed nothing here (a log already deleted, or never seen), so an older
+# change to the same log arriving by another route still loses. ?1 is the
+# sending device's number, ?2 the last seq before the batch.
+SYNC_RECORD = (
+    "UPDATE changes SET stamp = s.stamp, source = ?1 FROM temp.sync_in AS s "
+    "WHERE changes.seq > ?2 AND s.origin = changes.origin AND s.origin_id = changes.origin_id",
+    "INSERT INTO changes (log_id, origin, origin_id, live, stamp, source) "
+    "SELECT COALESCE(s.log_id, 0), s.origin, s.origin_id, s.live, s.stamp, ?1 FROM temp.sync_in AS s "
+    "WHERE NOT EXISTS (SELECT 1 FROM changes AS c "
+    "WHERE c.origin = s.origin AND c.origin_id = s.origin_id AND c.seq > ?2) ORDER BY s.seq",
+)
+
+
+# Apply a batch of the device's changes (CHANGE_FIELDS lists, in seq order)
+# and record `last` as how far its stream has been applied, all in one
+# transaction, so an interrupted sync picks up after the last whole batch. New
+# logs go in like bulkInsert's, with the insert triggers dropped for the batch.
+# A live change that comes without its log's data stops the batch: the changes
+# before it are applied and the stream is recorded as applied up to just
+# before it, so the log is not lost once the sender can send it.
+# Returns {"added", "restored", "deleted", "users", "pulled"} (users: ids whose
+# logs changed; pulled: how far the stream was applied).
+def applyChanges(conn: sqlite3.Connection, device: str, rows: list, last: int) -> dict:
+    if device == deviceId(conn):
+        raise ValueError("Cannot sync a database with itself (or with a copy of its file).")
+    for i, row in enumerate(rows):
+        if row[4] and row[5] is None:
+            rows, last = rows[:i], row[0] - 1
+            break
+    clock = max((row[1] for row in rows), default=0)
+    conn.execute(SYNC_IN)
+    triggers = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name IN (?, ?, ?)", BULK_TRIGGERS
+    ).fetchall()
+    with conn:
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM temp.sync_in")
+        conn.executemany("INSERT INTO temp.sync_in VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL)", rows)
+        for sql in APPLY_SYNC:
+            conn.execute(sql)
+        conn.execute("INSERT OR IGNORE INTO devices (uuid) VALUES (?)", (device,))
+        source = conn.execute("SELECT id FROM devices WHERE uuid = ?", (device,)).fetchone()[0]
+        mark = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+        for name in BULK_TRIGGERS:
+            conn.execute(f"DROP TRIGGER {name}")
+        first = conn.execute("SELECT COALESCE(MAX(id), 0) FROM logs").fetchone()[0]
+        added = conn.execute(SYNC_INSERT).fetchall()
+        if added:
+            for sql in SYNC_CATCH_UP:
+                conn.execute(sql, (first,))
+        for (sql,) in triggers:
+            conn.execute(sql)
+        restored = conn.execute(SYNC_REINSERT).fetchall() + conn.execute(SYNC_RESTORE).fetchall()
+        deleted = conn.execute(SYNC_DELETE).fetchall()
+        for sql in SYNC_RECORD:
+            conn.execute(sql, (source, mark))
+
+        # Keep the clock ahead of every stamp seen, so changes made here next win
+        conn.execute("UPDATE sqlite_sequence SET seq = ?1 WHERE name = 'changes' AND seq < ?1", (clock,))
+        conn.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'changes', ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'changes')",
+            (clock,),
+        )
+        conn.execute(
+            "INSERT INTO sync_peers (device, pulled) VALUES (?, ?) "
+            "ON CONFLICT(device) DO UPDATE SET pulled = excluded.pulled, synced = datetime('now')",
+            (device, last),
+        )
+        conn.execute("DELETE FROM temp.sync_in")
+    return {
+        "added": len(added),
+        "restored": len(restored),
+        "deleted": len(deleted),
+        "users": sorted({r[0] for r in added + restored + deleted}),
+        "pulled": last,
+    }
+
+
+# Logs count and kg total for one day, read from daily_totals
+# (user_id None adds up every user's day)
+def dayTotal(day_s: str, user_id: int = None):
+    with db() as conn:
+        cur = conn.cursor()
+        if user_id is None:
+            cur.execute("SELECT SUM(entries), SUM(kg_co2) FROM daily_totals WHERE log_date = ?", (day_s,))
+        else:
+            cur.execute(
+                "SELECT entries, kg_co2 FROM daily_totals WHERE user_id = ? AND log_date = ?", (user_id, day_s)
+            )
+        row = cur.fetchone()
+    if row is None or row[0] is None:
+        return 0, 0.0
+    return row[0], round(row[1], 3)
+
+
+# Window onto one user's logs (or everyone's, for user_id None) in History
+# order (newest date, then newest id first).
+# Pages are fetched with keyset conditions on (log_date, id) so reading page k
+# never scans the rows before it; a jump to an unseen page first finds its start
+# key with an index-only OFFSET from the nearest page already seen.
+# Archived logs are merged in: each page takes the next rows from logs and
+# from every archive segment that can hold the view's rows.
+# The app's own writes are patched in with insert()/remove() instead of
+# building a new pager, so the cached pages and totals stay usable.
+class HistoryPager:
+    PAGE = 200
+    KEEP_PAGES = 8
+    COLUMNS = "log_date, category, amount, duration_hours, kg_co2, COALESCE(note, ''), id"
+
+    def __init__(self, day: str = None, user_id: int = None):
+        self.day = day
+        self.user_id = user_id
+        self.pages = OrderedDict()  # page number -> rows, least recently used first
+        self.anchors = {0: None}  # page number -> (log_date, id) of the row just before it
+        self.segments = archiveSegments(user_id, day)
+
+        # Row count and kg total come from daily_totals, not from the logs rows
+        if day:
+            self.count, self.total = dayTotal(day, user_id)
+        else:
+            query = "SELECT COALESCE(SUM(entries), 0), COALESCE(SUM(kg_co2), 0) FROM daily_totals"
+            params = ()
+            if user_id is not None:
+                query += " WHERE user_id = ?"
+                params = (user_id,)
+            with db() as conn:
+                row = conn.execute(query, params).fetchone()
+            self.count, self.total = row[0], round(row[1], 3)
+
+    # WHERE clause and params for rows after an anchor key
+    def where(self, anchor):
+        clauses, params = ["deleted IS NULL"], []
+        if self.user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(self.user_id)
+        if self.day:
+            clauses.append("log_date = ?")
+            params.append(self.day)
+            if anchor is not None:
+                clauses.append("id < ?")
+                params.append(anchor[1])
+        elif anchor is not None:
+            clauses.append("(log_date, id) < (?, ?)")
+            params.extend(anchor)
+        return " WHERE " + " AND ".join(clauses), params
+
+    # Key of the row just before the start of page k
+    def anchor(self, k: int):
+        if k in self.anchors:
+            return self.anchors[k]
+        j = max(p for p in self.anchors if p < k)
+        if self.segments:
+            self.anchors[k] = self.seek(self.anchors[j], (k - j) * self.PAGE - 1)
+            return self.anchors[k]
+        where, params = self.where(self.anchors[j])
+        with db() as conn:
+            row = conn.execute(
+                f"SELECT log_date, id FROM logs{where} ORDER BY log_date DESC, id DESC LIMIT 1 OFFSET ?",
+                params + [(k - j) * self.PAGE - 1],
+            ).fetchone()
+        self.anchors[k] = tuple(row) if row else None
+        return self.anchors[k]
+
+    # With an archive, the key of the row `skip` rows past key: whole days are
+    # skipped using daily_totals (which count archived logs too), and only the
+    # day that row is on is read, from logs and the archive
+    def seek(self, key, skip: int):
+        if key is not None or self.day:
+            day_s = key[0] if key else self.day
+            ids = self.dayIds(day_s, key[1] if key else None)
+            if skip < len(ids):
+                return day_s, ids[skip]
+            if self.day:
+                return None
+            skip -= len(ids)
+
+        table, where, params = "fleet_daily_totals", "", []
+        if self.user_id is not None:
+            table, where, params = "daily_totals", "user_id = ? AND ", [self.user_id]
+        with db() as conn:
+            days = conn.execute(
+                f"SELECT log_date, entries FROM {table} WHERE {where}log_date < ? ORDER BY log_date DESC",
+                params + [key[0] if key else "9999-12-31"],
+            )
+            for day_s, entries in days:
+                if skip < entries:
+                    break
+                skip -= entries
+            else:
+                return None
+        ids = self.dayIds(day_s)
+        return (day_s, ids[min(skip, len(ids) - 1)]) if ids else None
+
+    # ids of one day's logs in this view, live and archived, newest first
+    def dayIds(self, day_s: str, below: int = None) -> list:
+        query, params = "SELECT id FROM logs WHERE deleted IS NULL AND log_date = ?", [day_s]
+        if self.user_id is not None:
+            query += " AND user_id = ?"
+            params.append(self.user_id)
+        if below is not None:
+            query += " AND id < ?"
+            params.append(below)
+        with db() as conn:
+            ids = [r[0] for r in conn.execute(query, params)]
+        for seg in self.segments:
+            ids.extend(seg.dayIds(day_s, self.user_id, below))
+        return sorted(ids, reverse=True)
+
+    def page(self, k: int) -> list:
+        if k in self.pages:
+            self.pages.move_to_end(k)
+            return self.pages[k]
+
+        anchor = self.anchor(k)
+        if k > 0 and anchor is None:
+            return []  # past the last row
+        where, params = self.where(anchor)
+        with db() as conn:
+            rows = conn.execute(
+                f"SELECT {self.COLUMNS} FROM logs{where} ORDER BY log_date DESC, id DESC LIMIT ?",
+                params + [self.PAGE],
+            ).fetchall()
+        if self.segments:
+            archived = [seg.before(anchor, self.user_id, self.day) for seg in self.segments]
+            rows = list(islice(merge(rows, *archived, key=lambda r: (r[0], r[6]), reverse=True), self.PAGE))
+        if len(rows) == self.PAGE:
+            self.anchors.setdefault(k + 1, (rows[-1][0], rows[-1][6]))
+
+        self.pages[k] = rows
+        if len(self.pages) > self.KEEP_PAGES:
+            self.pages.popitem(last=False)
+        return rows
+
+    def matches(self, user_id: int, day_s: str) -> bool:
+        return self.user_id in (None, user_id) and self.day in (None, day_s)
+
+    # A copy to patch with insert()/remove() while this one may still be read
+    # elsewhere; cached pages are shared, as a patch replaces them, never edits them
+    def copy(self):
+        other = copy(self)
+        other.pages = OrderedDict(self.pages)
+        other.anchors = dict(self.anchors)
+        return other
+
+    # Page a (log_date, id) key falls in: the last page whose start key is after
+    # it (a None start key past page 0 marks the end of the result)
+    def pageOf(self, key) -> int:
+        return max(k for k, a in self.anchors.items() if k == 0 or (a is not None and key < a))
+
+    # Add a just-written log (a row in COLUMNS order) if it belongs in this view
+    def insert(self, row, user_id: int) -> bool:
+        if not self.matches(user_id, row[0]):
+            return False
+        self.count += 1
+        self.total = round(self.total + row[4], 3)
+
+        key = (row[0], row[6])
+        k = self.pageOf(key)
+        rows = self.pages.get(k)
+        if rows is None:
+            self.forget(k)
+            return True
+        i = 0
+        while i < len(rows) and (rows[i][0], rows[i][6]) > key:
+            i += 1
+        self.settle(k, rows[:i] + [tuple(row)] + rows[i:])
+        return True
+
+    # Drop a just-deleted log (a row in COLUMNS order) from this view
+    def remove(self, row, user_id: int) -> bool:
+        if not self.matches(user_id, row[0]):
+            return False
+        self.count = max(0, self.count - 1)
+        self.total = round(self.total - row[4], 3)
+
+        k = self.pageOf((row[0], row[6]))
+        rows = self.pages.get(k)
+        if rows is None:
+            self.forget(k)
+            return True
+        self.settle(k, [r for r in rows if r[6] != row[6]], was_full=len(rows) == self.PAGE)
+        return True
+
+    # Page k is one row longer or shorter after a write: pass the extra row on
+    # (or take one back) through the cached pages after it so every page is
+    # PAGE rows again, and forget what cannot be fixed without a query
+    def settle(self, k: int, rows: list, was_full: bool = True):
+        while True:
+            following = self.pages.get(k + 1)
+            if len(rows) > self.PAGE:
+                spill = rows.pop()
+                self.pages[k] = rows
+                self.anchors[k + 1] = (rows[-1][0], rows[-1][6])
+                if following is None:
+                    self.forget(k + 1)
+                    return
+                k, rows = k + 1, [spill] + following
+            elif len(rows) < self.PAGE and was_full and following != []:
+                if following is None:
+                    self.pages.pop(k, None)  # refetched from its (unchanged) start key
+                    self.forget(k)
+                    return
+                rows = rows + [following[0]]
+                self.pages[k] = rows
+                self.anchors[k + 1] = (rows[-1][0], rows[-1][6])
+                k, rows, was_full = k + 1, following[1:], len(following) == self.PAGE
+            else:
+                self.pages[k] = rows
+                if len(rows) < self.PAGE:
+                    self.forget(k)  # the last page
+                    return
+                self.anchors[k + 1] = (rows[-1][0], rows[-1][6])
+                self.forget(k + 1)
+                return
+
+    # Drop pages and start keys after page k; they have shifted by one row
+    def forget(self, k: int):
+        for j in [j for j in self.anchors if j > k]:
+            del self.anchors[j]
+        for j in [j for j in self.pages if j > k]:
+            del self.pages[j]
+
+    # Rows start .. start + n - 1 of the result
+    def rows(self, start: int, n: int) -> list:
+        out = []
+        k = start // self.PAGE
+        skip = start - k * self.PAGE
+        while len(out) < n:
+            rows = self.page(k)[skip:]
+            if not rows:
+                break
+            out.extend(rows[: n - len(out)])
+            k += 1
+            skip = 0
+        return out
+
+
+# Turn what someone typed into an FTS5 query: every word must appear (in any
+# order, stemmed), and a trailing * makes a word a prefix. Quoting each word
+# means stray punctuation or FTS operators can never be a syntax error.
+def matchQuery(text: str) -> str:
+    words = re.findall(r"\w+\*?", text)
+    if not words:
+        raise ValueError("Search text must contain a word.")
+    return " ".join(f'"{w.rstrip("*")}"' + ("*" if w.endswith("*") else "") for w in words)
+
+
+# History filtered to logs whose note matches a search, best match first (FTS5
+# bm25 rank, then newest). Scoring needs every hit, so it is done once: the
+# hits' ids and ranks are kept in compact arrays, and each page is then read
+# by primary key, so scrolling deep into the hits costs the same as page 0.
+class NoteSearch(HistoryPager):
+    def __init__(self, text: str, day: str = None, user_id: int = None):
+        self.text = text
+        self.query = matchQuery(text)
+        self.day = day
+        self.user_id = user_id
+        self.pages = OrderedDict()
+
+        clauses, params = ["logs_fts MATCH ?", "l.deleted IS NULL"], [self.query]
+        if user_id is not None:
+            clauses.append("l.user_id = ?")
+            params.append(user_id)
+        if day:
+            clauses.append("l.log_date = ?")
+            params.append(day)
+        with db() as conn:
+            # CROSS JOIN keeps the FTS index as the outer loop
+            hits = conn.execute(
+                "SELECT logs_fts.rank, l.id, l.kg_co2 FROM logs_fts CROSS JOIN logs AS l ON l.id = logs_fts.rowid "
+                f"WHERE {' AND '.join(clauses)} ORDER BY logs_fts.rank, l.id DESC",
+                params,
+            ).fetchall()
+        self.ranks = array("d", [h[0] for h in hits])
+        self.ids = array("q", [h[1] for h in hits])
+        self.count = len(hits)
+        self.total = round(sum(h[2] for h in hits), 3)
+
+    def page(self, k: int) -> list:
+        if k in self.pages:
+            self.pages.move_to_end(k)
+            return self.pages[k]
+        ids = self.ids[k * self.PAGE:(k + 1) * self.PAGE].tolist()
+        if not ids:
+            return []
+        with db() as conn:
+            found = {
+                r[6]: r
+                for r in conn.execute(
+                    f"SELECT {self.COLUMNS} FROM logs WHERE id IN ({', '.join('?' * len(ids))}) AND deleted IS NULL",
+                    ids,
+                )
+            }
+        rows = [found[i] for i in ids if i in found]
+        self.pages[k] = rows
+        if len(self.pages) > self.KEEP_PAGES:
+            self.pages.popitem(last=False)
+        return rows
+
+    # A new log joins the hits if its note matches, placed by its rank (it has
+    # the highest id, so it goes first among equal ranks)
+    def insert(self, row, user_id: int) -> bool:
+        if not self.matches(user_id, row[0]) or not row[5]:
+            return False
+        with db() as conn:
+            hit = conn.execute(
+                "SELECT rank FROM logs_fts WHERE logs_fts MATCH ? AND rowid = ?", (self.query, row[6])
+            ).fetchone()
+        if hit is None:
+            return False
+        i = bisect_left(self.ranks, hit[0])
+        self.ranks.insert(i, hit[0])
+        self.ids.insert(i, row[6])
+        self.count += 1
+        self.total = round(self.total + row[4], 3)
+        self.dropFrom(i)
+        return True
+
+    def remove(self, row, user_id: int) -> bool:
+        if not self.matches(user_id, row[0]) or row[6] not in self.ids:
+            return False
+        i = self.ids.index(row[6])
+        del self.ranks[i]
+        del self.ids[i]
+        self.count -= 1
+        self.total = round(self.total - row[4], 3)
+        self.dropFrom(i)
+        return True
+
+    # A copy to patch while this one may still be read (see HistoryPager.copy)
+    def copy(self):
+        other = copy(self)
+        other.pages = OrderedDict(self.pages)
+        other.ranks = array("d", self.ranks)
+        other.ids = array("q", self.ids)
+        return other
+
+    # Cached pages from the one holding hit i on have shifted
+    def dropFrom(self, i: int):
+        for k in [k for k in self.pages if k >= i // self.PAGE]:
+            del self.pages[k]
@@ -0,0 +1,137 @@
+import json
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+import storage
+from storage import SYNC_BATCH, applyChanges, changesSince, db, deviceId, migrate, openConn, pulledFrom
+from core import reloadUsers
+
+# Seconds to wait on a sync server before giving up
+TIMEOUT = 60
+
+
+# One side of a sync backed by a database file, this one (conn given) or
+# another one, which is opened and brought to the latest schema first
+class FileTarget:
+    def __init__(self, path: str, conn=None):
+        self.path = path
+        self.own = conn is None
+        self.conn = openConn(path) if self.own else conn
+        if self.own:
+            migrate(self.conn, path)
+
+    def device(self) -> str:
+        return deviceId(self.conn)
+
+    def pulled(self, device: str) -> int:
+        return pulledFrom(self.conn, device)
+
+    def changes(self, since: int, limit: int, device: str) -> tuple:
+        return changesSince(self.conn, since, limit, device)
+
+    def apply(self, device: str, rows: list, last: int) -> dict:
+        return applyChanges(self.conn, device, rows, last)
+
+    def close(self):
+        if self.own:
+            self.conn.close()
+
+
+# One side of a sync behind an EcoTrack API server (ecotrack.py serve):
+# GET /sync, GET /changes and POST /changes
+class HttpTarget:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def call(self, path: str, query: dict = None, body: dict = None) -> dict:
+        url = f"{self.url}/{path}" + (f"?{urlencode(query)}" if query else "")
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = Request(url, data, {"Content-Type": "application/json"} if data else {})
+        try:
+            with urlopen(request, timeout=TIMEOUT) as response:
+                return json.loads(response.read())
+        except HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error")
+            except ValueError:
+                message = None
+            raise ValueError(f"{url}: {message or e}")
+
+    def device(self) -> str:
+        return self.call("sync")["device"]
+
+    def pulled(self, device: str) -> int:
+        return self.call("sync", {"device": device})["pulled"]
+
+    def changes(self, since: int, limit: int, device: str) -> tuple:
+        reply = self.call("changes", {"since": since, "limit": limit, "device": device})
+        return reply["changes"], reply["last"]
+
+    def apply(self, device: str, rows: list, last: int) -> dict:
+        return self.call("changes", body={"device": device, "changes": rows, "last": last})
+
+    def close(self):
+        pass
+
+
+def openTarget(target: str):
+    if target.startswith(("http://", "https://")):
+        return HttpTarget(target)
+    return FileTarget(target)
+
+
+# Move the changes src has made since dst last heard from it over to dst,
+# batch changes per transaction on the receiving side. Changes src got from
+# dst in the first place are left out, but still move dst's position on. If
+# dst stops at a change it cannot apply, the report says why ("stopped").
+def transfer(src, dst, batch: int = SYNC_BATCH) -> dict:
+    device, peer = src.device(), dst.device()
+    since = dst.pulled(device)
+    report = {"changes": 0, "added": 0, "restored": 0, "deleted": 0, "users": set()}
+    while True:
+        rows, last = src.changes(since, batch, peer)
+        if last == since:
+            break
+        done = dst.apply(device, rows, last)
+        report["changes"] += sum(row[0] <= done["pulled"] for row in rows)
+        for key in ("added", "restored", "deleted"):
+            report[key] += done[key]
+        report["users"].update(done["users"])
+        if done["pulled"] < last:
+            # Applied up to a change that came without its log; the rest waits
+            report["stopped"] = (f"change {done['pulled'] + 1} came without its log's data, "
+                                 "so the sync stopped before it and picks up from there next time")
+            break
+        since = last
+    return report
+
+
+# Exchange changes with another database file or a sync server, both ways:
+# first pull what it has that this database has not seen, then push back.
+# Only the changes since the last sync with it cross over, so the work is
+# proportional to what is new, not to the size of either database.
+def syncWith(target: str, batch: int = SYNC_BATCH) -> dict:
+    started = time.perf_counter()
+    here = FileTarget(storage.FILE, db())
+    there = openTarget(target)
+    try:
+        if there.device() == here.device():
+            raise ValueError(f"{target} is this database (or a copy of its file); copies cannot be synced.")
+        pulled = transfer(there, here, batch)
+        reloadUsers(pulled["users"])
+        pushed = transfer(here, there, batch)
+    finally:
+        there.close()
+
+    seconds = time.perf_counter() - started
+    moved = pulled["changes"] + pushed["changes"]
+    for report in (pulled, pushed):
+        report["users"] = len(report["users"])
+    return {
+        "pulled": pulled,
+        "pushed": pushed,
+        "seconds": round(seconds, 3),
+        "changes_per_sec": round(moved / seconds) if seconds > 0 else 0,
+    }
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core
+import storage
+from querycache import VIEWS
+
+
+# Drop everything kept in memory about the database in use
+def forget():
+    core.STREAKS.clear()
+    core.BUDGETS.clear()
+    core.FACTORS = {}
+    VIEWS.clear()
+
+
+# Switch to another fresh, fully migrated database in the test's temp dir:
+# newDtb("b.db"). Switching back to an earlier one reads it again from scratch.
+@pytest.fixture
+def newDtb(tmp_path):
+    old = storage.FILE
+
+    def use(name: str = "ecotrack.db") -> str:
+        storage.useFile(str(tmp_path / name))
+        storage.createDtb()
+        forget()
+        return storage.FILE
+
+    yield use
+    forget()
+    storage.useFile(old)
+
+
+# A fresh database for the test
+@pytest.fixture
+def dtb(newDtb):
+    return newDtb()
@@ -0,0 +1,33 @@
+from datetime import date, timedelta
+
+import bench
+import bulk
+import ecotrack
+import storage
+from core import fmtDate
+
+
+def test_archive_lookups_and_delete(dtb, capsys):
+    bench.populate(2000, users=2, seed=8)
+    live_before = {r[0] for r in storage.db().execute("SELECT id FROM logs")}
+    report = bulk.archiveLogs(fmtDate(date.today() - timedelta(days=100)))
+    assert report["rows"] > 0
+    assert storage.verifyTotals() == []
+
+    live = {r[0] for r in storage.db().execute("SELECT id FROM logs")}
+    archived = live_before - live
+    assert len(archived) == report["rows"]
+    (seg,) = storage.archiveSegments()
+    assert all(seg.contains(i) for i in archived)
+    assert not any(seg.contains(i) for i in live)
+    assert not seg.contains(0) and not seg.contains(max(live_before) + 1)
+
+    old, new = min(archived), max(live)
+    code = ecotrack.main(["delete", str(old), str(new), "999999"])
+    out = capsys.readouterr().out
+    assert code == 1
+    assert out.splitlines() == [
+        "Deleted 1 log",
+        f"Archived, so they cannot be deleted: #{old}",
+        "Not found: #999999",
+    ]
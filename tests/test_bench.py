@@ -0,0 +1,33 @@
+from datetime import date, timedelta
+
+import bench
+import core
+import storage
+from core import fmtDate, goodDay, streakShow
+
+
+# The streak counted the slow way: one day at a time back from today
+def naiveStreak(user_id: int) -> int:
+    day, streak = date.today(), 0
+    while True:
+        count, total = storage.dayTotal(fmtDate(day), user_id)
+        if not goodDay(count, total):
+            return streak
+        streak += 1
+        day -= timedelta(days=1)
+
+
+def test_synthetic_logs_are_seeded_and_valid(dtb):
+    rows = list(bench.syntheticLogs(600, users=2, seed=7))
+    assert rows == list(bench.syntheticLogs(600, users=2, seed=7))
+    assert len(rows) == 600
+    assert rows[-1][1] == fmtDate(date.today())
+    for user_id, day_s, cat, amount, hrs, note in rows:
+        assert core.checkLog(day_s, cat, amount, hrs) == (day_s, cat, amount, hrs)
+
+
+def test_populate_keeps_totals_and_streaks(dtb):
+    bench.populate(3000, users=2, seed=3)
+    assert storage.verifyTotals() == []
+    for user_id in (1, 2):
+        assert streakShow(user_id) == naiveStreak(user_id) > 0
@@ -0,0 +1,74 @@
+from datetime import date
+
+import bulk
+import storage
+from budgets import addBudget, listAlerts, listBudgets, newAlerts
+from core import addLogs, fmtDate, removeLogs, undoLast
+
+# 20 km by bus is 2.1 kg CO₂
+TRIP = (1, None, "Travel: Bus", 20.0, 0.0, None)
+
+
+def trips(day_s: str, n: int) -> list:
+    return addLogs([TRIP[:1] + (day_s,) + TRIP[2:]] * n)
+
+
+def test_alert_fires_once_per_period(dtb):
+    today = fmtDate(date.today())
+    budget = addBudget(1, "day", 10)
+    trips(today, 4)  # 8.4 kg
+    assert newAlerts(1) == []
+
+    ids = [log_id for log_id, _ in trips(today, 1)]  # 10.5 kg: over
+    (alert,) = newAlerts(1)
+    assert alert[1:3] == (today, 10.5)
+
+    # Going further over, dropping back under and crossing again stays one alert
+    trips(today, 2)
+    removeLogs(ids + [ids[0] - 1, ids[0] - 2, ids[0] - 3])
+    trips(today, 3)
+    undoLast(1)
+    undoLast(1, redo=True)
+    assert newAlerts(1) == []
+    assert len(listAlerts(1)) == 1
+
+    # Another day is another period
+    trips("2026-01-05", 5)
+    (alert,) = newAlerts(1)
+    assert alert[1] == "2026-01-05"
+
+    (status,) = listBudgets(1)
+    kg = storage.dayTotal(today, 1)[1]
+    assert status[0] == budget and status[4] == today and round(status[6], 3) == kg
+
+
+def test_import_crossing_alerts_once(dtb, tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, "BATCH", 3)
+    addBudget(1, "month", 20)
+    path = tmp_path / "in.jsonl"
+    path.write_text("".join('{"log_date": "2026-03-%02d", "category": "Travel: Bus", "amount": 20}\n' % d
+                            for d in range(1, 21)))
+    bulk.importLogs(str(path))
+    # Batches of 6.3 kg: the fourth takes the month from 18.9 kg to 25.2
+    (alert,) = newAlerts(1)
+    assert alert[1:3] == ("2026-03-01", 25.2)
+
+
+# A budget and logs written through another connection, as by another
+# process, are picked up: the engine reads the user's rules and sums again
+def test_outside_writes_are_seen(dtb):
+    today = fmtDate(date.today())
+    addBudget(1, "day", 5)
+    trips(today, 1)
+    other = storage.openConn()
+    with other:
+        other.execute("INSERT INTO budgets (user_id, period, limit_kg) VALUES (1, 'week', 1)")
+        other.execute(
+            "INSERT INTO logs (user_id, log_date, category, amount, duration_hours, kg_co2) "
+            "VALUES (1, ?, 'Travel: Bus', 20, 0, 2.1)",
+            (today,),
+        )
+    other.close()
+    assert [round(b[6], 3) for b in listBudgets(1)] == [4.2, 4.2]
+    trips(today, 1)
+    assert [a[1:3] for a in newAlerts(1)] == [(today, 6.3)]
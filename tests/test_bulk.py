@@ -0,0 +1,95 @@
+import io
+import json
+
+import pytest
+
+import bench
+import bulk
+import storage
+from bulk import exportLogs, importLogs, readJsonArray
+from core import addLogs
+
+
+@pytest.mark.parametrize("ext", ["csv", "jsonl", "json"])
+def test_export_import_round_trip(newDtb, tmp_path, monkeypatch, ext):
+    newDtb("a.db")
+    bench.populate(1500, users=2, seed=9)
+    storage.userId("bench2")
+    addLogs([
+        (1, "2026-01-02", "Travel: Car", 4.5, 0.25, 'quotes " and, commas'),
+        (2, "2026-01-02", "Travel: Bus", 1.0, 0.0, "ünïcode ✓\nand a newline"),
+    ])
+    first = tmp_path / f"first.{ext}"
+    assert exportLogs(str(first))["rows"] == 1502
+
+    # Small chunks, so most records straddle a chunk boundary
+    monkeypatch.setattr(bulk, "JSON_CHUNK", 97)
+    newDtb("b.db")
+    report = importLogs(str(first))
+    assert (report["rows"], report["skipped"]) == (1502, 0)
+    assert [u[1] for u in storage.listUsers()] == ["default", "bench2"]
+    assert storage.verifyTotals() == []
+
+    second = tmp_path / f"second.{ext}"
+    exportLogs(str(second))
+    assert second.read_bytes() == first.read_bytes()
+
+
+def test_json_array_chunks(monkeypatch):
+    records = [{"n": i, "note": "x" * (i * 37 % 300), "nested": {"a": [i, "]", ","]}} for i in range(200)]
+    text = "[\n" + ",\n".join(json.dumps(r) for r in records) + "\n]\n"
+    for chunk in (1, 2, 7, 64, 1 << 16):
+        monkeypatch.setattr(bulk, "JSON_CHUNK", chunk)
+        got = list(readJsonArray(io.StringIO(text)))
+        assert [item for _, item in got] == records
+        assert [line for line, _ in got] == list(range(2, 202))
+
+
+def test_json_record_across_the_default_chunk():
+    big = {"note": "y" * (bulk.JSON_CHUNK + 10)}
+    text = json.dumps([{"n": 1}, big, {"n": 2}])
+    assert [item for _, item in readJsonArray(io.StringIO(text))] == [{"n": 1}, big, {"n": 2}]
+
+
+@pytest.mark.parametrize("text", ["[]", "  [ \n ]\n", "[\n]"])
+def test_empty_json_array(dtb, tmp_path, text):
+    assert list(readJsonArray(io.StringIO(text))) == []
+    path = tmp_path / "empty.json"
+    path.write_text(text)
+    assert importLogs(str(path))["rows"] == 0
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ('[{"n": 1},]', "invalid JSON record"),
+        ('[{"n": 1}, {"n": 2}', "not closed"),
+        ("[", "not closed"),
+        ('[{"n": 1} {"n": 2}]', "expected ','"),
+        ('{"n": 1}', "array of records"),
+        ("", "not closed"),
+    ],
+)
+def test_bad_json_arrays(monkeypatch, text, message):
+    for chunk in (1, 1 << 16):
+        monkeypatch.setattr(bulk, "JSON_CHUNK", chunk)
+        with pytest.raises(ValueError, match=message):
+            list(readJsonArray(io.StringIO(text)))
+
+
+def test_bad_row_creates_no_user(dtb, tmp_path):
+    path = tmp_path / "in.csv"
+    path.write_text(
+        "user,log_date,category,amount,duration_hours,note\n"
+        "newbie,2026-01-03,Travel: Rocket,5,0,\n"
+        "default,2026-01-03,Travel: Car,5,0,\n"
+        "other,2026-01-03,Travel: Bus,2,0.5,\n"
+    )
+    report = importLogs(str(path))
+    assert (report["rows"], report["skipped"]) == (2, 1)
+    assert report["errors"][0].startswith("line 2:")
+    assert [u[1] for u in storage.listUsers()] == ["default", "other"]
+
+    with pytest.raises(ValueError, match="line 2"):
+        importLogs(str(path), strict=True)
+    assert [u[1] for u in storage.listUsers()] == ["default", "other"]
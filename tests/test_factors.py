@@ -0,0 +1,37 @@
+import argparse
+import json
+from datetime import date, timedelta
+
+import bench
+import bulk
+import ecotrack
+import storage
+from core import fmtDate, streakShow
+from factors import loadFactors, recalcEmissions
+from test_bench import naiveStreak
+
+
+def test_recalc_skips_archived_logs(dtb, tmp_path, capsys):
+    bench.populate(1500, users=1, seed=6)
+    cutoff = fmtDate(date.today() - timedelta(days=200))
+    bulk.archiveLogs(cutoff)
+    since = fmtDate(date.today() - timedelta(days=300))
+    archived = sum(seg.countSince(since, ["Travel: Car"]) for seg in storage.archiveSegments())
+    assert archived > 0
+    live = storage.db().execute(
+        "SELECT COUNT(*) FROM logs WHERE deleted IS NULL AND category = 'Travel: Car' AND log_date >= ?", (since,)
+    ).fetchone()[0]
+
+    path = tmp_path / "factors.json"
+    path.write_text(json.dumps([{"category": "Travel: Car", "effective_from": since, "kg_per_unit": 0.5}]))
+    loadFactors(str(path))
+    args = argparse.Namespace(since=since, category=["Travel: Car"])
+    ecotrack.cmdRecalc(args)
+    out, err = capsys.readouterr()
+    assert out.startswith(f"Recalculated {live} logs")
+    assert f"Skipped {archived} archived logs" in err
+
+    # The archived days keep the totals their logs were archived with
+    assert storage.verifyTotals() == []
+    assert streakShow() == naiveStreak(1)
+    assert recalcEmissions(cutoff)["archived"] == 0
@@ -0,0 +1,88 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import bench
+import bulk
+from core import addLogs, deleteLogs, fmtDate
+from storage import HistoryPager, archiveSegments, db
+
+
+# The view's rows read from scratch, newest first, archived logs included
+def expected(user_id: int = None, day: str = None) -> list:
+    query = f"SELECT {HistoryPager.COLUMNS} FROM logs WHERE deleted IS NULL"
+    params = []
+    if user_id is not None:
+        query += " AND user_id = ?"
+        params.append(user_id)
+    if day:
+        query += " AND log_date = ?"
+        params.append(day)
+    rows = db().execute(query + " ORDER BY log_date DESC, id DESC", params).fetchall()
+    for seg in archiveSegments(user_id, day):
+        rows.extend(
+            (d, cat, amount, hrs, kg, note or "", log_id)
+            for u, d, cat, amount, hrs, kg, note, log_id in seg.export(user_id)
+            if day in (None, d)
+        )
+    return sorted(rows, key=lambda r: (r[0], r[6]), reverse=True)
+
+
+def check(pager, rng, user_id=None, day=None, reads: int = 12):
+    rows = expected(user_id, day)
+    assert pager.count == len(rows)
+    starts = [0, max(0, len(rows) - 30), len(rows)] + [rng.randrange(len(rows) + 1) for _ in range(reads)]
+    for first in starts:
+        n = rng.choice((1, 30, HistoryPager.PAGE + 7))
+        assert pager.rows(first, n) == rows[first:first + n]
+
+
+@pytest.fixture(params=[False, True], ids=["live", "archived"])
+def logs(request, dtb):
+    bench.populate(3000, users=2, seed=5)
+    if request.param:
+        bulk.archiveLogs(fmtDate(date.today() - timedelta(days=300)))
+        assert archiveSegments()
+    return dtb
+
+
+@pytest.mark.parametrize("user_id", [None, 1])
+def test_pages_match_a_fresh_query(logs, user_id):
+    check(HistoryPager(None, user_id), random.Random(1), user_id, reads=40)
+
+
+def test_one_day(logs):
+    day = fmtDate(date.today() - timedelta(days=400))
+    check(HistoryPager(day), random.Random(2), None, day)
+
+
+# Scroll around while logs are added and deleted, patching copies of the pager
+# the way the GUI's worker does, and compare with a fresh query after each step
+@pytest.mark.parametrize("user_id", [None, 2])
+def test_writes_mid_scroll(logs, user_id):
+    rng = random.Random(3)
+    pager = HistoryPager(None, user_id)
+    check(pager, rng, user_id)
+    for step in range(40):
+        cached = {k: list(rows) for k, rows in pager.pages.items()}
+        if rng.random() < 0.5:
+            owner = user_id or rng.choice((1, 2))
+            day_s = fmtDate(date.today() - timedelta(days=rng.randrange(500)))
+            logs_ = [(owner, day_s, "Travel: Bus", 3.0, 0.2, rng.choice((None, "mid scroll")))]
+            if rng.random() < 0.3:
+                logs_ = logs_ * rng.randrange(2, 6)
+            added = addLogs(logs_)
+            patched = pager.copy()
+            for (owner, day_s, cat, amount, hrs, note), (log_id, kg) in zip(logs_, added):
+                patched.insert((day_s, cat, amount, hrs, kg, note or "", log_id), owner)
+        else:
+            live = db().execute("SELECT id FROM logs WHERE deleted IS NULL").fetchall()
+            ids = [r[0] for r in rng.sample(live, rng.randrange(1, 8))]
+            patched = pager.copy()
+            for owner, row in deleteLogs(ids):
+                patched.remove(row, owner)
+        # Patching the copy leaves the pages of the one it was made from alone
+        assert {k: list(rows) for k, rows in pager.pages.items()} == cached
+        pager = patched
+        check(pager, rng, user_id)
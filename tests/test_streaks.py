@@ -0,0 +1,92 @@
+import random
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+import bench
+import core
+import storage
+from core import addLogs, fmtDate, removeLogs, streakFor, streakShow, undoLast
+from test_bench import naiveStreak
+
+
+@pytest.fixture
+def reloads(monkeypatch):
+    counted = []
+    reload = core.StreakEngine.reload
+
+    def counting(engine):
+        counted.append(engine.user_id)
+        reload(engine)
+
+    monkeypatch.setattr(core.StreakEngine, "reload", counting)
+    return counted
+
+
+def test_streak_follows_writes(dtb):
+    bench.populate(1200, users=2, seed=4)
+    rng = random.Random(4)
+    for step in range(60):
+        user_id = rng.choice((1, 2))
+        pick = rng.random()
+        if pick < 0.5:
+            day_s = fmtDate(date.today() - timedelta(days=rng.randrange(60)))
+            addLogs([(user_id, day_s, "Travel: Car", rng.choice((1.0, 40.0)), 0.0, None)])
+        elif pick < 0.8:
+            ids = [r[0] for r in storage.db().execute(
+                "SELECT id FROM logs WHERE user_id = ? AND deleted IS NULL ORDER BY log_date DESC LIMIT 30",
+                (user_id,),
+            )]
+            removeLogs(rng.sample(ids, 2))
+        else:
+            undoLast(user_id, redo=rng.random() < 0.5)
+        assert streakShow(user_id) == naiveStreak(user_id)
+
+
+# The server reads streaks on pooled connections while its writer thread
+# commits: none of it may read the days again
+def test_no_reloads_across_threads(dtb, reloads):
+    bench.populate(1200, users=1, seed=2)
+    expected = streakShow()
+    assert reloads == [1]
+
+    def read():
+        for _ in range(20):
+            with storage.borrowed():
+                assert streakShow() == expected
+
+    def write():
+        for _ in range(10):
+            addLogs([(1, "2001-01-01", "Travel: Bus", 1.0, 0.0, None)])
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert reloads == [1]
+    assert streakFor(1).days["2001-01-01"][0] == 10
+
+
+# A write the engine was not told about, like another process's, is picked up
+# on the next read
+def test_outside_write_reloads(dtb, reloads):
+    today = fmtDate(date.today())
+    addLogs([(1, today, "Travel: Bus", 1.0, 0.0, None)])
+    assert streakShow() == 1
+    other = storage.openConn()
+    with other:
+        other.execute(
+            "INSERT INTO logs (user_id, log_date, category, amount, duration_hours, kg_co2) "
+            "VALUES (1, ?, 'Travel: Car', 100, 0, 19.2)",
+            (today,),
+        )
+    other.close()
+    assert streakShow() == 0
+    assert reloads == [1, 1]
+    assert streakShow() == 0
+    assert reloads == [1, 1]
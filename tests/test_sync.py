@@ -0,0 +1,131 @@
+from datetime import date, timedelta
+
+import pytest
+
+import bulk
+import storage
+from core import addLogs, fmtDate, removeLogs, undoLast
+from sync import syncWith
+
+
+# Every log of the database in use, live and archived, as comparable tuples
+def allLogs() -> list:
+    conn = storage.db()
+    names = dict(conn.execute("SELECT id, name FROM users"))
+    rows = conn.execute(
+        "SELECT user_id, log_date, category, amount, duration_hours, kg_co2, note FROM logs WHERE deleted IS NULL"
+    ).fetchall()
+    for seg in storage.archiveSegments():
+        rows.extend(r[:7] for r in seg.export())
+    return sorted((names[r[0]],) + tuple(r[1:]) for r in rows)
+
+
+def logId(note: str) -> int:
+    return storage.db().execute("SELECT id FROM logs WHERE note = ?", (note,)).fetchone()[0]
+
+
+def isLive(note: str) -> bool:
+    return storage.db().execute("SELECT deleted IS NULL FROM logs WHERE note = ?", (note,)).fetchone()[0] == 1
+
+
+def test_two_way_sync(newDtb):
+    b = newDtb("b.db")
+    ann = storage.userId("ann")
+    addLogs([(1, "2026-05-01", "Travel: Car", 3.0, 0.1, "b1"), (ann, "2026-05-02", "Travel: Bus", 2.0, 0.0, "b2")])
+    a = newDtb("a.db")
+    addLogs([(1, "2026-05-01", "Travel: Bus", 1.0, 0.0, "a1")] * 3)
+
+    report = syncWith(b)
+    assert (report["pulled"]["added"], report["pushed"]["added"]) == (2, 3)
+    here = allLogs()
+    assert len(here) == 5 and storage.verifyTotals() == []
+    newDtb("b.db")
+    assert allLogs() == here and storage.verifyTotals() == []
+
+    # Nothing new: nothing moves
+    report = syncWith(a)
+    assert report["pulled"]["changes"] == report["pushed"]["changes"] == 0
+
+
+def test_delete_on_one_side(newDtb):
+    b = newDtb("b.db")
+    a = newDtb("a.db")
+    addLogs([(1, "2026-05-01", "Travel: Car", 3.0, 0.1, "x"), (1, "2026-05-01", "Travel: Car", 4.0, 0.1, "y")])
+    syncWith(b)
+    newDtb("b.db")
+    removeLogs([logId("x")])
+    syncWith(a)
+    assert not isLive("x") and isLive("y")
+    newDtb("a.db")
+    assert not isLive("x") and isLive("y")
+    assert storage.verifyTotals() == []
+    assert storage.dayTotal("2026-05-01", 1)[0] == 1
+
+
+# Both sides change the same log: a deletes it, b deletes it and undoes that.
+# The side whose change carries the later Lamport stamp wins, on both sides.
+@pytest.mark.parametrize("later", ["a", "b"])
+def test_later_change_wins(newDtb, later):
+    b = newDtb("b.db")
+    a = newDtb("a.db")
+    addLogs([(1, "2026-05-01", "Travel: Car", 3.0, 0.1, "x")])
+    syncWith(b)
+
+    if later == "a":
+        addLogs([(1, "2026-05-03", "Travel: Bus", 1.0, 0.0, None)] * 5)  # moves a's clock on
+    removeLogs([logId("x")])
+    newDtb("b.db")
+    if later == "b":
+        addLogs([(1, "2026-05-03", "Travel: Bus", 1.0, 0.0, None)] * 5)
+    removeLogs([logId("x")])
+    undoLast(1)
+    assert isLive("x")
+
+    syncWith(a)
+    expect = later == "b"
+    assert isLive("x") == expect
+    newDtb("a.db")
+    assert isLive("x") == expect
+    assert storage.verifyTotals() == []
+    newDtb("b.db")
+    assert storage.verifyTotals() == []
+
+
+def test_archived_logs_sync(newDtb):
+    b = newDtb("b.db")
+    newDtb("a.db")
+    old = fmtDate(date.today() - timedelta(days=900))
+    addLogs([(1, old, "Travel: Car", 3.0, 0.1, "old")] * 4 + [(1, fmtDate(date.today()), "Travel: Bus", 1.0, 0.0, "new")])
+    assert bulk.archiveLogs()["rows"] == 4
+    syncWith(b)
+    here = allLogs()
+    newDtb("b.db")
+    assert allLogs() == here and len(here) == 5
+
+
+# Logs archived before the change stream existed (schema 9) are put into it by
+# migration 14, and so reach the other side
+def test_logs_archived_before_migration_10(newDtb, monkeypatch):
+    b = newDtb("b.db")
+    migrations = storage.MIGRATIONS
+    monkeypatch.setattr(storage, "MIGRATIONS", migrations[:9])
+    newDtb("a.db")
+    old = fmtDate(date.today() - timedelta(days=900))
+    with storage.db() as conn:
+        conn.executemany(
+            "INSERT INTO logs (user_id, log_date, category, amount, duration_hours, kg_co2, note) "
+            "VALUES (1, ?, 'Travel: Car', ?, 0, ?, ?)",
+            [(old, n, round(n * 0.192, 3), f"old {n}") for n in range(1, 6)]
+            + [(fmtDate(date.today()), 1, 0.192, "live")],
+        )
+    assert storage.archiveChunk(storage.db(), fmtDate(date.today()))[1] == 5
+    monkeypatch.setattr(storage, "MIGRATIONS", migrations)
+
+    newDtb("a.db")
+    assert storage.db().execute("SELECT COUNT(*) FROM changes").fetchone()[0] == 6
+    report = syncWith(b)
+    assert report["pushed"]["added"] == 6
+    here = allLogs()
+    newDtb("b.db")
+    assert allLogs() == here and len(here) == 6
+    assert storage.verifyTotals() == []
@@ -0,0 +1,122 @@
+import json
+import math
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import bulk
+import tracks
+from core import undoLast
+from tracks import importTracks, readGeoJson, readGpx, tripOf
+
+START = datetime(2026, 4, 1, 8, 0, tzinfo=timezone.utc)
+STEP = 10  # seconds between points
+
+
+# A track heading north from 50°N 10°E, one point every STEP seconds, moving
+# at each of the given speeds (km/h) in turn
+def track(speeds) -> tuple:
+    lats, lons, times = [50.0], [10.0], [START]
+    for kmh in speeds:
+        km = kmh * STEP / 3600
+        lats.append(lats[-1] + math.degrees(km / tracks.EARTH_KM))
+        lons.append(10.0)
+        times.append(times[-1] + timedelta(seconds=STEP))
+    return lats, lons, [t.strftime("%Y-%m-%dT%H:%M:%SZ") for t in times]
+
+
+TRAIN = [60] * 30 + [160] * 120 + [60] * 30
+BUS = ([25] * 12 + [0] * 6) * 10
+CAR = [55] * 90
+
+
+@pytest.fixture(params=["numpy", "pure"])
+def numpy(request, monkeypatch):
+    if request.param == "pure":
+        monkeypatch.setattr(tracks, "numpyOrNone", lambda: None)
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "speeds, category",
+    [(TRAIN, "Travel: Metro/Train"), (BUS, "Travel: Bus"), (CAR, "Travel: Car")],
+)
+def test_trip_of_synthetic_tracks(numpy, speeds, category):
+    day_s, cat, km, hours = tripOf(*track(speeds))
+    assert (day_s, cat) == (START.astimezone().date().isoformat(), category)
+    assert km == pytest.approx(sum(speeds) * STEP / 3600, abs=1e-3)
+    assert hours == round(len(speeds) * STEP / 3600, 3)
+    # A named category is taken as given
+    assert tripOf(*track(speeds), category="Travel: Motorcycle")[1] == "Travel: Motorcycle"
+
+
+def test_trip_of_bad_tracks(numpy):
+    lats, lons, times = track(CAR)
+    with pytest.raises(ValueError, match="no point times"):
+        tripOf(lats, lons, [None] * len(times))
+    with pytest.raises(ValueError, match="never moves"):
+        tripOf(*track([0] * 20))
+
+
+def geoJson(*named, features_first: bool = True) -> str:
+    features = [
+        {
+            "type": "Feature",
+            "properties": {"name": name, "coordTimes": times},
+            "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat, lon in zip(lats, lons)]},
+        }
+        for name, (lats, lons, times) in named
+    ]
+    features.insert(1, {"type": "Feature", "properties": {}, "geometry": {"type": "Point", "coordinates": [1, 2]}})
+    members = [("features", features), ("type", "FeatureCollection"), ("name", "day out")]
+    return json.dumps(dict(members if features_first else members[::-1]), indent=1)
+
+
+def gpx(*named) -> str:
+    trks = "".join(
+        f"<trk><name>{name}</name><trkseg>"
+        + "".join(f'<trkpt lat="{lat!r}" lon="{lon!r}"><time>{t}</time></trkpt>' for lat, lon, t in zip(*points))
+        + "</trkseg></trk>"
+        for name, points in named
+    )
+    return f'<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1">{trks}</gpx>'
+
+
+@pytest.mark.parametrize("features_first", [True, False])
+def test_geojson_streams_like_gpx(tmp_path, monkeypatch, features_first):
+    named = [("train", track(TRAIN)), ("bus", track(BUS)), ("car", track(CAR))]
+    (tmp_path / "a.gpx").write_text(gpx(*named))
+    (tmp_path / "a.geojson").write_text(geoJson(*named, features_first=features_first))
+    monkeypatch.setattr(bulk, "JSON_CHUNK", 101)  # features straddle many chunks
+    from_gpx = [(name, lats, lons, times) for name, lats, lons, times in readGpx(str(tmp_path / "a.gpx"))]
+    assert [t[0] for t in from_gpx] == ["train", "bus", "car"]
+    assert list(readGeoJson(str(tmp_path / "a.geojson"))) == from_gpx
+
+
+def test_single_feature_and_bad_files(tmp_path):
+    lats, lons, times = track(CAR)
+    feature = {
+        "type": "Feature",
+        "properties": {"coordTimes": [times[:40], times[40:]]},
+        "geometry": {"type": "MultiLineString", "coordinates": [
+            [[lon, lat] for lat, lon in zip(lats[:40], lons[:40])],
+            [[lon, lat] for lat, lon in zip(lats[40:], lons[40:])],
+        ]},
+    }
+    (tmp_path / "one.geojson").write_text(json.dumps(feature))
+    assert list(readGeoJson(str(tmp_path / "one.geojson"))) == [(None, lats, lons, times)]
+
+    (tmp_path / "cut.geojson").write_text(geoJson(("car", track(CAR)))[:-200])
+    with pytest.raises(ValueError):
+        list(readGeoJson(str(tmp_path / "cut.geojson")))
+
+
+def test_import_tracks(dtb, tmp_path):
+    (tmp_path / "a.gpx").write_text(gpx(("train", track(TRAIN)), ("bus", track(BUS))))
+    (tmp_path / "b.geojson").write_text(geoJson(("car", track(CAR))))
+    (tmp_path / "c.geojson").write_text('{"type": "FeatureCollection", "features": [')
+    report = importTracks([str(tmp_path)])
+    assert (report["trips"], report["skipped"]) == (3, 1)
+    assert report["categories"] == {"Travel: Metro/Train": 1, "Travel: Bus": 1, "Travel: Car": 1}
+    assert report["errors"][0].startswith(str(tmp_path / "c.geojson"))
+    assert undoLast() == ("add", 3)
@@ -0,0 +1,49 @@
+import bulk
+import storage
+from core import addLogs, redoLast, removeLogs, streakShow, undoLast
+from test_bench import naiveStreak
+
+
+def liveCount(user_id: int) -> int:
+    return storage.db().execute(
+        "SELECT COUNT(*) FROM logs WHERE user_id = ? AND deleted IS NULL", (user_id,)
+    ).fetchone()[0]
+
+
+def test_import_is_one_undo_step(dtb, tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, "BATCH", 40)  # the file spans several batches
+    addLogs([(1, "2026-01-01", "Travel: Car", 5.0, 0.0, "before")])
+    path = tmp_path / "in.csv"
+    path.write_text(
+        "log_date,category,amount,duration_hours,note\n"
+        + "".join(f"2026-02-{d % 28 + 1:02d},Travel: Bus,{d % 7 + 1},0.5,row {d}\n" for d in range(300))
+    )
+    assert bulk.importLogs(str(path))["rows"] == 300
+    assert liveCount(1) == 301
+
+    assert undoLast(1) == ("add", 300)
+    assert liveCount(1) == 1
+    assert storage.verifyTotals() == []
+    assert streakShow(1) == naiveStreak(1)
+
+    assert redoLast(1) == ("add", 300)
+    assert liveCount(1) == 301
+    assert storage.verifyTotals() == []
+    assert streakShow(1) == naiveStreak(1)
+
+    # The log added before the import is the next step back
+    assert undoLast(1) == ("add", 300)
+    assert undoLast(1) == ("add", 1)
+    assert liveCount(1) == 0
+    assert undoLast(1) is None
+
+
+def test_undo_delete(dtb):
+    ids = [log_id for log_id, _ in addLogs([(1, "2026-03-01", "Travel: Car", 5.0, 0.0, None)] * 3)]
+    assert removeLogs(ids[:2]) == ids[:2]
+    assert liveCount(1) == 1
+    assert undoLast(1) == ("delete", 2)
+    assert liveCount(1) == 3
+    assert redoLast(1) == ("delete", 2)
+    assert liveCount(1) == 1
+    assert storage.verifyTotals() == []
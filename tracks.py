@@ -0,0 +1,300 @@
+import os
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+from storage import DEFAULT_USER, db
+from core import checkLog, fmtDate, numpyOrNone
+from bulk import BATCH, MAX_ERRORS, JsonError, JsonStream, flush
+
+# Mean Earth radius for the haversine distance
+EARTH_KM = 6371.0088
+
+# Below this speed a stretch of track counts as standing still
+STOP_KMH = 2.0
+
+# Speed profile rules for guessing a trip's category, tried in order: a trip
+# whose 95th percentile moving speed reaches min_p95, or that stands still for
+# at least min_stopped of its time while its median moving speed stays under
+# max_median, gets the category. Anything else is a car trip. Motorcycles move
+# like cars, so they are never guessed; name the category for those.
+SPEED_RULES = (
+    ("Travel: Metro/Train", {"min_p95": 140.0}),
+    ("Travel: Bus", {"min_stopped": 0.25, "max_median": 35.0}),
+)
+DEFAULT_CATEGORY = "Travel: Car"
+
+# File extensions importTracks reads, and what they hold
+FORMATS = {".gpx": "gpx", ".geojson": "geojson", ".json": "geojson"}
+
+
+# Work out the track format from the file's extension
+def trackFormat(path: str) -> str:
+    fmt = FORMATS.get(os.path.splitext(path.lower())[1])
+    if fmt is None:
+        raise ValueError(f"Unknown track file type for {path} (use .gpx or .geojson)")
+    return fmt
+
+
+# The track files at the given paths, a directory standing for its track files
+def trackFiles(paths) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, names in sorted(os.walk(path)):
+                files += [os.path.join(folder, n) for n in sorted(names) if os.path.splitext(n.lower())[1] in FORMATS]
+        else:
+            trackFormat(path)
+            files.append(path)
+    return files
+
+
+# Yield (name, lats, lons, times) for each <trk> of a GPX file. The file is
+# parsed as a stream and each point, track or other top-level element is
+# removed from the tree once read, so a long recording never sits in memory.
+def readGpx(path: str):
+    lats, lons, times = [], [], []
+    parents = [None]  # open elements, so a finished one can leave its parent
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        tag = elem.tag
+        if tag.endswith("trkpt"):
+            lats.append(float(elem.get("lat")))
+            lons.append(float(elem.get("lon")))
+            times.append(elem.findtext(tag[:-5] + "time"))
+        elif tag.endswith("trk"):
+            if lats:
+                yield elem.findtext(tag[:-3] + "name"), lats, lons, times
+            lats, lons, times = [], [], []
+        elif len(parents) != 2:
+            continue  # still needed by the element it sits in (a point's time, a track's name)
+        if parents[-1] is not None:
+            parents[-1].remove(elem)
+
+
+# The features of a GeoJSON text: a FeatureCollection's "features" array is
+# decoded one feature at a time as the file is read, and its other members
+# (small ones: "type", "name", "crs") whole. A text without one is a single
+# feature itself.
+def geoFeatures(stream: JsonStream):
+    if stream.take() != "{":
+        raise JsonError("A GeoJSON file must hold an object.")
+    members, collection = {}, False
+    c = "," if stream.peek() != "}" else stream.take()
+    while c == ",":
+        key = stream.decode()
+        if stream.take() != ":":
+            raise JsonError(f"line {stream.line}: expected ':' after a member name")
+        if key == "features" and stream.peek() == "[":
+            collection = True
+            for _, feature in stream.items():
+                yield feature
+        else:
+            members[key] = stream.decode()
+        c = stream.take()
+    if c != "}":
+        raise JsonError(f"line {stream.line}: expected ',' or '}}' after a member")
+    if not collection:
+        yield members
+
+
+# Yield (name, lats, lons, times) for each LineString or MultiLineString
+# feature of a GeoJSON file, read as a stream like GPX files are. Point times
+# come from the feature's "coordTimes" (or "times") property, as written by
+# the usual GPX converters.
+def readGeoJson(path: str):
+    with open(path, encoding="utf-8") as f:
+        for feature in geoFeatures(JsonStream(f)):
+            track = featureTrack(feature)
+            if track is not None:
+                yield track
+
+
+# (name, lats, lons, times) of one GeoJSON feature, None if it has no line points
+def featureTrack(feature: dict):
+    geometry = feature.get("geometry") or {}
+    props = feature.get("properties") or {}
+    lines = geometry.get("coordinates") or []
+    times = props.get("coordTimes", props.get("times"))
+    if geometry.get("type") == "LineString":
+        lines, times = [lines], [times]
+    elif geometry.get("type") != "MultiLineString":
+        return None
+    if not isinstance(times, list) or len(times) != len(lines) or not all(isinstance(t, list) for t in times):
+        times = [None] * len(lines)
+
+    lats, lons, stamps = [], [], []
+    for line, line_times in zip(lines, times):
+        lats += [point[1] for point in line]
+        lons += [point[0] for point in line]
+        stamps += line_times if line_times and len(line_times) == len(line) else [None] * len(line)
+    return (props.get("name"), lats, lons, stamps) if lats else None
+
+
+def readTracks(path: str):
+    return readGpx(path) if trackFormat(path) == "gpx" else readGeoJson(path)
+
+
+# Seconds since the epoch for ISO 8601 point times (None where a point has
+# none). UTC times ("...Z"), the usual case, are parsed by NumPy in one go.
+def pointSeconds(times):
+    np = numpyOrNone()
+    if np is not None and all(t is not None and t.endswith("Z") for t in times):
+        stamps = np.array([t[:-1] for t in times], dtype="datetime64[ms]")
+        return stamps.astype(np.int64) / 1000.0
+    out = [None if t is None else datetime.fromisoformat(t.replace("Z", "+00:00")).timestamp() for t in times]
+    return np.array(out, dtype=float) if np is not None else out
+
+
+# Kilometres and seconds of each stretch between consecutive points. With
+# NumPy the haversine runs over the whole track at once.
+def stretches(lats, lons, seconds):
+    np = numpyOrNone()
+    if np is not None:
+        lat = np.radians(np.asarray(lats, dtype=float))
+        lon = np.radians(np.asarray(lons, dtype=float))
+        a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+        km = 2 * EARTH_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        return km, np.diff(seconds)
+
+    from math import asin, cos, radians, sin, sqrt
+
+    km, secs = [], []
+    for i in range(1, len(lats)):
+        p1, p2 = radians(lats[i - 1]), radians(lats[i])
+        a = sin((p2 - p1) / 2) ** 2 + cos(p1) * cos(p2) * sin(radians(lons[i] - lons[i - 1]) / 2) ** 2
+        km.append(2 * EARTH_KM * asin(sqrt(min(a, 1.0))))
+        t1, t2 = seconds[i - 1], seconds[i]
+        secs.append(None if t1 is None or t2 is None else t2 - t1)
+    return km, secs
+
+
+# (median, 95th percentile) of a trip's moving speeds in km/h and the share
+# of its time spent standing still; None when the track has no usable times
+def speedProfile(km, secs):
+    np = numpyOrNone()
+    if np is not None:
+        timed = np.nan_to_num(secs, nan=0.0) > 0
+        km, secs = km[timed], secs[timed]
+        if not len(secs):
+            return None
+        speeds = km / secs * 3600
+        moving = speeds >= STOP_KMH
+        if not moving.any():
+            return None
+        median, p95 = np.percentile(speeds[moving], [50, 95])
+        return float(median), float(p95), float(secs[~moving].sum() / secs.sum())
+
+    timed = [(k, s) for k, s in zip(km, secs) if s is not None and s > 0]
+    moving = sorted(k / s * 3600 for k, s in timed if k / s * 3600 >= STOP_KMH)
+    if not moving:
+        return None
+    stopped = sum(s for k, s in timed if k / s * 3600 < STOP_KMH) / sum(s for _, s in timed)
+    return moving[len(moving) // 2], moving[min(len(moving) - 1, int(0.95 * len(moving)))], stopped
+
+
+# Guess a trip's category from its speed profile (see SPEED_RULES); None when
+# the track has no usable times
+def inferCategory(km, secs):
+    profile = speedProfile(km, secs)
+    if profile is None:
+        return None
+    median, p95, stopped = profile
+    for category, rule in SPEED_RULES:
+        if "min_p95" in rule and p95 >= rule["min_p95"]:
+            return category
+        if "min_stopped" in rule and stopped >= rule["min_stopped"] and median < rule["max_median"]:
+            return category
+    return DEFAULT_CATEGORY
+
+
+# One track as (log_date, category, km, hours): date of its first timed point
+# (local time), total distance and first-to-last point time. The category is
+# the given one, else guessed from the speeds.
+def tripOf(lats, lons, times, category: str = None) -> tuple:
+    np = numpyOrNone()
+    seconds = pointSeconds(times)
+    km, secs = stretches(lats, lons, seconds)
+    if np is not None:
+        timed = seconds[~np.isnan(seconds)]
+        first, last = (float(timed[0]), float(timed[-1])) if len(timed) else (None, None)
+        distance = float(km.sum())
+    else:
+        timed = [s for s in seconds if s is not None]
+        first, last = (timed[0], timed[-1]) if timed else (None, None)
+        distance = sum(km)
+    if first is None:
+        raise ValueError("track has no point times")
+    if category is None:
+        category = inferCategory(km, secs)
+        if category is None:
+            raise ValueError("track never moves, so its category cannot be guessed; name one")
+    day_s = fmtDate(datetime.fromtimestamp(first).date())
+    return day_s, category, round(distance, 3), round((last - first) / 3600, 3)
+
+
+# The first trip in a track file, as tripOf gives it (the Add form's "From track")
+def firstTrip(path: str, category: str = None) -> tuple:
+    for _, lats, lons, times in readTracks(path):
+        return tripOf(lats, lons, times, category)
+    raise ValueError(f"{path} has no track points")
+
+
+# Log every track in GPX/GeoJSON files (directories are searched for them) as
+# one trip each, in BATCH-sized transactions like importLogs. Without a
+# category, each trip's is guessed from its speed profile. Bad tracks are
+# skipped and reported, unless strict is set. The whole import is one undo step.
+def importTracks(paths, category: str = None, user_id: int = DEFAULT_USER, strict: bool = False) -> dict:
+    conn = db()
+    started = time.perf_counter()
+    rows, errors, categories, journal = [], [], {}, {}
+    added = skipped = points = 0
+    km_total = 0.0
+
+    for path in trackFiles(paths):
+        try:
+            for number, (name, lats, lons, times) in enumerate(readTracks(path), start=1):
+                try:
+                    day_s, cat, km, hours = tripOf(lats, lons, times, category)
+                    day_s, cat, km, hours = checkLog(day_s, cat, km, hours)
+                except (ValueError, TypeError, KeyError) as e:
+                    if strict:
+                        raise ValueError(f"{path} track {number}: {e}")
+                    skipped += 1
+                    if len(errors) < MAX_ERRORS:
+                        errors.append(f"{path} track {number}: {e}")
+                    continue
+                note = name or os.path.basename(path)
+                rows.append((user_id, day_s, cat, km, hours, note))
+                categories[cat] = categories.get(cat, 0) + 1
+                points += len(lats)
+                km_total += km
+                if len(rows) >= BATCH:
+                    flush(conn, rows, journal)
+                    added += len(rows)
+                    rows = []
+        except (ET.ParseError, JsonError, AttributeError, KeyError) as e:
+            if strict:
+                raise ValueError(f"{path}: {e}")
+            skipped += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(f"{path}: {e}")
+
+    if rows:
+        flush(conn, rows, journal)
+        added += len(rows)
+
+    seconds = time.perf_counter() - started
+    return {
+        "trips": added,
+        "skipped": skipped,
+        "points": points,
+        "km": round(km_total, 3),
+        "categories": categories,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "points_per_sec": round(points / seconds) if seconds > 0 else 0,
+    }
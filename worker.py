@@ -0,0 +1,86 @@
+import itertools
+import queue
+import threading
+from collections import OrderedDict
+
+from profiling import span
+
+
+# Runs database calls on one background thread and hands the results back to
+# the Tk main loop through after() polling, so the UI never waits on SQLite.
+#
+# Jobs submitted with the same key are coalesced: a job still waiting in the
+# queue is replaced by the newer one, and a result is dropped if a newer job
+# with its key is already waiting. Ten quick Refresh clicks run one query
+# (two at most, if one was already running).
+class DataWorker:
+    def __init__(self, root, poll_ms: int = 15, on_error=None):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.on_error = on_error  # fallback for jobs submitted without failed=
+
+        self.pending = OrderedDict()  # key -> (fn, args, done, failed)
+        self.cond = threading.Condition()
+        self.results = queue.Queue()
+        self.outstanding = 0  # jobs submitted whose callbacks have not run yet
+        self.polling = False
+        self.ids = itertools.count()
+
+        self.thread = threading.Thread(target=self.run, name="ecotrack-db", daemon=True)
+        self.thread.start()
+
+    # Queue fn(*args) on the worker; done(result) / failed(error) run on the Tk thread
+    def submit(self, fn, *args, key=None, done=None, failed=None):
+        if key is None:
+            key = ("job", next(self.ids))  # writes and other one-off jobs never coalesce
+        with self.cond:
+            if key in self.pending:
+                self.pending.pop(key)
+            else:
+                self.outstanding += 1
+            # A replaced job moves to the back so it still runs after earlier writes
+            self.pending[key] = (fn, args, done, failed)
+            self.cond.notify()
+        self.startPolling()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                key, (fn, args, done, failed) = self.pending.popitem(last=False)
+            try:
+                with span(getattr(fn, "__qualname__", repr(fn)), "job"):
+                    result = fn(*args)
+                self.results.put((key, done, result, None, failed))
+            except Exception as e:
+                self.results.put((key, done, None, e, failed))
+
+    def startPolling(self):
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_ms, self.poll)
+
+    # Deliver finished jobs on the Tk thread, polling only while work is outstanding
+    def poll(self):
+        while True:
+            try:
+                key, done, result, error, failed = self.results.get_nowait()
+            except queue.Empty:
+                break
+            with self.cond:
+                self.outstanding -= 1
+                stale = key in self.pending
+            if error is not None:
+                handler = failed or self.on_error
+                if handler is not None:
+                    handler(error)
+            elif done is not None and not stale:
+                done(result)
+
+        with self.cond:
+            busy = self.outstanding > 0
+        if busy:
+            self.root.after(self.poll_ms, self.poll)
+        else:
+            self.polling = False